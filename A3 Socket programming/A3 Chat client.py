@@ -1,372 +1,1341 @@
-
-from socket import *
-
-
-# --------------------
-# Constants
-# --------------------
-# The states that the application can be in
-states = [
-    "disconnected",  # Connection to a chat server is not established
-    "connected",  # Connected to a chat server, but not authorized (not logged in)
-    "authorized"  # Connected and authorized (logged in)
-]
-TCP_PORT = 1300  # TCP port used for communication
-SERVER_HOST = "datakomm.work"  # Set this to either hostname (domain) or IP address of the chat server
-
-# --------------------
-# State variables
-# --------------------
-current_state = "disconnected"  # The current state of the system
-# When this variable will be set to false, the application will stop
-must_run = True
-# Use this variable to create socket connection to the chat server
-# Note: the "type: socket" is a hint to PyCharm about the type of values we will assign to the variable
-client_socket = None  # type: socket
-
-
-def quit_application():
-    """ Update the application state so that the main-loop will exit """
-    # Make sure we reference the global variable here. Not the best code style,
-    # but the easiest to work with without involving object-oriented code
-    global must_run
-    must_run = False
-
-
-def send_command(command, arguments):
-    """
-    Send one command to the chat server.
-    :param command: The command to send (login, sync, msg, ...(
-    :param arguments: The arguments for the command as a string, or None if no arguments are needed
-        (username, message text, etc)
-    :return:
-    """
-    global client_socket
-
-    try:
-        client_socket.send((command + " " + arguments + "\n").encode())
-        return True
-    except IOError as e:
-        print("Error happened: ", e)
-        return False
-
-
-def read_one_line(sock):
-    """
-    Read one line of text from a socket
-    :param sock: The socket to read from.
-    :return:
-    """
-    newline_received = False
-    message = ""
-    while not newline_received:
-        character = sock.recv(1).decode()
-        if character == '\n':
-            newline_received = True
-        elif character == '\r':
-            pass
-        else:
-            message += character
-    return message
-
-
-def get_servers_response():
-    """
-    Wait until a response command is received from the server
-    :return: The response of the server, the whole line as a single string
-    """
-    global client_socket
-
-    try:
-        server_answer = read_one_line(client_socket)
-        return server_answer
-    except IOError as e:
-        print("Error happened: ", e)
-        return False
-
-
-def connect_to_server():
-    # Must have these two lines, otherwise the function will not "see" the global variables that we will change here
-    global client_socket
-    global current_state
-
-    client_socket = socket(AF_INET, SOCK_STREAM)
-
-    try:
-        client_socket.connect((SERVER_HOST, TCP_PORT))
-        current_state = "connected"
-        send_command("sync", "")
-        server_response = get_servers_response()
-        if server_response == "modeok":
-            print("Success. modeok recieved")
-        else:
-            print("Error. Message not returned as expected. Returned: ", server_response)
-        return True
-    except IOError as e:
-        print("Error happened:", e)
-        return False
-
-
-def disconnect_from_server():
-
-    global client_socket
-    global current_state
-    try:
-        client_socket.close()
-        current_state = "disconnected"
-        return True
-    except IOError as e:
-        print("error happened", e)
-        return False
-
-
-def login():
-    global current_state
-    global client_socket
-
-    try:
-        username = input("Enter username: ")
-        send_command("login", username)
-        server_response = read_one_line(client_socket)
-        if server_response == "loginok":
-            print("Login successful. Logged inn as: ", username)
-            current_state = "authorized"
-            return True
-        if server_response == "loginerr incorrect username format":
-            print("Error. Username can only consist of alphanumeric characters: letters and digits. Try again")
-            return False
-        else:
-            print("Error. Message not returned as expected. Returned: ", server_response)
-            return False
-
-    except IOError as e:
-            print("Error happened: ", e)
-            return False
-
-
-def public_message():
-    global client_socket
-
-    try:
-        message = input("Write the message you wish to send: ")
-        send_command("msg", message)
-        server_response = read_one_line(client_socket)
-        server_response_splitted = server_response.split(" ")
-        if server_response_splitted[0] == "msgok":
-            print("Success. Message sent.")
-            return True
-        else:
-            print("Error. Message not sent. Try again")
-            return False
-
-    except IOError as e:
-        print("Error! Not a valid username input. Start over.")
-        return False
-
-
-def get_user_list():
-    global client_socket
-    # protocol for users list: users\n
-    try:
-        send_command("users", "")
-        string_users = read_one_line(client_socket)
-        users_list = string_users.split(" ")
-        # removing "users" at the start of the list
-        del(users_list[0])
-        print("Success. Received list of users: ", users_list)
-
-    except IOError as e:
-        print("Error happened: ", e)
-        return False
-
-
-def private_message():
-    global client_socket
-
-    try:
-        recipient = input("Enter username of recipient: ")
-        message = input("Enter message to be sent: ")
-        recipient_and_message = recipient + " " + message
-        send_command("privmsg", recipient_and_message)
-        server_response = read_one_line(client_socket)
-        server_response_splitted = server_response.split(" ")
-        if server_response_splitted[0] == "msgok":
-            if server_response_splitted[1] == "1":
-                print("Success. Message sent")
-                return True
-            else:
-                string_server_response = str(server_response_splitted[1])
-                print("Success, but message was sent to %i recipients!" % string_server_response)
-                return True
-        elif server_response_splitted[0] == "msgerr":
-            print("Error. Wrong recipient. Can't send to Anonymous users. Tried to send to: ", recipient)
-            return False
-        else:
-            print("Error. Message was not sent. Server response: ", server_response)
-            return False
-
-    except IOError as e:
-        print("Error happened: ", e)
-        return False
-
-
-def inbox():
-    global client_socket
-
-    try:
-        send_command("inbox", "")
-        server_answer = read_one_line(client_socket)
-        server_answer_splitt = server_answer.split(" ")
-        if server_answer_splitt[1] == "0":
-            print("No new messages in inbox.")
-            return True
-        else:
-            print("Your inbox has %i new messages." % int(server_answer_splitt[1]))
-            for i in range(1, int(server_answer_splitt[1]) + 1):
-                inbox_content = read_one_line(client_socket)
-                inbox_content_splitted = inbox_content.split(" ")
-                sender = inbox_content_splitted[1]
-                del(inbox_content_splitted[0:2])
-                messages = " "
-                message = messages.join(inbox_content_splitted)
-                print("Message %i is from " % i + sender + " and reads: " + message)
-            return True
-
-    except IOError as e:
-        print("Error happened: ", e)
-        return False
-
-
-"""
-The list of available actions that the user can perform
-Each action is a dictionary with the following fields:
-description: a textual description of the action
-valid_states: a list specifying in which states this action is available
-function: a function to call when the user chooses this particular action. The functions must be defined before
-            the definition of this variable
-"""
-available_actions = [
-    {
-        "description": "Connect to a chat server",
-        "valid_states": ["disconnected"],
-        "function": connect_to_server
-    },
-    {
-        "description": "Disconnect from the server",
-        "valid_states": ["connected", "authorized"],
-        "function": disconnect_from_server
-    },
-    {
-        "description": "Authorize (log in)",
-        "valid_states": ["connected", "authorized"],
-        "function": login
-    },
-    {
-        "description": "Send a public message",
-        "valid_states": ["connected", "authorized"],
-        "function": public_message
-    },
-    {
-        "description": "Send a private message",
-        "valid_states": ["authorized"],
-        "function": private_message
-    },
-    {
-        "description": "Read messages in the inbox",
-        "valid_states": ["connected", "authorized"],
-        "function": inbox
-    },
-    {
-        "description": "See list of users",
-        "valid_states": ["connected", "authorized"],
-        "function": get_user_list
-    },
-    {
-        "description": "Get a joke",
-        "valid_states": ["connected", "authorized"],
-        # TODO - optional step - implement the joke fetching from the server.
-        # Hint: this part is not described in the protocol. But the command is simple. Try to find
-        # out how it works ;)
-        "function": None
-    },
-    {
-        "description": "Quit the application",
-        "valid_states": ["disconnected", "connected", "authorized"],
-        "function": quit_application
-    },
-]
-
-
-def run_chat_client():
-    """ Run the chat client application loop. When this function exists, the application will stop """
-
-    while must_run:
-        print_menu()
-        action = select_user_action()
-        perform_user_action(action)
-    print("Thanks for watching. Like and subscribe! 👍")
-
-
-def print_menu():
-    """ Print the menu showing the available options """
-    print("==============================================")
-    print("What do you want to do now? ")
-    print("==============================================")
-    print("Available options:")
-    i = 1
-    for a in available_actions:
-        if current_state in a["valid_states"]:
-            # Only hint about the action if the current state allows it
-            print("  %i) %s" % (i, a["description"]))
-        i += 1
-    print()
-
-
-def select_user_action():
-    """
-    Ask the user to choose and action by entering the index of the action
-    :return: The action as an index in available_actions array or None if the input was invalid
-    """
-    number_of_actions = len(available_actions)
-    hint = "Enter the number of your choice (1..%i):" % number_of_actions
-    choice = input(hint)
-    # Try to convert the input to an integer
-    try:
-        choice_int = int(choice)
-    except ValueError:
-        choice_int = -1
-
-    if 1 <= choice_int <= number_of_actions:
-        action = choice_int - 1
-    else:
-        action = None
-
-    return action
-
-
-def perform_user_action(action_index):
-    """
-    Perform the desired user action
-    :param action_index: The index in available_actions array - the action to take
-    :return: Desired state change as a string, None if no state change is needed
-    """
-    if action_index is not None:
-        print()
-        action = available_actions[action_index]
-        if current_state in action["valid_states"]:
-            function_to_run = available_actions[action_index]["function"]
-            if function_to_run is not None:
-                function_to_run()
-            else:
-                print("Internal error: NOT IMPLEMENTED (no function assigned for the action)!")
-        else:
-            print("This function is not allowed in the current system state (%s)" % current_state)
-    else:
-        print("Invalid input, please choose a valid action")
-    print()
-    return None
-
-# Entrypoint for the application. In PyCharm you should see a green arrow on the left side.
-# By clicking it you run the application.
-if __name__ == '__main__':
-    run_chat_client()
\ No newline at end of file
+
+from socket import *
+from collections import deque, namedtuple
+import queue
+import threading
+import time
+import profiling
+from connection_manager import ConnectionManager, READ_TIMEOUT
+from line_reader import LineReader
+from metrics import default_registry
+from send_buffer import SendBuffer
+from traffic_log import open_recorder, REQUEST_LINE, RESPONSE_LINE
+
+
+# --------------------
+# Constants
+# --------------------
+# The states that the application can be in
+states = [
+    "disconnected",  # Connection to a chat server is not established
+    "connected",  # Connected to a chat server, but not authorized (not logged in)
+    "authorized"  # Connected and authorized (logged in)
+]
+TCP_PORT = 1300  # TCP port used for communication
+SERVER_HOST = "datakomm.work"  # Set this to either hostname (domain) or IP address of the chat server
+# Set this to a file name to record the commands and replies of the menu client in a traffic log, see traffic_log.py
+TRAFFIC_LOG = None
+# Sessions in "sync" mode poll the server for new messages with the inbox command. In "async" mode the server pushes
+# every message to the client as soon as it is sent
+CLIENT_MODES = ["sync", "async"]
+# Seconds to wait for the reply to a command in async mode
+REPLY_TIMEOUT = 30
+# Lines starting with these words are messages pushed by the server in async mode, not replies to a command
+PUSHED_MESSAGE_KINDS = ["msg", "privmsg"]
+# Async mode: lines about users logging in and out, sent after the userevents command by servers that support it
+USER_EVENT_KINDS = ["userjoined", "userleft"]
+# Seconds a user list received with the users command is trusted, when it is not kept up to date by user events
+USER_LIST_TTL = 30
+# Sync mode: the most commands of a batch sent before their replies are read. All the replies must fit in the
+# socket buffers, otherwise the server would wait for us to read while we wait for it to read
+BATCH_WINDOW = 1000
+# Messages asked from the server with one inbox command when the inbox is read in pages, see ChatClient.iter_inbox
+INBOX_PAGE_SIZE = 1000
+# Messages the menu shows before asking whether to show more
+INBOX_MENU_PAGE = 20
+# Jokes the menu client keeps ready, so that "Get a joke" does not wait for the server, see JokeCache
+JOKE_CACHE_SIZE = 5
+# Jokes shown recently. When the server sends one of them again, it is dropped
+JOKE_HISTORY_SIZE = 16
+
+# --------------------
+# Results returned by the ChatClient methods
+# --------------------
+# ok is True when the server accepted the login, error is the reason given by the server otherwise
+LoginResult = namedtuple("LoginResult", ["ok", "error"])
+# recipients is the number of users the message was delivered to, error is the reason when ok is False
+MessageResult = namedtuple("MessageResult", ["ok", "recipients", "error"])
+# kind is "msg" for public and "privmsg" for private messages
+InboxMessage = namedtuple("InboxMessage", ["kind", "sender", "text"])
+
+
+def parse_message_reply(reply):
+    """
+    Parse the reply to a msg or privmsg command
+    :param reply: The reply line, for example "msgok 1" or "msgerr incorrect recipient"
+    :return: MessageResult
+    """
+    reply_splitted = reply.split(" ", 1)
+    if reply_splitted[0] == "msgok":
+        recipients = 1
+        if len(reply_splitted) > 1 and reply_splitted[1].isdigit():
+            recipients = int(reply_splitted[1])
+        return MessageResult(True, recipients, None)
+    if reply_splitted[0] == "msgerr" and len(reply_splitted) > 1:
+        return MessageResult(False, 0, reply_splitted[1])
+    return MessageResult(False, 0, reply)
+
+
+def inbox_reply_size(reply):
+    """
+    :param reply: The first line of the reply to an inbox command, for example "inbox 3"
+    :return: The number of message lines that follow it
+    :raise IOError: When the line is not an inbox reply
+    """
+    reply_splitted = reply.split(" ")
+    if reply_splitted[0] != "inbox" or len(reply_splitted) < 2 or not reply_splitted[1].isdigit():
+        raise IOError("Unexpected reply to inbox: " + reply)
+    return int(reply_splitted[1])
+
+
+def parse_user_list(reply):
+    """
+    :param reply: The reply to the users command, for example "users alice bob"
+    :return: List of usernames
+    """
+    return reply.split(" ")[1:]
+
+
+def parse_inbox_line(line):
+    """
+    :param line: One message line of the inbox reply, for example "privmsg alice Hello there"
+    :return: InboxMessage
+    """
+    inbox_content_splitted = line.split(" ", 2)
+    while len(inbox_content_splitted) < 3:
+        inbox_content_splitted.append("")
+    return InboxMessage(*inbox_content_splitted)
+
+
+class UserDirectory:
+    """
+    Cached list of the users that are logged in. Checking if a user is in it takes constant time.
+    The list comes from the users command and is trusted for ttl seconds. While the server sends user events (async
+    mode with the userevents command) it is updated with every event, and stays valid until the connection is lost
+    """
+
+    def __init__(self, ttl=USER_LIST_TTL):
+        self.ttl = ttl
+        # username -> None, a dictionary keeps the order the server listed the users in
+        self.usernames = {}
+        # time.monotonic() of the last users reply, None when there is no list
+        self.updated_at = None
+        # True while user events keep the list up to date
+        self.live = False
+        # The receiver thread updates the directory while other threads read it
+        self.lock = threading.Lock()
+
+    def is_fresh(self):
+        with self.lock:
+            if self.updated_at is None:
+                return False
+            return self.live or time.monotonic() - self.updated_at < self.ttl
+
+    def replace(self, usernames):
+        with self.lock:
+            self.usernames = dict.fromkeys(usernames)
+            self.updated_at = time.monotonic()
+
+    def apply_event(self, event, username):
+        """
+        :param event: "userjoined" or "userleft"
+        """
+        with self.lock:
+            if event == "userjoined":
+                self.usernames[username] = None
+            else:
+                self.usernames.pop(username, None)
+
+    def clear(self):
+        with self.lock:
+            self.usernames = {}
+            self.updated_at = None
+            self.live = False
+
+    def names(self):
+        with self.lock:
+            return list(self.usernames)
+
+    def __contains__(self, username):
+        return username in self.usernames
+
+
+def parse_joke(reply):
+    """
+    :param reply: The reply to the joke command, for example "joke There's no place like 127.0.0.1"
+    :return: The text of the joke, or None when the reply is not a joke (the server does not support the command)
+    """
+    if reply.startswith("joke "):
+        return reply[len("joke "):]
+    return None
+
+
+class JokeCache:
+    """
+    Jokes fetched before they are asked for, see ChatClient.joke. When the cache is empty, the jokes for the next times
+    are asked for in the same batch as the one wanted now. In async mode, the cache is also topped up in the background
+    when it is half empty, so that it rarely runs out.
+    The server picks its jokes at random, so the same joke comes often: a joke that is already in the cache or was
+    shown recently is dropped
+    """
+
+    def __init__(self, capacity=JOKE_CACHE_SIZE, history_size=JOKE_HISTORY_SIZE):
+        """
+        :param capacity: The most jokes kept, 0 to not prefetch jokes at all
+        """
+        self.capacity = capacity
+        # Oldest first
+        self.jokes = deque()
+        self.shown = deque(maxlen=history_size)
+        # Number of joke commands sent and not answered yet, so that two commands do not both refill the cache
+        self.requested = 0
+        # Cleared when the server does not support the joke command
+        self.supported = True
+        # Async mode: commands may be sent from several threads
+        self.lock = threading.Lock()
+
+    def reserve_refill(self, extra=0):
+        """
+        :param extra: Jokes wanted right away, on top of the ones that fill the cache
+        :return: The number of joke commands to send, 0 when the cache has enough jokes or another refill is in progress
+        """
+        with self.lock:
+            if self.requested or not self.supported or len(self.jokes) > self.capacity // 2:
+                return 0
+            self.requested = self.capacity - len(self.jokes) + extra
+            return self.requested
+
+    def refilled(self, replies):
+        """
+        :param replies: The replies to the joke commands, empty when they failed
+        :return: The jokes received, duplicates included
+        """
+        with self.lock:
+            self.requested = 0
+            new_jokes = []
+            shown_jokes = []
+            for reply in replies:
+                joke = parse_joke(reply)
+                if joke is None:
+                    self.supported = False
+                elif joke in self.jokes or joke in new_jokes or joke in shown_jokes:
+                    continue
+                elif joke in self.shown:
+                    shown_jokes.append(joke)
+                else:
+                    new_jokes.append(joke)
+            if not new_jokes and shown_jokes:
+                # The server knows few jokes and they were all shown recently: they are shown again, oldest first,
+                # but never the last one twice in a row
+                shown_jokes.sort(key=list(self.shown).index)
+                new_jokes = [joke for joke in shown_jokes if joke != self.shown[-1]]
+            self.jokes.extend(new_jokes[:self.capacity - len(self.jokes)])
+            return [joke for joke in map(parse_joke, replies) if joke is not None]
+
+    def take(self):
+        """
+        :return: The oldest joke, or None when the cache is empty
+        """
+        with self.lock:
+            if not self.jokes:
+                return None
+            joke = self.jokes.popleft()
+            self.shown.append(joke)
+            return joke
+
+    def add_shown(self, joke):
+        with self.lock:
+            self.shown.append(joke)
+
+    def clear(self):
+        """
+        The jokes of another server may be different
+        """
+        with self.lock:
+            self.jokes.clear()
+            self.shown.clear()
+            self.supported = True
+
+
+def fail_replies(pending_replies, error):
+    """
+    Wake up the commands waiting for these replies, with an error
+    """
+    for pending_reply in pending_replies:
+        pending_reply.error = error
+        pending_reply.done.set()
+
+
+class PendingReply:
+    """
+    A command sent in async mode that is waiting for its reply. The receiver thread fills in the reply lines
+    """
+
+    def __init__(self, command):
+        self.command = command
+        # For the latency metric. Taken when the command is created, so time spent queued during a reconnect counts
+        self.started_at = time.perf_counter()
+        self.lines = []
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=REPLY_TIMEOUT):
+        """
+        :return: The reply lines
+        :raise IOError: When the connection was lost or no reply came in time
+        """
+        if not self.done.wait(timeout):
+            raise TimeoutError("No reply to %s from the server" % self.command)
+        if self.error is not None:
+            raise self.error
+        return self.lines
+
+
+class ChatClient:
+    """
+    One session with a chat server. Every method sends one command to the server, waits for its reply and returns
+    the reply as a result object, without printing anything or asking the user. Socket errors are raised as IOError.
+    The state of each session is kept in its own object, so one program can have many sessions at the same time.
+
+    In async mode a receiver thread reads everything the server sends. Replies are handed to the commands waiting
+    for them (the server answers in the order the commands were sent), and pushed messages are given to on_message,
+    or put in the incoming queue when there is no on_message function.
+
+    When the connection is lost, the client connects again with backoff (see connection_manager.py), selects the mode
+    and logs in with the same username. The command that was interrupted fails with IOError, because it is not known
+    if the server handled it. In sync mode the connection is restored when the next command is sent, so the failed
+    command returns its error without waiting for the reconnect. In async mode the receiver thread reconnects right
+    away, and commands sent while reconnecting are queued and sent on the new connection
+    """
+
+    def __init__(self, host=SERVER_HOST, port=TCP_PORT, mode="sync", on_message=None, user_list_ttl=USER_LIST_TTL,
+                 auto_reconnect=True, metrics_registry=None, recorder=None, joke_cache_size=0):
+        """
+        :param mode: "sync" or "async", see CLIENT_MODES
+        :param on_message: Async mode: function called with an InboxMessage for every pushed message. It is called
+            from the receiver thread, so it must not wait for replies from this client
+        :param user_list_ttl: Seconds the list from the users command is cached, 0 to always ask the server
+        :param auto_reconnect: Connect again when the connection is lost
+        :param metrics_registry: Where the performance metrics are recorded, metrics.default_registry when None.
+            The clients using the same registry add up their metrics
+        :param recorder: traffic_log.TrafficRecorder that records every command and reply line, or None. Each
+            connection is a session in the log
+        :param joke_cache_size: Jokes fetched ahead of time by joke(), see JokeCache. 0 fetches every joke when it is
+            asked for
+        """
+        self.host = host
+        self.port = port
+        self.mode = mode
+        self.on_message = on_message
+        self.state = "disconnected"  # One of the values in states
+        self.username = None  # The username of the last successful login
+        self.socket = None  # type: socket
+        # The reply of the server to the mode command of the last connect, "modeok" when it confirmed the mode
+        self.mode_reply = None
+        # Buffered reader for the lines received on the socket. A new reader is created for every connection
+        self.reader = None  # type: LineReader
+        # Buffered writer for the commands sent on the socket, also created for every connection
+        self.writer = None  # type: SendBuffer
+        # Async mode: pushed messages when there is no on_message function
+        self.incoming = queue.Queue()
+        # Async mode: commands waiting for a reply, oldest first
+        self.pending = deque()
+        # Sending a command and adding it to pending must happen together, so that the replies stay in order
+        self.send_lock = threading.Lock()
+        self.receiver_thread = None
+        self.user_directory = UserDirectory(user_list_ttl)
+        self.auto_reconnect = auto_reconnect
+        # In async mode the receiver thread waits for pushed messages for as long as the session lasts, so there is no
+        # read timeout. Dead connections are found by TCP keepalive
+        self.connection_manager = ConnectionManager(host, port, read_timeout=READ_TIMEOUT if mode == "sync" else None)
+        # Async mode: True while the receiver thread is connecting again
+        self.reconnecting = False
+        # Sync mode: True when the connection was lost, it is restored before the next command is sent
+        self.connection_broken = False
+        # Async mode: commands sent while reconnecting, list of (list of PendingReply, list of (command, arguments))
+        self.queued_commands = []
+        self.metrics_registry = metrics_registry if metrics_registry is not None else default_registry
+        self.create_metrics(self.metrics_registry)
+        # True while the connection is counted in the connections_active metric
+        self.connection_open = False
+        # Messages taken from the inbox on the server but not yielded yet by iter_inbox, oldest first
+        self.unread_inbox = deque()
+        # Sync mode: the stream_inbox generator of the page a loop over iter_inbox is in the middle of, None when no
+        # inbox reply is half read. Any other command first reads the rest of the page, see finish_inbox_page
+        self.inbox_page = None
+        # Cleared when the server does not support "inbox <limit>", the whole inbox is then always read at once
+        self.paged_inbox = True
+        self.recorder = recorder
+        # Number of the session of the current connection in the traffic log
+        self.recorded_session = None
+        self.joke_cache = JokeCache(joke_cache_size)
+
+    def create_metrics(self, registry):
+        self.command_latency = registry.histogram(
+            "chat_client_command_seconds", "Time from sending a command until its whole reply is received", "command")
+        self.commands_sent = registry.counter("chat_client_commands_sent_total", "Commands sent", "command")
+        self.messages_received = registry.counter(
+            "chat_client_messages_received_total", "Replies and pushed lines received, by their first word", "kind")
+        self.bytes_sent = registry.counter("chat_client_sent_bytes_total", "Bytes sent to the server")
+        self.bytes_received = registry.counter("chat_client_received_bytes_total", "Bytes received from the server")
+        self.errors = registry.counter(
+            "chat_client_errors_total", "Error replies, timeouts, lost connections and rejected messages", "kind")
+        self.connections_active = registry.gauge("chat_client_connections_active", "Open connections to the server")
+        self.reconnects = registry.counter("chat_client_reconnects_total", "Connections restored after being lost")
+
+    def set_connection_open(self, connection_open):
+        if connection_open != self.connection_open:
+            self.connection_open = connection_open
+            self.connections_active.inc(1 if connection_open else -1)
+
+    def record_reply(self, command, lines, started_at):
+        """
+        Update the metrics for a complete reply
+        """
+        self.command_latency.observe(time.perf_counter() - started_at, command)
+        kind = lines[0].split(" ", 1)[0]
+        self.messages_received.inc(label=kind)
+        if kind.endswith("err"):
+            self.errors.inc(label=kind)
+
+    def start_recorded_session(self):
+        """
+        A new connection is a new session in the traffic log
+        """
+        if self.recorder is not None:
+            self.end_recorded_session()
+            self.recorded_session = self.recorder.open_session()
+
+    def end_recorded_session(self):
+        recorded_session = self.recorded_session
+        if recorded_session is not None:
+            self.recorded_session = None
+            self.recorder.close_session(recorded_session)
+
+    def connect(self):
+        """
+        Connect to the chat server and select the mode of the session
+        :return: True when the server confirmed the mode, False when it replied something else
+        """
+        self.socket = self.connection_manager.connect()
+        self.connection_broken = False
+        self.inbox_page = None
+        self.reader = LineReader(self.socket, byte_counter=self.bytes_received)
+        self.writer = SendBuffer(self.socket, byte_counter=self.bytes_sent)
+        self.start_recorded_session()
+        self.state = "connected"
+        self.set_connection_open(True)
+        # The mode reply is read before the receiver thread starts, after this the receiver owns the reader
+        self.send_command(self.mode)
+        self.mode_reply = self.read_line()
+        self.user_directory.clear()
+        if self.mode == "async":
+            self.receiver_thread = threading.Thread(target=self.receive_lines, daemon=True)
+            self.receiver_thread.start()
+            # Servers that do not support user events reply with cmderr, the user list is then only cached for its TTL
+            self.user_directory.live = self.request("userevents") == "usereventsok"
+        return self.mode_reply == "modeok"
+
+    def disconnect(self):
+        self.state = "disconnected"
+        self.connection_broken = False
+        self.inbox_page = None
+        self.username = None
+        self.user_directory.clear()
+        self.unread_inbox.clear()
+        self.joke_cache.clear()
+        self.set_connection_open(False)
+        self.end_recorded_session()
+        # Ends the waiting of a reconnect in progress
+        self.connection_manager.stop()
+        try:
+            # Wakes up the receiver thread if it is waiting for data
+            self.socket.shutdown(SHUT_RDWR)
+        except IOError:
+            pass
+        self.socket.close()
+        if self.receiver_thread is not None and self.receiver_thread is not threading.current_thread():
+            self.receiver_thread.join()
+        self.receiver_thread = None
+
+    def receive_lines(self):
+        """
+        Async mode: the receiver thread. Runs until the connection is closed, and survives reconnects
+        """
+        while True:
+            try:
+                while True:
+                    line = self.read_line()
+                    kind = line.split(" ", 1)[0]
+                    if self.handle_pushed_line(line, kind):
+                        continue
+                    lines = [line]
+                    if kind == "inbox":
+                        lines += [self.read_line() for i in range(inbox_reply_size(line))]
+                    if self.pending:
+                        pending_reply = self.pending.popleft()
+                        # The list is replaced here and not by the thread waiting for the reply, so that it cannot
+                        # overwrite the events received after the reply
+                        if pending_reply.command == "users":
+                            self.user_directory.replace(parse_user_list(line))
+                        self.record_reply(pending_reply.command, lines, pending_reply.started_at)
+                        pending_reply.lines = lines
+                        pending_reply.done.set()
+            except IOError as e:
+                if not self.connection_lost(e):
+                    return
+
+    def handle_pushed_line(self, line, kind):
+        """
+        :return: True when the line was a pushed message or a user event, False when it is a reply
+        """
+        if kind in PUSHED_MESSAGE_KINDS:
+            self.messages_received.inc(label=kind)
+            self.deliver_message(parse_inbox_line(line))
+            return True
+        if kind in USER_EVENT_KINDS:
+            self.messages_received.inc(label=kind)
+            self.user_directory.apply_event(kind, line[len(kind) + 1:])
+            return True
+        return False
+
+    def connection_lost(self, error):
+        """
+        The connection is gone: fail the commands waiting for a reply, since nobody will answer them, and connect
+        again unless the user disconnected. In sync mode the connection is only marked as broken, see
+        restore_connection
+        :return: True when the session was restored on a new connection
+        """
+        lost_error = ConnectionError("Connection to the server lost: %s" % error)
+        # The rest of a half read inbox page is gone with the connection
+        self.inbox_page = None
+        self.set_connection_open(False)
+        with self.send_lock:
+            fail_replies(self.pending, lost_error)
+            self.pending.clear()
+            if self.state == "disconnected" or not self.auto_reconnect:
+                self.state = "disconnected"
+                self.user_directory.clear()
+                return False
+            self.errors.inc(label="connection_lost")
+            if self.mode == "sync":
+                self.connection_broken = True
+            else:
+                self.reconnecting = True
+        self.socket.close()
+        if self.mode == "sync":
+            self.user_directory.clear()
+            return False
+        # User events were missed while the connection was down
+        self.user_directory.clear()
+        connection = self.connection_manager.reconnect(self.restore_session)
+        with self.send_lock:
+            self.reconnecting = False
+            queued_commands = self.queued_commands
+            self.queued_commands = []
+            if connection is None or self.state == "disconnected":
+                if connection is not None:
+                    connection.close()
+                self.state = "disconnected"
+                for pending_replies, commands in queued_commands:
+                    fail_replies(pending_replies, lost_error)
+                return False
+            self.reconnects.inc()
+            self.set_connection_open(True)
+            try:
+                for pending_replies, commands in queued_commands:
+                    self.pending.extend(pending_replies)
+                    self.write_commands(commands)
+                self.writer.flush()
+            except IOError:
+                # The receiver thread finds the new connection broken as well on its next read
+                pass
+        return True
+
+    def restore_connection(self):
+        """
+        Sync mode: connect again after the connection was lost, before the next command is sent
+        :raise ConnectionError: When all the attempts failed, the session is then disconnected
+        """
+        self.connection_broken = False
+        connection = self.connection_manager.reconnect(self.restore_session)
+        if connection is None:
+            self.state = "disconnected"
+            raise ConnectionError("Could not connect to the server again")
+        self.reconnects.inc()
+        self.set_connection_open(True)
+
+    def restore_session(self, connection):
+        """
+        Called with the new socket when reconnecting: select the mode and log in again
+        :raise IOError: When the server does not accept the mode or the login, the next attempt is then made. The
+            server may not have noticed yet that the old connection is gone, and still have the username in use
+        """
+        self.socket = connection
+        self.reader = LineReader(connection, byte_counter=self.bytes_received)
+        self.writer = SendBuffer(connection, byte_counter=self.bytes_sent)
+        self.start_recorded_session()
+        # The receiver thread must not wait forever for these replies, even in async mode
+        connection.settimeout(self.connection_manager.connect_timeout)
+        self.send_command(self.mode)
+        if self.read_session_reply() != "modeok":
+            raise ConnectionError("The server did not accept the %s mode" % self.mode)
+        if self.username is not None:
+            self.send_command("login", self.username)
+            if self.read_session_reply() != "loginok":
+                raise ConnectionError("The server did not accept the login of %s" % self.username)
+        if self.mode == "async":
+            self.send_command("userevents")
+            self.user_directory.live = self.read_session_reply() == "usereventsok"
+        connection.settimeout(self.connection_manager.read_timeout)
+
+    def read_session_reply(self):
+        """
+        Read the reply to a command sent by restore_session. Pushed messages that arrive before it are delivered
+        """
+        while True:
+            line = self.read_line()
+            if not self.handle_pushed_line(line, line.split(" ", 1)[0]):
+                return line
+
+    def deliver_message(self, message):
+        if self.on_message is not None:
+            self.on_message(message)
+        else:
+            self.incoming.put(message)
+
+    def get_message(self, timeout=None):
+        """
+        Async mode without on_message: wait for the next pushed message
+        :param timeout: Seconds to wait, None waits until a message arrives
+        :return: InboxMessage, or None if no message arrived in time
+        """
+        try:
+            return self.incoming.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def send_command(self, command, arguments=None):
+        """
+        Send one command to the chat server.
+        :param command: The command to send (login, sync, msg, ...)
+        :param arguments: The arguments for the command as a string, or None if no arguments are needed
+            (username, message text, etc)
+        """
+        self.commands_sent.inc(label=command)
+        if self.recorded_session is not None:
+            self.record_command(command, arguments)
+        self.writer.write_command(command, arguments)
+        self.writer.flush()
+
+    def write_commands(self, commands):
+        """
+        Add many commands to the send buffer. Full buffers are sent on the way, the rest stays until flush
+        :param commands: List of (command, arguments) tuples
+        """
+        write_command = self.writer.write_command
+        count_command = self.commands_sent.inc
+        for command, arguments in commands:
+            count_command(label=command)
+            if self.recorded_session is not None:
+                self.record_command(command, arguments)
+            write_command(command, arguments)
+
+    def record_command(self, command, arguments):
+        line = command if arguments is None else "%s %s" % (command, arguments)
+        recorded_session = self.recorded_session
+        if recorded_session is not None:
+            self.recorder.record_line(recorded_session, REQUEST_LINE, line)
+
+    def read_line(self):
+        """
+        Wait until a line is received from the server
+        :return: The line, without the newline character(s)
+        """
+        line = self.reader.read_line()
+        # Read once: in async mode, disconnect() may end the recorded session while the receiver thread reads
+        recorded_session = self.recorded_session
+        if recorded_session is not None:
+            self.recorder.record_line(recorded_session, RESPONSE_LINE, line)
+        return line
+
+    def request_lines(self, command, arguments=None):
+        """
+        Send one command and wait for the complete reply
+        :return: The reply lines. Only the inbox reply has more than one line
+        """
+        if self.mode == "async":
+            pending_reply = PendingReply(command)
+            with self.send_lock:
+                if self.state == "disconnected":
+                    raise ConnectionError("Not connected to the server")
+                if self.reconnecting:
+                    self.queued_commands.append(([pending_reply], [(command, arguments)]))
+                else:
+                    self.pending.append(pending_reply)
+                    try:
+                        self.send_command(command, arguments)
+                    except IOError:
+                        self.pending.remove(pending_reply)
+                        raise
+            return self.wait_for_reply(pending_reply)
+
+        self.finish_inbox_page()
+        if self.connection_broken:
+            self.restore_connection()
+        started_at = time.perf_counter()
+        try:
+            self.send_command(command, arguments)
+            lines = self.read_reply(command)
+        except IOError as e:
+            self.connection_lost(e)
+            raise
+        self.record_reply(command, lines, started_at)
+        return lines
+
+    def wait_for_reply(self, pending_reply):
+        """
+        Async mode: wait until the receiver thread has the reply
+        :return: The reply lines
+        """
+        try:
+            return pending_reply.wait()
+        except TimeoutError:
+            self.errors.inc(label="timeout")
+            raise
+
+    def read_reply(self, command):
+        """
+        Sync mode: read the complete reply to a command
+        :return: The reply lines
+        """
+        lines = [self.read_line()]
+        if command == "inbox":
+            lines += [self.read_line() for i in range(inbox_reply_size(lines[0]))]
+        return lines
+
+    def request_batch(self, commands):
+        """
+        Pipelining: send many commands in few writes, then collect their replies. The server answers in the same
+        order, so the whole batch takes about one round trip instead of one round trip per command
+        :param commands: List of (command, arguments) tuples, arguments can be None
+        :return: List with the reply lines of every command, in the same order as commands
+        """
+        if self.mode == "async":
+            pending_replies = [PendingReply(command) for command, arguments in commands]
+            with self.send_lock:
+                if self.state == "disconnected":
+                    raise ConnectionError("Not connected to the server")
+                if self.reconnecting:
+                    self.queued_commands.append((pending_replies, commands))
+                else:
+                    self.pending.extend(pending_replies)
+                    self.write_commands(commands)
+                    self.writer.flush()
+            return [self.wait_for_reply(pending_reply) for pending_reply in pending_replies]
+
+        self.finish_inbox_page()
+        if self.connection_broken:
+            self.restore_connection()
+        replies = []
+        try:
+            for window_start in range(0, len(commands), BATCH_WINDOW):
+                window = commands[window_start:window_start + BATCH_WINDOW]
+                started_at = time.perf_counter()
+                self.write_commands(window)
+                self.writer.flush()
+                for command, arguments in window:
+                    lines = self.read_reply(command)
+                    self.record_reply(command, lines, started_at)
+                    replies.append(lines)
+        except IOError as e:
+            self.connection_lost(e)
+            raise
+        return replies
+
+    def request(self, command, arguments=None):
+        """
+        Send one command and wait for the reply
+        :return: The reply of the server, the whole line as a single string
+        """
+        return self.request_lines(command, arguments)[0]
+
+    def login(self, username):
+        """
+        :return: LoginResult
+        """
+        server_response = self.request("login", username)
+        if server_response == "loginok":
+            self.state = "authorized"
+            if username != self.username:
+                # Messages of the previous user
+                self.unread_inbox.clear()
+            self.username = username
+            return LoginResult(True, None)
+        if server_response.startswith("loginerr "):
+            return LoginResult(False, server_response[len("loginerr "):])
+        return LoginResult(False, server_response)
+
+    def msg(self, text):
+        """
+        Send a public message to all users
+        :return: MessageResult
+        """
+        return parse_message_reply(self.request("msg", text))
+
+    def is_unknown_recipient(self, recipient):
+        """
+        :return: True when the cached user list is fresh and the recipient is not in it. The message can then be
+            rejected without asking the server
+        """
+        return self.user_directory.is_fresh() and recipient not in self.user_directory
+
+    def refresh_for_recipients(self, recipients):
+        """
+        Ask the server for the user list once when one of the recipients is not in a list that is only trusted for
+        its ttl: the user may have logged in since it was fetched. A list kept live by user events is not refreshed
+        :param recipients: Usernames, None for a public message
+        """
+        directory = self.user_directory
+        if directory.live or not directory.is_fresh():
+            return
+        if any(recipient is not None and recipient not in directory for recipient in recipients):
+            self.refresh_users()
+
+    def privmsg(self, recipient, text):
+        """
+        Send a private message to one user
+        :return: MessageResult
+        """
+        self.refresh_for_recipients([recipient])
+        if self.is_unknown_recipient(recipient):
+            self.errors.inc(label="rejected_locally")
+            return MessageResult(False, 0, "incorrect recipient")
+        return parse_message_reply(self.request("privmsg", recipient + " " + text))
+
+    def send_messages(self, messages):
+        """
+        Send many messages in one batch
+        :param messages: List of (recipient, text) tuples. The recipient is None for a public message
+        :return: List of MessageResult, in the same order as messages
+        """
+        commands = []
+        # Index in messages of every command sent, the other messages are rejected without a round trip
+        sent_indexes = []
+        results = [MessageResult(False, 0, "incorrect recipient")] * len(messages)
+        self.refresh_for_recipients([recipient for recipient, text in messages])
+        for i, (recipient, text) in enumerate(messages):
+            if recipient is None:
+                commands.append(("msg", text))
+            elif self.is_unknown_recipient(recipient):
+                self.errors.inc(label="rejected_locally")
+                continue
+            else:
+                commands.append(("privmsg", recipient + " " + text))
+            sent_indexes.append(i)
+        for i, lines in zip(sent_indexes, self.request_batch(commands)):
+            results[i] = parse_message_reply(lines[0])
+        return results
+
+    def privmsg_many(self, recipients, text):
+        """
+        Send the same private message to each of the recipients, in one batch
+        :return: Dictionary recipient -> MessageResult
+        """
+        results = self.send_messages([(recipient, text) for recipient in recipients])
+        return dict(zip(recipients, results))
+
+    def inbox(self):
+        """
+        Get the messages received since the last time the inbox was read
+        :return: List of InboxMessage
+        """
+        return list(self.iter_inbox(page_size=None))
+
+    def iter_inbox(self, limit=None, page_size=INBOX_PAGE_SIZE):
+        """
+        Generator: the messages in the inbox, oldest first, as InboxMessage. In sync mode every message is yielded as
+        soon as its line is read from the socket, so the first message is available right away and the memory used
+        does not grow with the size of the inbox. In async mode the receiver thread reads the lines, and the messages
+        of a page are yielded when the whole page has arrived.
+        The messages are asked from the server page_size at a time. When the loop over the messages stops early, the
+        rest of the current page is still read, so that the connection stays in sync, and kept: the next call yields
+        those messages first. The messages of the later pages stay on the server. In sync mode, another command sent
+        while the loop is in the middle of a page also reads the rest of the page first, and the loop then goes on
+        with those messages
+        :param limit: Yield at most this many messages, None for all of them
+        :param page_size: Messages asked with one inbox command, None asks for the whole inbox at once
+        """
+        yielded = 0
+        last_page = False
+        while limit is None or yielded < limit:
+            if self.unread_inbox:
+                yield self.unread_inbox.popleft()
+                yielded += 1
+                continue
+            if last_page:
+                return
+            wanted = page_size if limit is None else min(page_size or limit, limit - yielded)
+            if self.mode == "async":
+                lines = self.request_inbox_lines(wanted)
+                self.unread_inbox.extend(parse_inbox_line(line) for line in lines[1:])
+                last_page = wanted is None or len(lines) - 1 < wanted
+                continue
+            if self.inbox_page is not None:
+                # Another loop over iter_inbox is in the middle of a page, its messages come first
+                self.finish_inbox_page()
+                continue
+            page = self.stream_inbox(wanted)
+            self.inbox_page = page
+            received = 0
+            try:
+                for message in page:
+                    received += 1
+                    yield message
+                    yielded += 1
+                    if limit is not None and yielded >= limit:
+                        break
+            finally:
+                # When another command has read the rest of the page, it is not known whether it was the last one
+                finished_by_command = self.inbox_page is not page
+                if not finished_by_command:
+                    self.inbox_page = None
+                # Reads the rest of the page into unread_inbox when the loop stopped early
+                page.close()
+            last_page = wanted is None or (received < wanted and not finished_by_command)
+
+    def finish_inbox_page(self):
+        """
+        Sync mode: read the rest of the inbox page a loop over iter_inbox is in the middle of into unread_inbox, so
+        that the next line on the socket is the reply to the next command
+        """
+        page = self.inbox_page
+        if page is not None:
+            self.inbox_page = None
+            page.close()
+
+    def request_inbox_lines(self, count):
+        """
+        Send one inbox command and wait for the complete reply
+        :param count: Most messages to ask for, None for all of them
+        :return: The reply lines
+        """
+        if count is not None and self.paged_inbox:
+            lines = self.request_lines("inbox", str(count))
+            if not lines[0].startswith("cmderr"):
+                return lines
+            self.paged_inbox = False
+        return self.request_lines("inbox")
+
+    def stream_inbox(self, count):
+        """
+        Sync mode, generator: send one inbox command and yield the messages of the reply while its lines are read.
+        When the generator is closed before the end of the reply, the remaining lines are read into unread_inbox
+        :param count: Most messages to ask for, None for all of them
+        """
+        if self.connection_broken:
+            self.restore_connection()
+        started_at = time.perf_counter()
+        try:
+            header = None
+            if count is not None and self.paged_inbox:
+                self.send_command("inbox", str(count))
+                header = self.read_line()
+                if header.startswith("cmderr"):
+                    # The server does not support pages, the whole inbox is read at once from now on
+                    self.paged_inbox = False
+                    header = None
+            if header is None:
+                self.send_command("inbox")
+                header = self.read_line()
+            remaining = inbox_reply_size(header)
+            try:
+                while remaining:
+                    message = parse_inbox_line(self.read_line())
+                    remaining -= 1
+                    yield message
+            except GeneratorExit:
+                for i in range(remaining):
+                    self.unread_inbox.append(parse_inbox_line(self.read_line()))
+                self.record_reply("inbox", [header], started_at)
+                raise
+        except IOError as e:
+            self.connection_lost(e)
+            raise
+        self.record_reply("inbox", [header], started_at)
+
+    def joke(self):
+        """
+        :return: A joke, right away when one was fetched ahead of time. None when the server does not tell jokes
+        """
+        joke = self.joke_cache.take()
+        if joke is not None:
+            if self.mode == "async":
+                count = self.joke_cache.reserve_refill()
+                if count:
+                    # The replies are read by the receiver thread, nobody waits for this refill
+                    threading.Thread(target=self.prefetch_jokes, args=(count,), daemon=True).start()
+            return joke
+        if not self.joke_cache.supported:
+            return None
+        # The cache is empty: one batch brings the joke wanted now and refills the cache. A refill in progress in the
+        # background is not waited for
+        count = self.joke_cache.reserve_refill(extra=1) or self.joke_cache.capacity + 1
+        jokes = self.fetch_jokes(count)
+        joke = self.joke_cache.take()
+        if joke is None and jokes:
+            # Every joke received was the one shown last
+            joke = jokes[0]
+            self.joke_cache.add_shown(joke)
+        return joke
+
+    def fetch_jokes(self, count):
+        """
+        Ask the server for count jokes in one batch, and put them in the joke cache
+        :param count: Reserved with JokeCache.reserve_refill
+        :return: The jokes received
+        """
+        try:
+            replies = self.request_batch([("joke", None)] * count)
+        except IOError:
+            self.joke_cache.refilled([])
+            raise
+        return self.joke_cache.refilled([lines[0] for lines in replies])
+
+    def prefetch_jokes(self, count):
+        """
+        Async mode: fetch_jokes in a background thread
+        """
+        try:
+            self.fetch_jokes(count)
+        except IOError:
+            # Only a prefetch, the next joke() asks again
+            pass
+
+    def users(self, refresh=False):
+        """
+        :param refresh: Ask the server even when the cached list is still fresh
+        :return: List with the usernames of the users that are logged in
+        """
+        if not refresh and self.user_directory.is_fresh():
+            return self.user_directory.names()
+        users_list = parse_user_list(self.request("users"))
+        if self.mode != "async":
+            self.user_directory.replace(users_list)
+        return users_list
+
+    def refresh_users(self):
+        return self.users(refresh=True)
+
+
+# --------------------
+# State variables
+# --------------------
+# The session with the chat server used by the menu. The current state of the system is chat_client.state
+chat_client = ChatClient(recorder=open_recorder(TRAFFIC_LOG, "chat client", side="client", host=SERVER_HOST,
+                                                  port=TCP_PORT), joke_cache_size=JOKE_CACHE_SIZE)
+# When this variable will be set to false, the application will stop
+must_run = True
+# profiling.Profiler of the menu actions, set when profiling is enabled with the environment variables of profiling.py
+profiler = None
+
+
+def quit_application():
+    """ Update the application state so that the main-loop will exit """
+    # Make sure we reference the global variable here. Not the best code style,
+    # but the easiest to work with without involving object-oriented code
+    global must_run
+    must_run = False
+
+
+# --------------------
+# Menu actions. They ask the user for input, call chat_client and print the result
+# --------------------
+def connect_to_server():
+    try:
+        if chat_client.connect():
+            print("Success. modeok recieved")
+        else:
+            print("Error. Message not returned as expected. Returned: ", chat_client.mode_reply)
+        return True
+    except IOError as e:
+        print("Error happened:", e)
+        return False
+
+
+def disconnect_from_server():
+    try:
+        chat_client.disconnect()
+        return True
+    except IOError as e:
+        print("error happened", e)
+        return False
+
+
+def login():
+    try:
+        username = input("Enter username: ")
+        result = chat_client.login(username)
+        if result.ok:
+            print("Login successful. Logged inn as: ", username)
+            return True
+        if result.error == "incorrect username format":
+            print("Error. Username can only consist of alphanumeric characters: letters and digits. Try again")
+            return False
+        else:
+            print("Error. Login failed. Server response: ", result.error)
+            return False
+
+    except IOError as e:
+        print("Error happened: ", e)
+        return False
+
+
+def public_message():
+    try:
+        message = input("Write the message you wish to send: ")
+        result = chat_client.msg(message)
+        if result.ok:
+            print("Success. Message sent.")
+            return True
+        else:
+            print("Error. Message not sent. Try again")
+            return False
+
+    except IOError as e:
+        print("Error happened: ", e)
+        return False
+
+
+def get_user_list():
+    # protocol for users list: users\n
+    try:
+        users_list = chat_client.users()
+        print("Success. Received list of users: ", users_list)
+        return True
+
+    except IOError as e:
+        print("Error happened: ", e)
+        return False
+
+
+def private_message():
+    try:
+        recipient = input("Enter username of recipient: ")
+        message = input("Enter message to be sent: ")
+        result = chat_client.privmsg(recipient, message)
+        if result.ok:
+            if result.recipients == 1:
+                print("Success. Message sent")
+            else:
+                print("Success, but message was sent to %i recipients!" % result.recipients)
+            return True
+        elif result.error is not None and result.error.startswith("incorrect recipient"):
+            print("Error. Wrong recipient. Can't send to Anonymous users. Tried to send to: ", recipient)
+            return False
+        else:
+            print("Error. Message was not sent. Server response: ", result.error)
+            return False
+
+    except IOError as e:
+        print("Error happened: ", e)
+        return False
+
+
+def inbox():
+    try:
+        # The messages are shown while they arrive, INBOX_MENU_PAGE at a time. The ones not shown stay in the inbox
+        shown = 0
+        while True:
+            page_count = 0
+            for message in chat_client.iter_inbox(limit=INBOX_MENU_PAGE):
+                shown += 1
+                page_count += 1
+                print("Message %i is from " % shown + message.sender + " and reads: " + message.text)
+            if page_count < INBOX_MENU_PAGE:
+                break
+            if input("Press Enter to show more messages, or q and Enter to stop: ").strip().lower() == "q":
+                break
+        if not shown:
+            print("No new messages in inbox.")
+        return True
+
+    except IOError as e:
+        print("Error happened: ", e)
+        return False
+
+
+def get_joke():
+    try:
+        joke = chat_client.joke()
+    except IOError as e:
+        print("Error happened:", e)
+        return False
+    if joke is None:
+        print("The server does not tell jokes.")
+    else:
+        print("Joke:", joke)
+    return True
+
+
+def show_metrics():
+    print(chat_client.metrics_registry.dump("json"))
+    return True
+
+
+"""
+The list of available actions that the user can perform
+Each action is a dictionary with the following fields:
+description: a textual description of the action
+valid_states: a list specifying in which states this action is available
+function: a function to call when the user chooses this particular action. The functions must be defined before
+            the definition of this variable
+"""
+available_actions = [
+    {
+        "description": "Connect to a chat server",
+        "valid_states": ["disconnected"],
+        "function": connect_to_server
+    },
+    {
+        "description": "Disconnect from the server",
+        "valid_states": ["connected", "authorized"],
+        "function": disconnect_from_server
+    },
+    {
+        "description": "Authorize (log in)",
+        "valid_states": ["connected", "authorized"],
+        "function": login
+    },
+    {
+        "description": "Send a public message",
+        "valid_states": ["connected", "authorized"],
+        "function": public_message
+    },
+    {
+        "description": "Send a private message",
+        "valid_states": ["authorized"],
+        "function": private_message
+    },
+    {
+        "description": "Read messages in the inbox",
+        "valid_states": ["connected", "authorized"],
+        "function": inbox
+    },
+    {
+        "description": "See list of users",
+        "valid_states": ["connected", "authorized"],
+        "function": get_user_list
+    },
+    {
+        "description": "Get a joke",
+        "valid_states": ["connected", "authorized"],
+        "function": get_joke
+    },
+    {
+        "description": "Show performance metrics",
+        "valid_states": ["disconnected", "connected", "authorized"],
+        "function": show_metrics
+    },
+    {
+        "description": "Quit the application",
+        "valid_states": ["disconnected", "connected", "authorized"],
+        "function": quit_application
+    },
+]
+
+
+def run_chat_client():
+    """ Run the chat client application loop. When this function exists, the application will stop """
+
+    while must_run:
+        print_menu()
+        action = select_user_action()
+        perform_user_action(action)
+    print("Thanks for watching. Like and subscribe! 👍")
+
+
+def print_menu():
+    """ Print the menu showing the available options """
+    print("==============================================")
+    print("What do you want to do now? ")
+    print("==============================================")
+    print("Available options:")
+    i = 1
+    for a in available_actions:
+        if chat_client.state in a["valid_states"]:
+            # Only hint about the action if the current state allows it
+            print("  %i) %s" % (i, a["description"]))
+        i += 1
+    print()
+
+
+def select_user_action():
+    """
+    Ask the user to choose and action by entering the index of the action
+    :return: The action as an index in available_actions array or None if the input was invalid
+    """
+    number_of_actions = len(available_actions)
+    hint = "Enter the number of your choice (1..%i):" % number_of_actions
+    choice = input(hint)
+    # Try to convert the input to an integer
+    try:
+        choice_int = int(choice)
+    except ValueError:
+        choice_int = -1
+
+    if 1 <= choice_int <= number_of_actions:
+        action = choice_int - 1
+    else:
+        action = None
+
+    return action
+
+
+def perform_user_action(action_index):
+    """
+    Perform the desired user action
+    :param action_index: The index in available_actions array - the action to take
+    :return: Desired state change as a string, None if no state change is needed
+    """
+    if action_index is not None:
+        print()
+        action = available_actions[action_index]
+        if chat_client.state in action["valid_states"]:
+            function_to_run = available_actions[action_index]["function"]
+            if function_to_run is not None:
+                run_action(action["description"], function_to_run)
+            else:
+                print("Internal error: NOT IMPLEMENTED (no function assigned for the action)!")
+        else:
+            print("This function is not allowed in the current system state (%s)" % chat_client.state)
+    else:
+        print("Invalid input, please choose a valid action")
+    print()
+    return None
+
+
+def run_action(description, function_to_run):
+    """
+    Call the function of an action, under cProfile when the action is sampled by the profiler
+    """
+    profiled_run = profiler.sample(description) if profiler is not None else None
+    if profiled_run is None:
+        function_to_run()
+        return
+    try:
+        profiled_run.call(function_to_run)
+    finally:
+        profiled_run.finish()
+
+# Entrypoint for the application. In PyCharm you should see a green arrow on the left side.
+# By clicking it you run the application.
+if __name__ == '__main__':
+    profiler = profiling.profiler_from_environment("chat client")
+    if profiler is not None:
+        profiler.install_report_signal()
+    try:
+        run_chat_client()
+    finally:
+        if profiler is not None:
+            print("Profile written to %s" % ", ".join(profiler.close()))
\ No newline at end of file
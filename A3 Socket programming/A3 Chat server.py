@@ -0,0 +1,370 @@
+# A local chat server that speaks the same protocol as the chat server used by "A3 Chat client.py".
+# It makes it possible to test and benchmark the chat client without the remote server. Run it with:
+#   python "A3 Chat server.py" --port 1300
+# and set SERVER_HOST in the chat client to "localhost" (or use ChatClient("localhost", 1300)).
+#
+# All sessions are served by one asyncio event loop. The server keeps two indexes in memory: logged in username ->
+# session, and username -> inbox with the messages that user has not read yet. The inboxes are kept by an InboxStore,
+# which limits their memory use by spilling cold inboxes to disk (see inbox_store.py).
+#
+# Public messages are encoded once and the same bytes are pushed to every session in async mode. Writes never block:
+# when a client reads slower than messages arrive, its output waits in a bounded queue of that session. A session whose
+# queue overflows is a slow consumer. It is either downgraded to sync mode, so that its messages go to its inbox
+# instead, or disconnected, so that it cannot make the server hold an unbounded amount of data for it.
+#
+# Besides the commands of the protocol, the server supports "userevents": after it, a session in async mode is sent
+# "userjoined <username>" and "userleft <username>" lines, so that the client can keep its user list up to date.
+# "inbox <limit>" returns only the oldest messages of the inbox, at most limit of them, so that a large inbox can be
+# read in pages. The other messages stay in the inbox.
+
+import argparse
+import asyncio
+import random
+from collections import deque
+
+from inbox_store import InboxStore, INBOX_POLICIES, DEFAULT_RING_CAPACITY
+from script_support import raise_open_files_limit
+
+TCP_PORT = 1300
+# Usernames may only contain letters and digits
+USERNAME_ERROR = "loginerr incorrect username format"
+USERNAME_TAKEN_ERROR = "loginerr username already in use"
+# Public messages from sessions that are not logged in are sent with this name
+ANONYMOUS_SENDER = "anonymous"
+# A client sending a line longer than this is disconnected
+MAX_LINE_LENGTH = 65536
+# Bytes that may wait in the output queue of a session before it is handled as a slow consumer
+OUTPUT_QUEUE_LIMIT = 1024 * 1024
+# What to do with a slow consumer: move its messages to its inbox and switch it to sync mode, or disconnect it
+SLOW_CONSUMER_POLICIES = ["inbox", "drop"]
+JOKES = [
+    "There are 10 types of people in the world: those who understand binary, and those who don't.",
+    "A TCP packet walks into a bar and says: I'd like a beer. The bartender: You'd like a beer? TCP: Yes, a beer.",
+    "I would tell you a UDP joke, but you might not get it.",
+    "Why do programmers prefer dark mode? Because light attracts bugs.",
+    "The best thing about a Boolean is that even if you are wrong, you are only off by a bit.",
+    "There's no place like 127.0.0.1",
+]
+
+# When set to False, sessions that connect and disconnect are not printed
+print_messages = True
+
+
+class ChatServer:
+    """
+    The state shared by all the sessions
+    """
+
+    def __init__(self, inbox_store=None, output_queue_limit=OUTPUT_QUEUE_LIMIT, slow_consumer_policy="inbox"):
+        # Logged in users: username -> ChatSession
+        self.sessions_by_username = {}
+        # Messages waiting to be read with the inbox command, each line as bytes with "\n".
+        # An inbox is kept after its user logs out, the messages are there on the next login
+        self.inboxes = inbox_store if inbox_store is not None else InboxStore()
+        self.session_count = 0
+        # Sessions that asked for userjoined and userleft events with the userevents command
+        self.user_watchers = set()
+        self.output_queue_limit = output_queue_limit
+        self.slow_consumer_policy = slow_consumer_policy
+        self.downgraded_sessions = 0
+        self.dropped_sessions = 0
+
+    def login(self, session, username):
+        """
+        :return: The reply to the login command
+        """
+        if not username.isalnum():
+            return USERNAME_ERROR
+        owner = self.sessions_by_username.get(username)
+        if owner is session:
+            return "loginok"
+        if owner is not None:
+            return USERNAME_TAKEN_ERROR
+        self.logout(session)
+        session.username = username
+        self.sessions_by_username[username] = session
+        self.notify_watchers("userjoined", username)
+        return "loginok"
+
+    def logout(self, session):
+        if session.username is not None and self.sessions_by_username.get(session.username) is session:
+            del self.sessions_by_username[session.username]
+            self.notify_watchers("userleft", session.username)
+        session.username = None
+
+    def notify_watchers(self, event, username):
+        """
+        Send a userjoined or userleft event to the sessions in async mode that asked for them
+        """
+        if not self.user_watchers:
+            return
+        line = ("%s %s\n" % (event, username)).encode()
+        for watcher in self.user_watchers:
+            if watcher.mode == "async":
+                watcher.send(line)
+
+    def deliver(self, username, line):
+        """
+        Give a message line to a user: pushed right away to a session in async mode, otherwise kept in the inbox
+        """
+        session = self.sessions_by_username.get(username)
+        if session is not None and session.mode == "async":
+            session.send(line, pushed=True)
+        else:
+            self.inboxes.append(username, line)
+
+    def broadcast(self, sender_session, text):
+        """
+        Send a public message to all logged in users except the sender
+        :return: Number of recipients
+        """
+        sender = sender_session.username or ANONYMOUS_SENDER
+        # The line is encoded once and the same bytes are given to every recipient
+        line = ("msg %s %s\n" % (sender, text)).encode()
+        recipients = 0
+        for username in list(self.sessions_by_username):
+            if username != sender_session.username:
+                self.deliver(username, line)
+                recipients += 1
+        return recipients
+
+    def private_message(self, sender_session, arguments):
+        """
+        :param arguments: "recipient message text"
+        :return: The reply to the privmsg command
+        """
+        if sender_session.username is None:
+            return "msgerr unauthorized"
+        recipient, space, text = arguments.partition(" ")
+        if recipient not in self.sessions_by_username:
+            return "msgerr incorrect recipient"
+        self.deliver(recipient, ("privmsg %s %s\n" % (sender_session.username, text)).encode())
+        return "msgok 1"
+
+    def slow_consumer(self, session):
+        """
+        Called when the output queue of a session overflows. A session that was already downgraded and still does not
+        keep up with its replies is disconnected
+        """
+        if self.slow_consumer_policy == "inbox" and not session.downgraded:
+            self.downgraded_sessions += 1
+            if print_messages:
+                print("Session #%i is too slow, its messages go to the inbox" % session.session_id)
+            session.downgrade_to_inbox()
+        else:
+            self.dropped_sessions += 1
+            if print_messages:
+                print("Session #%i is too slow, disconnecting it" % session.session_id)
+            session.drop()
+
+    def take_inbox(self, session, limit=None):
+        """
+        :param limit: Take only the oldest messages, at most this many. None takes them all
+        :return: The inbox reply as a list of bytes-like chunks. The messages in it are removed from the inbox
+        """
+        if session.username is None:
+            return [b"inbox 0\n"]
+        if limit is None:
+            count, chunks = self.inboxes.drain(session.username)
+        else:
+            count, chunks = self.inboxes.take(session.username, limit)
+        return [("inbox %i\n" % count).encode()] + chunks
+
+    def user_list(self):
+        return "users " + " ".join(self.sessions_by_username)
+
+
+class ChatSession(asyncio.Protocol):
+    """
+    One client connection. Commands are lines of text. All the commands in one read are handled together, and their
+    replies are sent with one write.
+    While the transport has more buffered than its high-water mark, new output waits in output_queue. It is written
+    when the transport has room again
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.buffer = bytearray()
+        self.username = None
+        self.mode = "sync"
+        self.session_id = 0
+        # Output waiting for the transport: deque of (bytes-like, pushed), pushed is True for pushed message lines
+        self.output_queue = deque()
+        self.queued_bytes = 0
+        self.writing_paused = False
+        # True after the session was switched to sync mode for being a slow consumer
+        self.downgraded = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.session_count += 1
+        self.session_id = self.server.session_count
+        if print_messages:
+            print("Session #%i connected from %s" % (self.session_id, transport.get_extra_info("peername")))
+
+    def connection_lost(self, error):
+        self.server.user_watchers.discard(self)
+        self.server.logout(self)
+        self.transport = None
+        if print_messages:
+            print("Session #%i disconnected" % self.session_id)
+
+    def pause_writing(self):
+        self.writing_paused = True
+
+    def resume_writing(self):
+        self.writing_paused = False
+        self.flush_output()
+
+    def send(self, data, pushed=False):
+        """
+        Write data to the client without blocking. It is queued while the transport is paused
+        :param pushed: True for a pushed message line, which can be moved to the inbox if the session is too slow
+        """
+        if self.transport is None or self.transport.is_closing():
+            return
+        if not self.writing_paused and not self.output_queue:
+            self.transport.write(data)
+            return
+        self.output_queue.append((data, pushed))
+        self.queued_bytes += len(data)
+        if self.queued_bytes > self.server.output_queue_limit:
+            self.server.slow_consumer(self)
+
+    def flush_output(self):
+        # Every write can pause the transport again, so the queue is written one entry at a time
+        while self.output_queue and not self.writing_paused and self.transport is not None:
+            data, pushed = self.output_queue.popleft()
+            self.queued_bytes -= len(data)
+            self.transport.write(data)
+
+    def downgrade_to_inbox(self):
+        """
+        Switch to sync mode and move the queued message lines to the inbox. The client can read them with the inbox
+        command, or send async again when it has caught up
+        """
+        self.mode = "sync"
+        self.downgraded = True
+        remaining = deque()
+        for data, pushed in self.output_queue:
+            if pushed:
+                if self.username is not None:
+                    self.server.inboxes.append(self.username, data)
+                self.queued_bytes -= len(data)
+            else:
+                remaining.append((data, pushed))
+        self.output_queue = remaining
+
+    def drop(self):
+        self.output_queue.clear()
+        self.queued_bytes = 0
+        self.transport.abort()
+
+    def data_received(self, data):
+        self.buffer += data
+        replies = []
+        line_start = 0
+        while True:
+            line_end = self.buffer.find(b"\n", line_start)
+            if line_end < 0:
+                break
+            line = str(self.buffer[line_start:line_end], "utf-8", "replace").rstrip("\r")
+            line_start = line_end + 1
+            self.handle_command(line, replies)
+        del self.buffer[:line_start]
+        too_long = len(self.buffer) > MAX_LINE_LENGTH
+        if too_long:
+            replies.append(b"cmderr line too long\n")
+        if replies:
+            self.send(b"".join(replies))
+        if too_long:
+            self.transport.close()
+
+    def handle_command(self, line, replies):
+        """
+        Handle one command and add its reply to replies
+        """
+        command, space, arguments = line.partition(" ")
+        if command == "sync" or command == "async":
+            self.mode = command
+            self.downgraded = False
+            reply = "modeok"
+        elif command == "login":
+            reply = self.server.login(self, arguments)
+        elif command == "msg":
+            reply = "msgok %i" % self.server.broadcast(self, arguments)
+        elif command == "privmsg":
+            reply = self.server.private_message(self, arguments)
+        elif command == "inbox":
+            # "inbox <limit>" reads a large inbox in pages
+            if arguments and not arguments.isdigit():
+                reply = "cmderr inbox limit must be a number"
+            else:
+                replies.extend(self.server.take_inbox(self, int(arguments) if arguments else None))
+                return
+        elif command == "users":
+            reply = self.server.user_list()
+        elif command == "userevents":
+            self.server.user_watchers.add(self)
+            reply = "usereventsok"
+        elif command == "joke":
+            reply = "joke " + random.choice(JOKES)
+        elif command == "help":
+            reply = "supported sync async login msg privmsg inbox users userevents joke help"
+        elif command == "":
+            return
+        else:
+            reply = "cmderr command not supported"
+        replies.append((reply + "\n").encode())
+
+
+async def serve(host, port, inbox_store, output_queue_limit=OUTPUT_QUEUE_LIMIT, slow_consumer_policy="inbox"):
+    server = ChatServer(inbox_store, output_queue_limit, slow_consumer_policy)
+    loop = asyncio.get_running_loop()
+    listener = await loop.create_server(lambda: ChatSession(server), host, port, backlog=1024, reuse_address=True)
+    print("Chat server ready for connections on port %i" % port)
+    async with listener:
+        await listener.serve_forever()
+
+
+def run_chat_server(host="", port=TCP_PORT, inbox_store=None, output_queue_limit=OUTPUT_QUEUE_LIMIT,
+                    slow_consumer_policy="inbox"):
+    raise_open_files_limit()
+    if inbox_store is None:
+        inbox_store = InboxStore()
+    try:
+        asyncio.run(serve(host or None, port, inbox_store, output_queue_limit, slow_consumer_policy))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        inbox_store.close()
+    print("Chat server stopped")
+
+
+# Main entrypoint of the script
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local chat server for testing and benchmarking the chat client")
+    parser.add_argument("--host", default="", help="Address to listen on, all addresses by default")
+    parser.add_argument("--port", type=int, default=TCP_PORT)
+    parser.add_argument("--quiet", action="store_true", help="Do not print connecting and disconnecting sessions")
+    parser.add_argument("--inbox-memory", type=float, default=None,
+                        help="Megabytes all the inboxes may use in memory together, no limit by default")
+    parser.add_argument("--inbox-policy", choices=INBOX_POLICIES, default="spill",
+                        help="When the inbox memory is full: spill cold inboxes to disk, or evict their oldest messages")
+    parser.add_argument("--inbox-capacity", type=int, default=DEFAULT_RING_CAPACITY,
+                        help="Messages one inbox keeps in memory")
+    parser.add_argument("--inbox-spill-dir", default=None,
+                        help="Directory for the spilled inbox segment files, a temporary directory by default")
+    parser.add_argument("--output-queue", type=int, default=OUTPUT_QUEUE_LIMIT // 1024,
+                        help="Kilobytes that may wait to be sent to one session before it is a slow consumer")
+    parser.add_argument("--slow-consumers", choices=SLOW_CONSUMER_POLICIES, default="inbox",
+                        help="Move the messages of slow consumers to their inbox, or disconnect them")
+    arguments = parser.parse_args()
+
+    print_messages = not arguments.quiet
+    memory_limit = int(arguments.inbox_memory * 1024 * 1024) if arguments.inbox_memory is not None else None
+    run_chat_server(arguments.host, arguments.port,
+                    InboxStore(memory_limit, arguments.inbox_policy, arguments.inbox_capacity,
+                               arguments.inbox_spill_dir),
+                    arguments.output_queue * 1024, arguments.slow_consumers)
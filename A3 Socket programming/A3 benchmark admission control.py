@@ -0,0 +1,154 @@
+# Benchmark: how much one aggressive client slows down the well-behaved clients of "A3 server warmup.py", with and
+# without admission control (see admission_control.py).
+# The aggressive client keeps --pipeline requests in flight on each of its connections, like the warm-up client in a
+# loop without any sleep. At the same time, a well-behaved client sends --rate requests per second and measures their
+# latency. The two clients bind different loopback source addresses (127.0.0.1 and 127.0.0.2, Linux), so that each
+# has its own bucket for the limit per address. The scenarios:
+#  - no limits: every read is handled at once, as before admission control
+#  - fair turns: the event loop switches connection every REQUESTS_PER_TURN requests
+#  - rate limited: fair turns, and a token bucket per connection and per address, over the limit the server stops
+#    reading from the client ("delay"), or answers with an error and then waits until the buckets have earned the
+#    tokens of the rejected requests ("reject")
+# With both policies, the p99 latency of the well-behaved client must stay at or below its p99 without limits, and
+# it must get no errors. The script checks this at the end, and exits with status 1 when a scenario fails. The
+# scenarios are run --runs times, one after the other, and the median p99 of the runs is compared: a single p99
+# rests on a few samples, and moves a lot when something else runs on the machine.
+# Run it with, for example:
+#   python "A3 benchmark admission control.py" --mode selectors --duration 5
+
+import argparse
+import multiprocessing
+import statistics
+import sys
+import time
+
+from script_support import load_script, raise_open_files_limit, script_path
+
+BENCHMARK_SCRIPT = script_path("A3 benchmark server modes.py")
+# The server, and the source addresses of the client that sends as fast as it can and of the well-behaved one
+SERVER_HOST = "127.0.0.1"
+AGGRESSIVE_HOST = "127.0.0.1"
+WELL_BEHAVED_HOST = "127.0.0.2"
+
+
+server_modes = load_script("server_modes", BENCHMARK_SCRIPT)
+# The scenarios with admission control, and the one their latency is compared with
+LIMITED_SCENARIOS = ["rate limited, delay", "rate limited, reject"]
+BASELINE_SCENARIO = "no limits"
+
+
+def make_scenarios(connection_rate, address_rate):
+    """
+    :return: List of (name, server options)
+    """
+    rate_limits = ["--rate-limit", str(connection_rate), "--address-rate-limit", str(address_rate)]
+    return [
+        (BASELINE_SCENARIO, ["--requests-per-turn", "0"]),
+        ("fair turns", []),
+        (LIMITED_SCENARIOS[0], rate_limits + ["--rate-limit-policy", "delay"]),
+        (LIMITED_SCENARIOS[1], rate_limits + ["--rate-limit-policy", "reject"]),
+    ]
+
+
+def run_client(source_host, port, connections, duration, loop, pipeline, rate):
+    return server_modes.load_client.run_load_test(SERVER_HOST, port, connections, duration, loop, pipeline, rate,
+                                                  source_host=source_host)
+
+
+def measure_scenario(mode, port, server_arguments, duration, aggressive_connections, pipeline, rate):
+    """
+    :return: (result of the aggressive client, result of the well-behaved client), see run_load_test
+    """
+    process = server_modes.start_server_process(mode, port, server_arguments)
+    try:
+        # Separate processes, so that the clients do not slow each other down
+        with multiprocessing.get_context("fork").Pool(2) as pool:
+            aggressive, well_behaved = pool.starmap(run_client, [
+                (AGGRESSIVE_HOST, port, aggressive_connections, duration, "closed", pipeline, 0),
+                (WELL_BEHAVED_HOST, port, 1, duration, "open", 1, rate),
+            ])
+    finally:
+        server_modes.stop_server_process(process)
+    return aggressive, well_behaved
+
+
+def run_benchmark(mode, port, duration, aggressive_connections, pipeline, rate, connection_rate, address_rate,
+                  runs=1):
+    """
+    :return: Dictionary scenario name -> list with the (aggressive, well-behaved) results of every run
+    """
+    print("Mode %s: %i aggressive connections with %i requests in flight, one well-behaved client at %.0f requests/s"
+          % (mode, aggressive_connections, pipeline, rate))
+    results = {}
+    for run in range(runs):
+        if runs > 1:
+            print(" Run %i of %i" % (run + 1, runs))
+        for name, server_arguments in make_scenarios(connection_rate, address_rate):
+            aggressive, well_behaved = measure_scenario(mode, port, server_arguments, duration,
+                                                        aggressive_connections, pipeline, rate)
+            results.setdefault(name, []).append((aggressive, well_behaved))
+            print("  %-21s aggressive: %9.0f requests/s, %6i errors   well-behaved: p50 %7.3f ms, p99 %8.3f ms, "
+                  "max %8.3f ms, %i errors"
+                  % (name, aggressive["throughput_per_second"], aggressive["error_responses"],
+                     well_behaved["latency_ms"]["p50"], well_behaved["latency_ms"]["p99"],
+                     well_behaved["latency_ms"]["max"], well_behaved["error_responses"]))
+            # A new port for the next run, so that connections in TIME_WAIT do not disturb it
+            port += 1
+            time.sleep(0.5)
+    return results
+
+
+def median_p99(scenario_results):
+    """
+    :return: The median over the runs of the p99 latency of the well-behaved client, in ms
+    """
+    return statistics.median(well_behaved["latency_ms"]["p99"] for aggressive, well_behaved in scenario_results)
+
+
+def check_results(results):
+    """
+    :param results: What run_benchmark returns
+    :return: List of the problems found, empty when admission control kept the well-behaved client fast
+    """
+    problems = []
+    baseline_p99 = median_p99(results[BASELINE_SCENARIO])
+    for name in LIMITED_SCENARIOS:
+        p99 = median_p99(results[name])
+        if p99 > baseline_p99:
+            problems.append("%s: median p99 of the well-behaved client %.3f ms, above %.3f ms without limits"
+                            % (name, p99, baseline_p99))
+        error_count = sum(well_behaved["error_responses"] for aggressive, well_behaved in results[name])
+        if error_count:
+            problems.append("%s: %i errors for the well-behaved client" % (name, error_count))
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Latency of a well-behaved client next to an aggressive one, "
+                                                 "with and without admission control")
+    parser.add_argument("--mode", choices=server_modes.SERVER_MODES, default="selectors")
+    parser.add_argument("--port", type=int, default=5800)
+    parser.add_argument("--duration", type=float, default=5, help="Seconds to run each scenario")
+    parser.add_argument("--aggressive-connections", type=int, default=8)
+    parser.add_argument("--pipeline", type=int, default=1000,
+                        help="Requests the aggressive client keeps in flight on each connection")
+    parser.add_argument("--rate", type=float, default=200, help="Requests per second of the well-behaved client")
+    parser.add_argument("--connection-rate", type=float, default=5000,
+                        help="Rate limit of every connection in the rate limited scenarios")
+    parser.add_argument("--address-rate", type=float, default=20000,
+                        help="Rate limit of every client address in the rate limited scenarios")
+    parser.add_argument("--runs", type=int, default=3,
+                        help="Times every scenario is run, the check compares the median p99 of the runs")
+    arguments = parser.parse_args()
+
+    raise_open_files_limit()
+    benchmark_results = run_benchmark(arguments.mode, arguments.port, arguments.duration,
+                                      arguments.aggressive_connections, arguments.pipeline, arguments.rate,
+                                      arguments.connection_rate, arguments.address_rate, arguments.runs)
+    failures = check_results(benchmark_results)
+    for failure in failures:
+        print("FAILED", failure)
+    if failures:
+        sys.exit(1)
+    print("ok: with admission control the median p99 of the well-behaved client stays at or below the one without "
+          "limits")
@@ -0,0 +1,76 @@
+# Microbenchmark: the cost per expression of evaluating the requests of "A3 server warmup.py", without any network.
+#  - text: calculate_response for every request line, like the server did before the expression cache
+#  - text, cached: the same requests through the LRU cache of the server
+#  - batch: the frames of binary_protocol.py, evaluated with map() (and with NumPy, when it is installed)
+# The requests are small random numbers like the ones of make_numbers_to_send, so many of them repeat. Run it with:
+#   python "A3 benchmark batch evaluation.py" [number of expressions] [expressions per batch frame]
+
+import random
+import sys
+import time
+
+import batch_evaluator
+import binary_protocol
+from script_support import load_script, script_path
+
+SERVER_SCRIPT = script_path("A3 server warmup.py")
+
+
+server = load_script("server", SERVER_SCRIPT)
+
+
+def make_expressions(count, operators):
+    return [(random.randint(1, 20), random.choice(operators), random.randint(1, 20)) for i in range(count)]
+
+
+def time_text(expressions, calculate):
+    """
+    :return: (seconds per expression, the results)
+    """
+    messages = ["%i %s %i" % expression for expression in expressions]
+    start_time = time.perf_counter()
+    results = [calculate(message) for message in messages]
+    return (time.perf_counter() - start_time) / len(expressions), [int(result) for result in results]
+
+
+def time_batch(expressions, batch_size, evaluate):
+    """
+    :param evaluate: batch_evaluator.evaluate_batch_python or evaluate_batch_numpy
+    :return: (seconds per expression, the results)
+    """
+    payloads = [memoryview(binary_protocol.encode_expressions(expressions[start:start + batch_size]))[4:]
+                for start in range(0, len(expressions), batch_size)]
+    original_evaluate = batch_evaluator.evaluate_batch
+    batch_evaluator.evaluate_batch = evaluate
+    try:
+        start_time = time.perf_counter()
+        answers = [binary_protocol.calculate_expressions(payload) for payload in payloads]
+        elapsed = time.perf_counter() - start_time
+    finally:
+        batch_evaluator.evaluate_batch = original_evaluate
+    results = []
+    for frame_results, statuses in answers:
+        results.extend(binary_protocol.decode_response(memoryview(frame_results).cast("B")))
+    return elapsed / len(expressions), results
+
+
+if __name__ == '__main__':
+    expression_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    for operators in ["+", batch_evaluator.OPERATORS]:
+        expressions = make_expressions(expression_count, operators)
+        expected = [batch_evaluator.evaluate(left, batch_evaluator.OPERATORS.index(operator_text), right)
+                    for left, operator_text, right in expressions]
+        print("%i expressions with the operators %s, %i per batch frame:" % (expression_count, operators, batch_size))
+        server.set_expression_cache_size(batch_evaluator.EXPRESSION_CACHE_SIZE)
+        methods = [("text", lambda: time_text(expressions, server.calculate_response)),
+                   ("text, cached", lambda: time_text(expressions, server.cached_calculate_response)),
+                   ("batch, map()", lambda: time_batch(expressions, batch_size,
+                                                       batch_evaluator.evaluate_batch_python))]
+        if batch_evaluator.numpy is not None:
+            methods.append(("batch, NumPy", lambda: time_batch(expressions, batch_size,
+                                                               batch_evaluator.evaluate_batch_numpy)))
+        for name, measure in methods:
+            seconds, results = measure()
+            print("  %-14s %8.3f us per expression  %s"
+                  % (name, seconds * 1e6, "ok" if results == expected else "WRONG RESULTS"))
@@ -0,0 +1,87 @@
+# Benchmark: the text protocol of "A3 server warmup.py" versus its binary and batch modes (see binary_protocol.py).
+# The server is started as a separate process. All the protocols get the same number of requests in flight on every
+# connection: --batch pipelined text lines, or one frame of --batch requests. The benchmark reports the
+# throughput, the latency, and the CPU time the server used per request, read from /proc (Linux only).
+# Run it with, for example:
+#   python "A3 benchmark binary protocol.py" --mode selectors --connections 4 --batch 100 --duration 5
+
+import argparse
+import os
+import time
+
+from script_support import load_script, script_path
+
+BENCHMARK_SCRIPT = script_path("A3 benchmark server modes.py")
+
+
+server_modes = load_script("server_modes", BENCHMARK_SCRIPT)
+
+
+def read_cpu_seconds(pid):
+    """
+    :return: User plus system CPU time used by a process, in seconds, read from /proc (Linux only), 0 elsewhere
+    """
+    try:
+        with open("/proc/%i/stat" % pid) as stat_file:
+            # The process name may contain spaces, the fields are counted from the end of it
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+    except IOError:
+        return 0.0
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def measure_protocol(mode, port, protocol, connections, duration, batch, extra_arguments=()):
+    """
+    :return: The load test result of the warm-up client, with the server CPU time per request added
+    """
+    process = server_modes.start_server_process(mode, port, extra_arguments)
+    try:
+        cpu_before = read_cpu_seconds(process.pid)
+        if protocol != "text":
+            result = server_modes.load_client.run_load_test("localhost", port, connections, duration, "closed", 1,
+                                                            protocol=protocol, batch=batch)
+        else:
+            result = server_modes.load_client.run_load_test("localhost", port, connections, duration, "closed",
+                                                            batch)
+        cpu_used = read_cpu_seconds(process.pid) - cpu_before
+    finally:
+        server_modes.stop_server_process(process)
+    result["server_cpu_seconds"] = round(cpu_used, 2)
+    result["server_cpu_us_per_request"] = round(cpu_used * 1e6 / max(result["responses"], 1), 3)
+    return result
+
+
+def run_benchmark(mode, port, connections, duration, batch, extra_arguments=()):
+    print("Mode %s, %i connections, %i requests in flight on each:" % (mode, connections, batch))
+    results = {}
+    for protocol in server_modes.load_client.LOAD_PROTOCOLS:
+        result = measure_protocol(mode, port, protocol, connections, duration, batch, extra_arguments)
+        results[protocol] = result
+        print("  %-6s %10.0f requests/s  server CPU %7.3f us/request  latency p50 %s ms, p99 %s ms  errors %i"
+              % (protocol, result["throughput_per_second"], result["server_cpu_us_per_request"],
+                 result["latency_ms"]["p50"], result["latency_ms"]["p99"], result["error_responses"]))
+        # A new port for the next run, so that connections in TIME_WAIT do not disturb it
+        port += 1
+        time.sleep(0.5)
+    for protocol in ["binary", "batch"]:
+        print("  %s: %.1fx the throughput, %.1fx less server CPU per request than text"
+              % (protocol.capitalize(),
+                 results[protocol]["throughput_per_second"] / max(results["text"]["throughput_per_second"], 1),
+                 results["text"]["server_cpu_us_per_request"]
+                 / max(results[protocol]["server_cpu_us_per_request"], 0.001)))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the protocols of the warm-up server")
+    parser.add_argument("--mode", choices=server_modes.SERVER_MODES, default="selectors")
+    parser.add_argument("--port", type=int, default=5750)
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5, help="Seconds to run each protocol")
+    parser.add_argument("--batch", type=int, default=100,
+                        help="Requests in flight per connection: pipelined lines, or the requests in one frame")
+    parser.add_argument("--server-args", default="", help="Extra options for the server")
+    arguments = parser.parse_args()
+
+    run_benchmark(arguments.mode, arguments.port, arguments.connections, arguments.duration, arguments.batch,
+                  arguments.server_args.split())
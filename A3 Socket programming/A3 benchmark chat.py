@@ -0,0 +1,319 @@
+# End-to-end benchmark of the chat client and the chat protocol, against "A3 Chat server.py" on localhost.
+# The server is started as a separate process. The benchmark then:
+#  - connects and logs in many sessions
+#  - compares the users command with the cached user list of the client
+#  - sends private messages to all of them, one command at a time and as one pipelined batch
+#  - drains the inboxes
+#  - reads one large inbox (50000 messages by default) as a list and with the streaming iter_inbox
+#  - measures the time "Get a joke" waits, with and without the joke cache of the client
+#  - measures how long a public message takes to reach clients in async mode
+#  - measures the fan-out of public messages to many async subscribers (10000 by default), read by one selector
+#    instead of a ChatClient thread each, optionally with subscribers that never read (slow consumers)
+# Run it with, for example:
+#   python "A3 benchmark chat.py" --sessions 5000
+#   python "A3 benchmark chat.py" --fanout-subscribers 10000 --slow-subscribers 100 --message-size 1000
+#   python "A3 benchmark chat.py" --large-inbox 200000
+
+import argparse
+import selectors
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from socket import *
+
+from script_support import load_script, raise_open_files_limit, script_path
+
+chat_client_module = load_script("chat_client", "A3 Chat client.py")
+
+
+def start_chat_server(port, extra_arguments=()):
+    """
+    Start the local chat server in a separate process and wait until it accepts connections
+    """
+    command = [sys.executable, script_path("A3 Chat server.py"), "--port", str(port),
+               "--quiet"] + list(extra_arguments)
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            create_connection(("localhost", port), timeout=1).close()
+            return process
+        except IOError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("The chat server did not start")
+
+
+def connect_sessions(port, count, mode="sync", on_message=None):
+    """
+    :return: List of logged in ChatClient objects, with usernames user0, user1, ...
+    """
+    clients = []
+    for i in range(count):
+        client = chat_client_module.ChatClient("localhost", port, mode=mode, on_message=on_message)
+        client.connect()
+        client.login("%suser%i" % (mode, i))
+        clients.append(client)
+    return clients
+
+
+def measure_private_messages(sender, recipients, serial_count):
+    """
+    :return: Messages per second when sent one at a time, and when sent as one pipelined batch
+    """
+    start_time = time.perf_counter()
+    for recipient in recipients[:serial_count]:
+        sender.privmsg(recipient, "one at a time")
+    serial_rate = serial_count / (time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    results = sender.privmsg_many(recipients, "in one batch")
+    batch_rate = len(recipients) / (time.perf_counter() - start_time)
+    failed = sum(1 for result in results.values() if not result.ok)
+    return serial_rate, batch_rate, failed
+
+
+def measure_inbox_drain(clients):
+    """
+    :return: Inboxes read per second, and the number of messages read
+    """
+    start_time = time.perf_counter()
+    message_count = 0
+    for client in clients:
+        message_count += len(client.inbox())
+    return len(clients) / (time.perf_counter() - start_time), message_count
+
+
+def fill_inbox(sender, recipient, message_count):
+    for start in range(0, message_count, chat_client_module.BATCH_WINDOW):
+        count = min(chat_client_module.BATCH_WINDOW, message_count - start)
+        sender.send_messages([(recipient, "large inbox message %i" % i) for i in range(start, start + count)])
+
+
+def measure_large_inbox(port, message_count):
+    """
+    Read an inbox of message_count messages with inbox(), which returns them all in one list, and with iter_inbox,
+    which yields them while they are read
+    :return: Dictionary method -> (seconds until the first message, seconds for all of them, peak bytes allocated)
+    """
+    sender, reader = connect_sessions(port, 2)
+    results = {}
+    for method in ["inbox()", "iter_inbox()"]:
+        fill_inbox(sender, reader.username, message_count)
+        tracemalloc.start()
+        start_time = time.perf_counter()
+        first_message_time = None
+        read_count = 0
+        messages = reader.inbox() if method == "inbox()" else reader.iter_inbox()
+        for message in messages:
+            if first_message_time is None:
+                first_message_time = time.perf_counter() - start_time
+            read_count += 1
+        total_time = time.perf_counter() - start_time
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del messages
+        if read_count != message_count:
+            print("%s read %i messages instead of %i" % (method, read_count, message_count))
+        results[method] = (first_message_time, total_time, peak_bytes)
+    sender.disconnect()
+    reader.disconnect()
+    return results
+
+
+def measure_jokes(port, joke_count):
+    """
+    Time of joke() for a user who asks for a joke between other commands, here the users command. In sync mode the
+    cache is refilled when it is empty, by the joke() that finds it empty
+    :return: Dictionary cache size -> (median, max) seconds
+    """
+    results = {}
+    for cache_size in [0, chat_client_module.JOKE_CACHE_SIZE]:
+        client = chat_client_module.ChatClient("localhost", port, joke_cache_size=cache_size)
+        client.connect()
+        client.login("jokereader%i" % cache_size)
+        times = []
+        for i in range(joke_count):
+            start_time = time.perf_counter()
+            client.joke()
+            times.append(time.perf_counter() - start_time)
+            client.users(refresh=True)
+        client.disconnect()
+        times.sort()
+        results[cache_size] = (times[len(times) // 2], times[-1])
+    return results
+
+
+def measure_push_latency(port, subscriber_count, message_count):
+    """
+    Async mode: time from sending a public message until every subscriber has received it
+    :return: List of latencies in seconds, one per message
+    """
+    received = [0]
+    all_received = threading.Event()
+    lock = threading.Lock()
+
+    def on_message(message):
+        with lock:
+            received[0] += 1
+            if received[0] == subscriber_count:
+                all_received.set()
+
+    subscribers = connect_sessions(port, subscriber_count, "async", on_message)
+    sender = chat_client_module.ChatClient("localhost", port)
+    sender.connect()
+    sender.login("pushsender")
+    latencies = []
+    for i in range(message_count):
+        received[0] = 0
+        all_received.clear()
+        start_time = time.perf_counter()
+        sender.msg("push number %i" % i)
+        all_received.wait(10)
+        latencies.append(time.perf_counter() - start_time)
+    for client in subscribers + [sender]:
+        client.disconnect()
+    return latencies
+
+
+def connect_raw_subscribers(port, count, name_prefix, receive_buffer=None):
+    """
+    Open async sessions with plain sockets, so that thousands of them can be read by one thread
+    :param receive_buffer: Size of the socket receive buffer, small for the slow subscribers
+    :return: List of connected and logged in sockets
+    """
+    sockets = []
+    for i in range(count):
+        subscriber = socket(AF_INET, SOCK_STREAM)
+        if receive_buffer is not None:
+            subscriber.setsockopt(SOL_SOCKET, SO_RCVBUF, receive_buffer)
+        subscriber.connect(("localhost", port))
+        subscriber.sendall(("async\nlogin %s%i\n" % (name_prefix, i)).encode())
+        sockets.append(subscriber)
+    # Wait for the two replies of every session: modeok and loginok
+    for subscriber in sockets:
+        replies = b""
+        while replies.count(b"\n") < 2:
+            replies += subscriber.recv(100)
+        if not replies.endswith(b"loginok\n"):
+            raise RuntimeError("Login failed: %r" % replies)
+    return sockets
+
+
+def measure_fanout(port, subscriber_count, message_count, slow_count, message_size):
+    """
+    Time from sending a public message until all the (fast) subscribers have received it. The slow subscribers never
+    read, so the server has to queue their messages, and finally downgrade or disconnect them
+    :return: List of latencies in seconds, one per message
+    """
+    slow_subscribers = connect_raw_subscribers(port, slow_count, "slow", receive_buffer=4096)
+    subscribers = connect_raw_subscribers(port, subscriber_count, "fan")
+    selector = selectors.DefaultSelector()
+    for subscriber in subscribers:
+        subscriber.setblocking(False)
+        selector.register(subscriber, selectors.EVENT_READ)
+    sender = chat_client_module.ChatClient("localhost", port)
+    sender.connect()
+    sender.login("fanoutsender")
+    text = "x" * message_size
+    latencies = []
+    for i in range(message_count):
+        start_time = time.perf_counter()
+        sender.msg(text)
+        received = 0
+        while received < subscriber_count:
+            for key, events in selector.select(10):
+                received += key.fileobj.recv(65536).count(b"\n")
+        latencies.append(time.perf_counter() - start_time)
+    selector.close()
+    sender.disconnect()
+    for subscriber in subscribers + slow_subscribers:
+        subscriber.close()
+    return latencies
+
+
+def run_benchmark(port, session_count, serial_count, subscriber_count, fanout_count=0, slow_count=0,
+                  message_size=100, large_inbox_size=0, joke_count=0, server_arguments=()):
+    server = start_chat_server(port, server_arguments)
+    try:
+        start_time = time.perf_counter()
+        clients = connect_sessions(port, session_count)
+        print("Connected and logged in %i sessions in %.2f s" % (session_count, time.perf_counter() - start_time))
+
+        sender = clients[0]
+        recipients = [client.username for client in clients[1:]]
+        start_time = time.perf_counter()
+        users = sender.users(refresh=True)
+        print("users command with %i users: %.2f ms" % (len(users), (time.perf_counter() - start_time) * 1000))
+        start_time = time.perf_counter()
+        sender.users()
+        print("users from the cached user list: %.2f ms" % ((time.perf_counter() - start_time) * 1000))
+        start_time = time.perf_counter()
+        for i in range(serial_count):
+            sender.privmsg("nosuchuser%i" % i, "rejected")
+        print("Private messages to unknown users, rejected by the client: %10.0f messages/s"
+              % (serial_count / (time.perf_counter() - start_time)))
+
+        serial_rate, batch_rate, failed = measure_private_messages(sender, recipients,
+                                                                   min(serial_count, len(recipients)))
+        print("Private messages one at a time: %10.0f messages/s" % serial_rate)
+        print("Private messages in one batch:  %10.0f messages/s (%i failed)" % (batch_rate, failed))
+
+        inbox_rate, message_count = measure_inbox_drain(clients[1:])
+        print("Inboxes drained: %.0f inboxes/s, %i messages" % (inbox_rate, message_count))
+        for client in clients:
+            client.disconnect()
+
+        if large_inbox_size:
+            # Measured with tracemalloc, which makes both methods slower in the same way
+            for method, (first_time, total_time, peak_bytes) in measure_large_inbox(port, large_inbox_size).items():
+                print("Inbox of %i messages with %-13s first message after %8.2f ms, all after %7.0f ms, "
+                      "peak memory %6.1f MB" % (large_inbox_size, method + ":", first_time * 1000, total_time * 1000,
+                                                peak_bytes / 1e6))
+
+        if joke_count:
+            for cache_size, (median_time, max_time) in measure_jokes(port, joke_count).items():
+                print("Get a joke with a cache of %i jokes: median %.3f ms, max %.3f ms"
+                      % (cache_size, median_time * 1000, max_time * 1000))
+
+        latencies = sorted(measure_push_latency(port, subscriber_count, 20))
+        print("Public message to %i async subscribers: median %.2f ms, max %.2f ms"
+              % (subscriber_count, latencies[len(latencies) // 2] * 1000, latencies[-1] * 1000))
+
+        if fanout_count:
+            latencies = sorted(measure_fanout(port, fanout_count, 50, slow_count, message_size))
+            print("Fan-out of %i-byte messages to %i subscribers (and %i that do not read): "
+                  "median %.2f ms, max %.2f ms"
+                  % (message_size, fanout_count, slow_count, latencies[len(latencies) // 2] * 1000,
+                     latencies[-1] * 1000))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the chat client and the local chat server")
+    parser.add_argument("--port", type=int, default=1399)
+    parser.add_argument("--sessions", type=int, default=1000, help="Number of logged in sessions")
+    parser.add_argument("--serial", type=int, default=500,
+                        help="Number of private messages sent one at a time, for comparison with the batch")
+    parser.add_argument("--subscribers", type=int, default=100, help="Async sessions receiving public messages")
+    parser.add_argument("--fanout-subscribers", type=int, default=10000,
+                        help="Subscribers for the fan-out test, read by one selector. 0 skips the test")
+    parser.add_argument("--slow-subscribers", type=int, default=0,
+                        help="Subscribers in the fan-out test that never read their messages")
+    parser.add_argument("--message-size", type=int, default=100, help="Characters in a fan-out message")
+    parser.add_argument("--large-inbox", type=int, default=50000,
+                        help="Messages in the inbox read as a list and with iter_inbox. 0 skips the test")
+    parser.add_argument("--jokes", type=int, default=200,
+                        help="Jokes asked for, with and without the joke cache. 0 skips the test")
+    parser.add_argument("--server-args", default="",
+                        help='Extra options for the server, for example --server-args="--slow-consumers drop"')
+    arguments = parser.parse_args()
+
+    raise_open_files_limit()
+    run_benchmark(arguments.port, arguments.sessions, arguments.serial, arguments.subscribers,
+                  arguments.fanout_subscribers, arguments.slow_subscribers, arguments.message_size,
+                  arguments.large_inbox, arguments.jokes, arguments.server_args.split())
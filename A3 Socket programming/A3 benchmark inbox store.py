@@ -0,0 +1,116 @@
+# Benchmark: memory used (RSS) by the chat server inboxes as the number of stored messages grows.
+# Compares a dictionary of deques with one bytes object per message (how the chat server stored the inboxes before)
+# with the InboxStore, without a memory limit and with a limit using the spill and the evict policies.
+# Every variant runs in its own process, so that they do not affect each other's memory use. Linux only (/proc).
+# Run it with, for example:
+#   python "A3 benchmark inbox store.py" --messages 2000000 --users 10000 --limit 32
+
+import argparse
+import multiprocessing
+import random
+import time
+from collections import deque
+
+from inbox_store import InboxStore
+
+
+def read_memory_kb():
+    with open("/proc/self/status") as status_file:
+        for line in status_file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+class DequeInboxes:
+    """
+    The previous inbox storage of the chat server: username -> deque of bytes
+    """
+
+    def __init__(self):
+        self.inboxes = {}
+
+    def append(self, username, line):
+        self.inboxes.setdefault(username, deque()).append(line)
+
+    def drain(self, username):
+        messages = self.inboxes.pop(username, ())
+        return len(messages), list(messages)
+
+    def close(self):
+        pass
+
+
+def make_store(variant, memory_limit):
+    if variant == "deque":
+        return DequeInboxes()
+    if variant == "store":
+        return InboxStore()
+    return InboxStore(memory_limit, policy=variant.split("-")[1])
+
+
+def fill_store(variant, message_count, user_count, checkpoints, memory_limit, result_queue):
+    """
+    Runs in a separate process: store messages for random users and record the memory use at every checkpoint
+    """
+    random.seed(1)
+    store = make_store(variant, memory_limit)
+    usernames = ["user%i" % i for i in range(user_count)]
+    baseline_kb = read_memory_kb()
+    rows = []
+    start_time = time.perf_counter()
+    stored = 0
+    for checkpoint in checkpoints:
+        while stored < checkpoint:
+            sender = random.choice(usernames)
+            # Each line is a new bytes object, like the lines the chat server builds for every message
+            line = ("privmsg %s This is message number %i, sent while you were away\n" % (sender, stored)).encode()
+            store.append(random.choice(usernames), line)
+            stored += 1
+        rows.append((checkpoint, read_memory_kb() - baseline_kb))
+    insert_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    drained = 0
+    for username in usernames:
+        count, chunks = store.drain(username)
+        drained += count
+    drain_seconds = time.perf_counter() - start_time
+    store.close()
+    result_queue.put((variant, rows, insert_seconds, drained, drain_seconds))
+
+
+def run_benchmark(message_count, user_count, memory_limit_mb, variants):
+    checkpoints = [message_count * (i + 1) // 5 for i in range(5)]
+    context = multiprocessing.get_context("fork")
+    result_queue = context.Queue()
+    results = {}
+    for variant in variants:
+        process = context.Process(target=fill_store, args=(variant, message_count, user_count, checkpoints,
+                                                           int(memory_limit_mb * 1024 * 1024), result_queue))
+        process.start()
+        variant_name, rows, insert_seconds, drained, drain_seconds = result_queue.get()
+        process.join()
+        results[variant_name] = rows
+        print("%-12s insert %.2f s, drained %i messages in %.2f s"
+              % (variant_name, insert_seconds, drained, drain_seconds))
+
+    print()
+    print("Memory growth in MB (RSS), %i users, memory limit %s MB for the limited variants:"
+          % (user_count, memory_limit_mb))
+    print("%12s" % "messages" + "".join("%14s" % variant for variant in variants))
+    for row_index, checkpoint in enumerate(checkpoints):
+        print("%12i" % checkpoint + "".join("%14.1f" % (results[variant][row_index][1] / 1024)
+                                            for variant in variants))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="RSS of the inbox storage against the number of stored messages")
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--limit", type=float, default=16, help="Memory limit in MB for the limited variants")
+    parser.add_argument("--variants", nargs="+", default=["deque", "store", "store-spill", "store-evict"],
+                        choices=["deque", "store", "store-spill", "store-evict"])
+    arguments = parser.parse_args()
+
+    run_benchmark(arguments.messages, arguments.users, arguments.limit, arguments.variants)
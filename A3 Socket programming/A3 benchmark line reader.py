@@ -0,0 +1,77 @@
+# Microbenchmark: reading server lines one byte at a time (the old read_one_line) versus the buffered LineReader.
+# The "server" is one end of a local socket pair, so no network is needed. Run it with:
+#   python "A3 benchmark line reader.py" [number of lines]
+
+import sys
+import threading
+import time
+from socket import *
+
+from line_reader import LineReader
+
+# An inbox reply like the chat server sends it: a count line followed by one line per message.
+# The text is plain ASCII, because the old loop decodes every byte on its own and fails on multi-byte characters
+MESSAGE_LINE = "privmsg alice Hei! Har du sett paa oppgaven til fredag? Svar naar du kan :)\r\n"
+
+
+def read_one_line_byte_by_byte(sock):
+    """
+    The previous implementation of read_one_line in the chat client, kept here as the baseline
+    :param sock: The socket to read from.
+    :return: The line, without newline characters
+    """
+    newline_received = False
+    message = ""
+    while not newline_received:
+        character = sock.recv(1).decode()
+        if character == '\n':
+            newline_received = True
+        elif character == '\r':
+            pass
+        else:
+            message += character
+    return message
+
+
+def make_inbox_reply(line_count):
+    return ("inbox %i\r\n" % line_count + MESSAGE_LINE * line_count).encode()
+
+
+def time_reading(read_line, line_count):
+    """
+    Send an inbox reply through a socket pair and measure how long it takes to read all of its lines
+    :param read_line: Function that is given the receiving socket and returns a function reading one line
+    :param line_count: Number of message lines in the reply
+    :return: Elapsed time in seconds
+    """
+    server_side, client_side = socketpair()
+    data = make_inbox_reply(line_count)
+    # The reply is larger than the socket buffer, so it must be sent from another thread
+    sender = threading.Thread(target=server_side.sendall, args=(data,))
+    read_next_line = read_line(client_side)
+
+    start_time = time.perf_counter()
+    sender.start()
+    count = int(read_next_line().split(" ")[1])
+    for i in range(count):
+        read_next_line()
+    elapsed = time.perf_counter() - start_time
+
+    sender.join()
+    server_side.close()
+    client_side.close()
+    return elapsed
+
+
+def run_benchmark(line_count):
+    print("Reading an inbox reply with %i messages (%i bytes)" % (line_count, len(make_inbox_reply(line_count))))
+    old_time = time_reading(lambda sock: lambda: read_one_line_byte_by_byte(sock), line_count)
+    print("  recv(1) per character: %8.2f ms" % (old_time * 1000))
+    new_time = time_reading(lambda sock: LineReader(sock).read_line, line_count)
+    print("  LineReader:            %8.2f ms" % (new_time * 1000))
+    print("  Speedup:               %8.1fx" % (old_time / new_time))
+
+
+if __name__ == '__main__':
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    run_benchmark(lines)
@@ -0,0 +1,315 @@
+# Regression benchmark: replay the sessions of a traffic log (see traffic_log.py) against a local server, all of them
+# at the same time, and compare the throughput and latency with the recording and with earlier replays.
+# Record traffic with "A3 server warmup.py --record traffic.log", or by setting TRAFFIC_LOG in the chat client, then
+# run for example:
+#   python "A3 benchmark replay traffic.py" traffic.log --output run1.json
+#   python "A3 benchmark replay traffic.py" traffic.log --timing original --compare run1.json
+#
+# Each session gets its own connection and sends its requests in the recorded order. The requests sent one after the
+# other without waiting for a response (pipelined) are sent together, and the responses that followed them are read
+# before the next requests are sent. The time from sending such a group of requests until the last of its responses
+# is read is the latency of the exchange. With --timing original, the sessions start and the exchanges are sent at
+# the recorded times (divided by --speed), otherwise as fast as the server answers.
+# Responses that differ from the recorded ones are counted, but do not stop the replay: chat messages pushed by other
+# sessions and jokes are not the same from one run to the other.
+
+import argparse
+import asyncio
+import json
+import time
+from collections import namedtuple
+
+import binary_protocol
+import traffic_log
+from script_support import load_script, script_path
+
+LOAD_CLIENT_SCRIPT = script_path("A3 client warmup connecting to own server.py")
+# Replay timings: the recorded times between the exchanges, or none at all
+REPLAY_TIMINGS = ["fast", "original"]
+# Seconds to wait for the responses of one exchange before the session is given up
+RESPONSE_TIMEOUT = 10.0
+# Longest response line that can be read
+MAX_LINE_LENGTH = 1024 * 1024
+
+# Requests sent together and the responses that followed them. requests and responses are lists of (kind, data),
+# time is when the first request (or the first response, when there are no requests) was recorded
+Exchange = namedtuple("Exchange", ["time", "requests", "responses", "recorded_latency"])
+
+
+load_client = load_script("load_client", LOAD_CLIENT_SCRIPT)
+
+
+def make_exchanges(records):
+    """
+    :param records: The records of one session, see traffic_log.read_sessions
+    :return: List of Exchange
+    """
+    exchanges = []
+    requests = responses = None
+    first_time = last_time = None
+    for record in records:
+        if traffic_log.is_request(record.kind):
+            if requests is None or responses:
+                if requests is not None:
+                    exchanges.append(make_exchange(first_time, last_time, requests, responses))
+                requests, responses = [], []
+                first_time = record.time
+            requests.append((record.kind, record.data))
+        elif traffic_log.is_response(record.kind):
+            if requests is None:
+                requests, responses = [], []
+                first_time = record.time
+            responses.append((record.kind, record.data))
+            last_time = record.time
+    if requests is not None:
+        exchanges.append(make_exchange(first_time, last_time, requests, responses))
+    return exchanges
+
+
+def make_exchange(first_time, last_time, requests, responses):
+    recorded_latency = last_time - first_time if requests and responses else None
+    return Exchange(first_time, requests, responses, recorded_latency)
+
+
+def encode_requests(requests):
+    """
+    :return: The requests as the bytes to send
+    """
+    data = bytearray()
+    for kind, request in requests:
+        data += request
+        if kind == traffic_log.REQUEST_LINE:
+            data += b"\n"
+    return bytes(data)
+
+
+class ReplayStatistics:
+    """
+    Results of a replay, collected from all the sessions
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.requests_sent = 0
+        self.responses = 0
+        self.different_responses = 0
+        self.missing_responses = 0
+        self.connection_errors = 0
+        self.failed_sessions = 0
+
+    def as_dict(self, duration, settings):
+        """
+        :return: The results, ready to be written as JSON, with the same throughput and latency fields as the load
+            test of the warm-up client. Latencies are per exchange, in milliseconds
+        """
+        latencies = sorted(self.latencies)
+        result = dict(settings)
+        result.update({
+            "duration_seconds": round(duration, 3),
+            "exchanges": len(latencies),
+            "requests_sent": self.requests_sent,
+            "responses": self.responses,
+            "different_responses": self.different_responses,
+            "missing_responses": self.missing_responses,
+            "connection_errors": self.connection_errors,
+            "failed_sessions": self.failed_sessions,
+            "throughput_per_second": round(self.requests_sent / duration, 1) if duration > 0 else 0.0,
+            "latency_ms": {
+                "mean": round(1000 * sum(latencies) / len(latencies), 3) if latencies else None,
+                "p50": load_client.percentile(latencies, 50),
+                "p90": load_client.percentile(latencies, 90),
+                "p99": load_client.percentile(latencies, 99),
+                "max": round(1000 * latencies[-1], 3) if latencies else None,
+            },
+        })
+        return result
+
+
+def recorded_result(sessions):
+    """
+    :param sessions: List of the exchanges of every session
+    :return: The throughput and latency of the recording itself, in the format of ReplayStatistics.as_dict
+    """
+    statistics = ReplayStatistics()
+    start_time = min(exchanges[0].time for exchanges in sessions)
+    end_time = start_time
+    for exchanges in sessions:
+        for exchange in exchanges:
+            statistics.requests_sent += len(exchange.requests)
+            statistics.responses += len(exchange.responses)
+            if exchange.recorded_latency is not None:
+                statistics.latencies.append(exchange.recorded_latency)
+                end_time = max(end_time, exchange.time + exchange.recorded_latency)
+            end_time = max(end_time, exchange.time)
+    return statistics.as_dict(end_time - start_time, {"timing": "recorded"})
+
+
+async def read_response(reader, kind):
+    """
+    :return: One response line without its newline, or one whole frame
+    :raise ConnectionError: When the server closed the connection
+    """
+    if kind == traffic_log.RESPONSE_LINE:
+        line = await reader.readline()
+        if not line.endswith(b"\n"):
+            raise ConnectionError("Connection closed by the server")
+        return line.rstrip(b"\r\n")
+    try:
+        header = await reader.readexactly(binary_protocol.FRAME_HEADER_SIZE)
+        return header + await reader.readexactly(int.from_bytes(header, "little"))
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("Connection closed by the server")
+
+
+async def read_exchange_responses(reader, responses, statistics):
+    for kind, expected in responses:
+        if await read_response(reader, kind) != expected:
+            statistics.different_responses += 1
+        statistics.responses += 1
+
+
+async def replay_session(host, port, exchanges, start_delay, speed, statistics):
+    """
+    Replay the exchanges of one session on a new connection
+    :param start_delay: Seconds to wait before connecting, None to start right away and send without waiting
+    :param speed: With start_delay: the recorded times between the exchanges are divided by this
+    """
+    loop = asyncio.get_running_loop()
+    if start_delay is not None:
+        await asyncio.sleep(start_delay)
+    try:
+        reader, writer = await asyncio.open_connection(host, port, limit=MAX_LINE_LENGTH)
+    except OSError:
+        statistics.connection_errors += 1
+        statistics.missing_responses += sum(len(exchange.responses) for exchange in exchanges)
+        return
+    session_start = loop.time()
+    first_time = exchanges[0].time
+    responses_before = statistics.responses
+    try:
+        for exchange in exchanges:
+            if start_delay is not None:
+                delay = session_start + (exchange.time - first_time) / speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            started_at = time.perf_counter()
+            if exchange.requests:
+                writer.write(encode_requests(exchange.requests))
+                statistics.requests_sent += len(exchange.requests)
+                await writer.drain()
+            await asyncio.wait_for(read_exchange_responses(reader, exchange.responses, statistics), RESPONSE_TIMEOUT)
+            if exchange.requests and exchange.responses:
+                statistics.latencies.append(time.perf_counter() - started_at)
+    except (OSError, asyncio.TimeoutError):
+        statistics.failed_sessions += 1
+        statistics.missing_responses += (sum(len(exchange.responses) for exchange in exchanges)
+                                         - (statistics.responses - responses_before))
+    finally:
+        writer.close()
+
+
+async def replay_sessions(host, port, sessions, timing, speed):
+    """
+    :param sessions: List of the exchanges of every session
+    :return: ReplayStatistics, and the seconds the replay took
+    """
+    statistics = ReplayStatistics()
+    log_start = min(exchanges[0].time for exchanges in sessions)
+    start_time = time.perf_counter()
+    await asyncio.gather(*[
+        replay_session(host, port, exchanges, (exchanges[0].time - log_start) / speed if timing == "original" else None,
+                       speed, statistics)
+        for exchanges in sessions])
+    return statistics, time.perf_counter() - start_time
+
+
+def load_sessions(path, session_limit=None):
+    """
+    :return: (the description of the first recording in the log, list of the exchanges of every session that has
+        any requests or responses)
+    """
+    descriptions, records_by_session = traffic_log.read_sessions(path)
+    sessions = [make_exchanges(records) for records in records_by_session.values()]
+    sessions = [exchanges for exchanges in sessions if exchanges]
+    if session_limit is not None:
+        sessions = sessions[:session_limit]
+    return descriptions[0] if descriptions else {}, sessions
+
+
+def run_replay(path, host, port=None, timing="fast", speed=1.0, session_limit=None):
+    """
+    :param port: The port of the server, the port in the description of the recording when None
+    :return: (result of the replay, result of the recording), see ReplayStatistics.as_dict
+    """
+    description, sessions = load_sessions(path, session_limit)
+    if not sessions:
+        raise ValueError("%s has no recorded sessions" % path)
+    if port is None:
+        port = description.get("port")
+    settings = {
+        "log": path,
+        "source": description.get("source"),
+        "side": description.get("side"),
+        "host": host,
+        "port": port,
+        "sessions": len(sessions),
+        "timing": timing,
+        "speed": speed if timing == "original" else None,
+    }
+    statistics, duration = asyncio.run(replay_sessions(host, port, sessions, timing, speed))
+    return statistics.as_dict(duration, settings), recorded_result(sessions)
+
+
+def print_comparison(name, result, baseline):
+    """
+    Print the throughput and latency of result, and how much they changed from baseline
+    """
+    def change(new_value, old_value):
+        if new_value is None or not old_value:
+            return ""
+        return " (%+.1f%%)" % (100 * (new_value - old_value) / old_value)
+
+    throughput = result["throughput_per_second"]
+    print("  %-10s %10.1f requests/s%s" % (name, throughput, change(throughput, baseline["throughput_per_second"])))
+    for key in ["p50", "p90", "p99", "max"]:
+        latency = result["latency_ms"][key]
+        if latency is not None:
+            print("  %-10s %10.3f ms latency %s%s"
+                  % ("", latency, key, change(latency, baseline["latency_ms"][key])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a traffic log against a local server")
+    parser.add_argument("log", help="Traffic log written by the warm-up server with --record, or by the chat client")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=None, help="Port of the server, the recorded port by default")
+    parser.add_argument("--timing", choices=REPLAY_TIMINGS, default="fast",
+                        help="fast: send as soon as the previous responses arrived, original: at the recorded times")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="With --timing original: replay this many times faster than recorded")
+    parser.add_argument("--sessions", type=int, default=None, help="Replay only the first N sessions of the log")
+    parser.add_argument("--output", help="Write the JSON result to this file")
+    parser.add_argument("--compare", help="JSON result of an earlier replay to compare with")
+    arguments = parser.parse_args()
+
+    replay_result, recording_result = run_replay(arguments.log, arguments.host, arguments.port, arguments.timing,
+                                                 arguments.speed, arguments.sessions)
+    print("Replayed %i sessions, %i requests in %.2f s: %i responses, %i different from the recording, %i missing, "
+          "%i connection errors"
+          % (replay_result["sessions"], replay_result["requests_sent"], replay_result["duration_seconds"],
+             replay_result["responses"], replay_result["different_responses"], replay_result["missing_responses"],
+             replay_result["connection_errors"]))
+    if replay_result["side"] == "server":
+        # The recorded latency is only the time the server took to answer, the recording is not a useful baseline
+        print("Recorded by the server: %.1f requests/s" % recording_result["throughput_per_second"])
+    else:
+        print("Compared with the recording:")
+        print_comparison("replay", replay_result, recording_result)
+    if arguments.compare:
+        with open(arguments.compare) as baseline_file:
+            baseline_result = json.load(baseline_file)
+        print("Compared with %s:" % arguments.compare)
+        print_comparison("replay", replay_result, baseline_result)
+    if arguments.output:
+        with open(arguments.output, "w") as output_file:
+            json.dump(replay_result, output_file, indent=2)
@@ -0,0 +1,80 @@
+# Microbenchmark: sending many chat commands one send call each (the old send_command) versus the SendBuffer.
+# The "server" is one end of a local socket pair, read by another thread, so no network is needed. The received
+# bytes are compared with what was sent, to check that nothing was lost or reordered. Run it with:
+#   python "A3 benchmark send buffer.py" [number of commands]
+
+import sys
+import threading
+import time
+from socket import *
+
+from send_buffer import SendBuffer
+
+MESSAGE_TEXT = "Hei! Har du sett paa oppgaven til fredag? Svar naar du kan :)"
+
+
+def make_commands(count):
+    return [("privmsg", "user%i %s" % (i % 100, MESSAGE_TEXT)) for i in range(count)]
+
+
+def expected_bytes(commands):
+    return "".join("%s %s\n" % (command, arguments) for command, arguments in commands).encode()
+
+
+def send_one_by_one(sock, commands):
+    """
+    The previous send_command: build, encode and send every command on its own. The return value of send is not
+    checked, like before
+    :return: Number of send calls
+    """
+    for command, arguments in commands:
+        sock.send((command + " " + arguments + "\n").encode())
+    return len(commands)
+
+
+def send_buffered(sock, commands):
+    """
+    :return: Number of send calls
+    """
+    writer = SendBuffer(sock)
+    for command, arguments in commands:
+        writer.write_command(command, arguments)
+    writer.flush()
+    return writer.send_calls
+
+
+def time_sending(send, commands):
+    """
+    Send the commands through a socket pair while another thread reads them
+    :return: (elapsed seconds, number of send calls, True when the receiver got exactly the expected bytes)
+    """
+    sender_side, receiver_side = socketpair()
+    received = bytearray()
+    expected = expected_bytes(commands)
+
+    def receive_all():
+        while len(received) < len(expected):
+            data = receiver_side.recv(1 << 20)
+            if not data:
+                break
+            received.extend(data)
+
+    receiver = threading.Thread(target=receive_all)
+    receiver.start()
+    start_time = time.perf_counter()
+    send_calls = send(sender_side, commands)
+    receiver.join()
+    elapsed = time.perf_counter() - start_time
+    sender_side.close()
+    receiver_side.close()
+    return elapsed, send_calls, received == expected
+
+
+if __name__ == '__main__':
+    command_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    commands = make_commands(command_count)
+    print("Sending %i privmsg commands:" % command_count)
+    for name, send in [("one send per command", send_one_by_one), ("SendBuffer", send_buffered)]:
+        elapsed, send_calls, correct = time_sending(send, commands)
+        print("  %-22s %8.3f s  %10.0f commands/s  %8i send calls  %s"
+              % (name, elapsed, command_count / elapsed, send_calls, "ok" if correct else "DATA MISMATCH"))
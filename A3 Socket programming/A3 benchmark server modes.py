@@ -0,0 +1,212 @@
+# Benchmark for the server modes of "A3 server warmup.py".
+# For every mode the server is started as a separate process on localhost, then the benchmark measures:
+#  - how many idle connections the server can hold at the same time, and how much memory it uses for them
+#  - how many requests per second it answers with several active clients
+# With --scaling, it instead measures how the throughput grows with the number of worker processes (--workers).
+# Run it with, for example:
+#   python "A3 benchmark server modes.py" --idle-connections 20000 --connections 100 --duration 10
+#   python "A3 benchmark server modes.py" --scaling --modes selectors --connections 200 --pipeline 10
+
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from socket import *
+
+from script_support import load_script, raise_open_files_limit, script_path
+
+SERVER_SCRIPT = script_path("A3 server warmup.py")
+LOAD_CLIENT_SCRIPT = script_path("A3 client warmup connecting to own server.py")
+
+
+load_client = load_script("load_client", LOAD_CLIENT_SCRIPT)
+SERVER_MODES = ["threaded", "asyncio", "selectors", "pool"]
+
+
+def start_server_process(mode, port, extra_arguments=()):
+    """
+    Start the warm-up server in a separate process and wait until it accepts connections
+    :return: The server process
+    """
+    command = [sys.executable, SERVER_SCRIPT, "--mode", mode, "--port", str(port), "--quiet"] + list(extra_arguments)
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            probe = create_connection(("localhost", port), timeout=1)
+            probe.close()
+            return process
+        except IOError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("The server in %s mode did not start" % mode)
+
+
+def stop_server_process(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def read_process_status(pid):
+    """
+    :return: Resident memory in kilobytes and number of threads of a process, read from /proc (Linux only)
+    """
+    memory_kb = 0
+    threads = 0
+    try:
+        with open("/proc/%i/status" % pid) as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    memory_kb = int(line.split()[1])
+                elif line.startswith("Threads:"):
+                    threads = int(line.split()[1])
+    except IOError:
+        pass
+    return memory_kb, threads
+
+
+def hold_idle_connections(process, port, count):
+    """
+    Open many connections that do not send anything, then check that the server still answers on the last one
+    :return: Dictionary with the results
+    """
+    memory_before, threads_before = read_process_status(process.pid)
+    connections = []
+    start_time = time.perf_counter()
+    try:
+        for i in range(count):
+            connections.append(create_connection(("localhost", port), timeout=5))
+    except IOError as e:
+        print("  Could not open connection #%i: %s" % (len(connections) + 1, e))
+    connect_time = time.perf_counter() - start_time
+
+    still_answering = False
+    if connections:
+        try:
+            connections[-1].sendall(b"1 + 2\n")
+            still_answering = connections[-1].recv(100) == b"3\n"
+        except IOError:
+            pass
+    # Give the server a moment to accept and set up all the connections before reading its memory usage
+    time.sleep(1)
+    memory_after, threads_after = read_process_status(process.pid)
+    for connection in connections:
+        connection.close()
+
+    return {
+        "connections_held": len(connections),
+        "connect_seconds": round(connect_time, 3),
+        "still_answering": still_answering,
+        "server_memory_kb": memory_after,
+        "memory_per_connection_kb": round((memory_after - memory_before) / max(len(connections), 1), 2),
+        "server_threads": threads_after,
+    }
+
+
+def measure_requests_per_second(port, connection_count, duration, pipeline_depth=1):
+    """
+    Keep pipeline_depth requests in flight on every connection for the given time, using the load generator of the
+    warm-up client
+    :return: The load test result, with throughput and latency percentiles
+    """
+    return load_client.run_load_test("localhost", port, connection_count, duration, "closed", pipeline_depth)
+
+
+def measure_with_load_processes(port, connection_count, duration, pipeline_depth, process_count):
+    """
+    Run the throughput test from several processes at the same time, so that the load generator is not limited
+    to one CPU core when the server uses many
+    :return: Total number of requests answered per second
+    """
+    if process_count <= 1:
+        return measure_requests_per_second(port, connection_count, duration, pipeline_depth)["throughput_per_second"]
+    connections_per_process = max(connection_count // process_count, 1)
+    with multiprocessing.get_context("fork").Pool(process_count) as pool:
+        results = pool.starmap(measure_requests_per_second,
+                               [(port, connections_per_process, duration, pipeline_depth)] * process_count)
+    return sum(result["throughput_per_second"] for result in results)
+
+
+def run_scaling_benchmark(modes, port, max_workers, active_connections, duration, pipeline_depth, load_processes,
+                          extra_arguments=()):
+    """
+    Measure the throughput of every mode with 1, 2, ... max_workers server processes
+    :return: Dictionary mode -> list of requests per second, one entry for each number of workers
+    """
+    results = {}
+    for mode in modes:
+        print("Mode %s, %i active connections, %i requests in flight on each:" % (mode, active_connections,
+                                                                                   pipeline_depth))
+        results[mode] = []
+        for workers in range(1, max_workers + 1):
+            process = start_server_process(mode, port, ["--workers", str(workers)] + list(extra_arguments))
+            try:
+                requests_per_second = measure_with_load_processes(port, active_connections, duration,
+                                                                  pipeline_depth, load_processes)
+            finally:
+                stop_server_process(process)
+            results[mode].append(requests_per_second)
+            print("  %3i workers: %10.0f requests per second (%.2fx one worker)"
+                  % (workers, requests_per_second, requests_per_second / results[mode][0]))
+            port += 1
+    return results
+
+
+def run_benchmark(modes, port, idle_connections, active_connections, duration, pipeline_depth=1,
+                  extra_arguments=()):
+    results = {}
+    for mode in modes:
+        print("Mode %s:" % mode)
+        process = start_server_process(mode, port, extra_arguments)
+        try:
+            result = hold_idle_connections(process, port, idle_connections)
+            print("  Idle connections held: %i (server %i kB, %.2f kB per connection, %i threads), last one %s"
+                  % (result["connections_held"], result["server_memory_kb"], result["memory_per_connection_kb"],
+                     result["server_threads"], "answered" if result["still_answering"] else "NOT answered"))
+            load_result = measure_requests_per_second(port, active_connections, duration, pipeline_depth)
+            result["requests_per_second"] = load_result["throughput_per_second"]
+            result["latency_ms"] = load_result["latency_ms"]
+            print("  Requests per second with %i active connections, %i requests in flight on each: %.0f"
+                  % (active_connections, pipeline_depth, result["requests_per_second"]))
+            print("  Latency: p50 %s ms, p99 %s ms, p99.9 %s ms"
+                  % (result["latency_ms"]["p50"], result["latency_ms"]["p99"], result["latency_ms"]["p99.9"]))
+            results[mode] = result
+        finally:
+            stop_server_process(process)
+        # Use a new port for the next mode, so that connections in TIME_WAIT do not disturb it
+        port += 1
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the modes of the warm-up server")
+    parser.add_argument("--modes", nargs="+", choices=SERVER_MODES, default=SERVER_MODES)
+    parser.add_argument("--port", type=int, default=5700)
+    parser.add_argument("--idle-connections", type=int, default=1000)
+    parser.add_argument("--connections", type=int, default=50, help="Active connections for the throughput test")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds to run the throughput test")
+    parser.add_argument("--pipeline", type=int, default=1,
+                        help="Number of pipelined requests in flight on every active connection")
+    parser.add_argument("--scaling", action="store_true",
+                        help="Measure throughput with 1 to --max-workers server processes instead")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--load-processes", type=int, default=os.cpu_count() or 1,
+                        help="Processes generating load in the --scaling test")
+    parser.add_argument("--server-args", default="",
+                        help='Extra options for the server, for example --server-args="--pool-size 64 --backlog 1024"')
+    arguments = parser.parse_args()
+
+    raise_open_files_limit()
+    if arguments.scaling:
+        run_scaling_benchmark(arguments.modes, arguments.port, arguments.max_workers, arguments.connections,
+                              arguments.duration, arguments.pipeline, arguments.load_processes,
+                              arguments.server_args.split())
+    else:
+        run_benchmark(arguments.modes, arguments.port, arguments.idle_connections, arguments.connections,
+                      arguments.duration, arguments.pipeline, arguments.server_args.split())
@@ -1,123 +1,481 @@
-# A Simple TCP client, used as a warm-up exercise for socket programming assignment.
-# Course IELEx2001, NTNU
-
-import random
-import time
-from socket import *
-
-# Hostname of the server and TCP port number to use
-HOST = "localhost"
-PORT = 5678
-
-# The socket object (connection to the server and data exchange will happen using this variable)
-client_socket = None
-print("------Start of code------")
-
-
-def connect_to_server(host, port):
-    # The "global" keyword is needed so that this function refers to the globally defined client_socket variable
-    global client_socket
-
-    client_socket = socket(AF_INET, SOCK_STREAM)
-
-    try:
-        client_socket.connect((host, port))
-        return True
-    except IOError as e:
-        print("Error happened:", e)
-        return False
-
-
-def send_request_to_server(request):
-    # The "global" keyword is needed so that this function refers to the globally defined client_socket variable
-    global client_socket
-
-    try:
-        client_socket.send(request.encode())
-        return True
-    except IOError as e:
-        print("Error happened: ", e)
-        return False
-
-
-def read_response_from_server():
-    # The "global" keyword is needed so that this function refers to the globally defined client_socket variable
-    global client_socket
-    try:
-        response = client_socket.recv(1000)
-
-        return response
-    except IOError as e:
-        print("Error happened", e)
-        return None
-
-
-def close_connection():
-    # The "global" keyword is needed so that this function refers to the globally defined client_socket variable
-    global client_socket
-
-    try:
-        client_socket.close()
-        return True
-    except IOError as e:
-        print("error happened", e)
-        return False
-
-
-def make_numbers_to_send():
-    a = random.randint(1, 20)
-    b = random.randint(1, 20)
-    request = str(a) + " + " + str(b)
-    return request
-
-
-def run_client_tests():
-    print("Simple TCP client started")
-    if not connect_to_server(HOST, PORT):
-        return "ERROR: Failed to connect to the server"
-
-    print("Connection to the server established")
-
-    for i in range(5):
-        request = make_numbers_to_send()
-        if not send_request_to_server(request):
-            return "ERROR: Failed to send valid message to server!"
-
-        print("Sent ", request, " to server")
-        response = read_response_from_server()
-        if response is None:
-            return "ERROR: Failed to receive server's response!"
-
-        print("Server responded with: ", response)
-        seconds_to_sleep = 1
-        print("Sleeping %i seconds to allow simulate long client-server connection..." % seconds_to_sleep)
-        time.sleep(seconds_to_sleep)
-
-    if not (send_request_to_server("Game over") and close_connection()):
-        return "ERROR: Could not finish the conversation with the server"
-
-    print("Game over, connection closed")
-    # When the connection is closed, try to send one more message. It should fail.
-    if send_request_to_server("2+2"):
-        return "ERROR: sending a message after closing the connection did not fail!"
-
-    print("Sending another message after closing the connection failed as expected")
-    return "Simple TCP client finished"
-
-
-# Main entrypoint of the script
-
-result = run_client_tests()
-print(result)
-
-print("------End of code------")
-
-
-
-
-
-
-
-
-
-
+# A Simple TCP client, used as a warm-up exercise for socket programming assignment.
+# Course IELEx2001, NTNU
+#
+# Without options, the script runs the five test requests against the server. With --load it works as a
+# load generator instead, for example:
+#   python "A3 client warmup connecting to own server.py" --load --connections 50 --pipeline 10 --duration 10
+#   python "A3 client warmup connecting to own server.py" --load --loop open --rate 20000 --output result.json
+#   python "A3 client warmup connecting to own server.py" --load --protocol binary --batch 100 --pipeline 4
+# With --protocol binary or batch the load test uses the frames of binary_protocol.py, each carrying --batch requests.
+
+import argparse
+import asyncio
+import collections
+import json
+import math
+import random
+import time
+
+import batch_evaluator
+import binary_protocol
+from connection_manager import ConnectionManager, open_connection
+
+# Hostname of the server and TCP port number to use
+HOST = "localhost"
+PORT = 5678
+
+# The socket object (connection to the server and data exchange will happen using this variable)
+client_socket = None
+
+# Number of different requests prepared with make_numbers_to_send before a load test starts
+LOAD_REQUEST_VARIANTS = 1000
+# Seconds to wait for the outstanding responses when a load test ends
+LOAD_DRAIN_TIMEOUT = 2.0
+# Number of different request frames prepared before a load test with the binary or batch protocol starts
+LOAD_FRAME_VARIANTS = 50
+# The protocols of the server, see binary_protocol.py: text lines, binary frames of sums, batch frames of expressions
+LOAD_PROTOCOLS = ["text", "binary", "batch"]
+
+
+def connect_to_server(host, port):
+    # The "global" keyword is needed so that this function refers to the globally defined client_socket variable
+    global client_socket
+
+    # The socket gets connect and read timeouts, TCP keepalive and TCP_NODELAY (see connection_manager.py)
+    try:
+        client_socket = open_connection(host, port)
+        return True
+    except IOError as e:
+        print("Error happened:", e)
+    # The server may be restarting: try again a few times, waiting longer (with jitter) between the attempts
+    print("Trying to connect again...")
+    client_socket = ConnectionManager(host, port).reconnect()
+    return client_socket is not None
+
+
+def send_request_to_server(request):
+    # The "global" keyword is needed so that this function refers to the globally defined client_socket variable
+    global client_socket
+
+    try:
+        # The server reads one request per line, so every request ends with a newline
+        # send() may write only part of the data, sendall() repeats it until everything is sent
+        client_socket.sendall((request + "\n").encode())
+        return True
+    except IOError as e:
+        print("Error happened: ", e)
+        return False
+
+
+def read_response_from_server():
+    # The "global" keyword is needed so that this function refers to the globally defined client_socket variable
+    global client_socket
+    try:
+        response = client_socket.recv(1000)
+
+        return response
+    except IOError as e:
+        print("Error happened", e)
+        return None
+
+
+def close_connection():
+    # The "global" keyword is needed so that this function refers to the globally defined client_socket variable
+    global client_socket
+
+    try:
+        client_socket.close()
+        return True
+    except IOError as e:
+        print("error happened", e)
+        return False
+
+
+def make_numbers_to_send():
+    a = random.randint(1, 20)
+    b = random.randint(1, 20)
+    request = str(a) + " + " + str(b)
+    return request
+
+
+def run_client_tests():
+    print("Simple TCP client started")
+    if not connect_to_server(HOST, PORT):
+        return "ERROR: Failed to connect to the server"
+
+    print("Connection to the server established")
+
+    for i in range(5):
+        request = make_numbers_to_send()
+        if not send_request_to_server(request):
+            return "ERROR: Failed to send valid message to server!"
+
+        print("Sent ", request, " to server")
+        response = read_response_from_server()
+        if response is None:
+            return "ERROR: Failed to receive server's response!"
+
+        print("Server responded with: ", response)
+        seconds_to_sleep = 1
+        print("Sleeping %i seconds to allow simulate long client-server connection..." % seconds_to_sleep)
+        time.sleep(seconds_to_sleep)
+
+    if not (send_request_to_server("Game over") and close_connection()):
+        return "ERROR: Could not finish the conversation with the server"
+
+    print("Game over, connection closed")
+    # When the connection is closed, try to send one more message. It should fail.
+    if send_request_to_server("2+2"):
+        return "ERROR: sending a message after closing the connection did not fail!"
+
+    print("Sending another message after closing the connection failed as expected")
+    return "Simple TCP client finished"
+
+
+class LoadStatistics:
+    """
+    Results of a load test, collected from all the connections
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.requests_sent = 0
+        self.responses = 0
+        self.error_responses = 0
+        self.connection_errors = 0
+        self.connections_opened = 0
+
+    def add_response(self, latency, response):
+        self.latencies.append(latency)
+        self.responses += 1
+        if response.startswith(b"ERROR"):
+            self.error_responses += 1
+
+    def add_frame_response(self, latency, request_count, correct):
+        """
+        Binary protocol: one response frame with the answers to request_count requests. The latency is recorded
+        once for the frame
+        """
+        self.latencies.append(latency)
+        self.responses += request_count
+        if not correct:
+            self.error_responses += request_count
+
+    def as_dict(self, duration, settings):
+        """
+        :param duration: Seconds the load test was running
+        :param settings: The load test settings, included in the result
+        :return: The results, ready to be written as JSON. Latencies are in milliseconds
+        """
+        latencies = sorted(self.latencies)
+        result = dict(settings)
+        result.update({
+            "duration_seconds": round(duration, 3),
+            "connections_opened": self.connections_opened,
+            "connection_errors": self.connection_errors,
+            "requests_sent": self.requests_sent,
+            "responses": self.responses,
+            "error_responses": self.error_responses,
+            "throughput_per_second": round(self.responses / duration, 1) if duration > 0 else 0.0,
+            "latency_ms": {
+                "mean": round(1000 * sum(latencies) / len(latencies), 3) if latencies else None,
+                "p50": percentile(latencies, 50),
+                "p90": percentile(latencies, 90),
+                "p99": percentile(latencies, 99),
+                "p99.9": percentile(latencies, 99.9),
+                "max": round(1000 * latencies[-1], 3) if latencies else None,
+            },
+        })
+        return result
+
+
+def percentile(sorted_values, percent):
+    """
+    :param sorted_values: Latencies in seconds, sorted in ascending order
+    :param percent: The percentile to find, for example 99.9
+    :return: The percentile in milliseconds (nearest-rank method), or None when there are no values
+    """
+    if not sorted_values:
+        return None
+    # The smallest value with at least percent % of the values at or below it
+    index = max(0, math.ceil(len(sorted_values) * percent / 100) - 1)
+    return round(1000 * sorted_values[index], 3)
+
+
+def make_request_batch(requests, count):
+    """
+    :return: count requests taken at random from the prepared requests, as bytes ready to send in one write
+    """
+    return "".join(random.choice(requests) for i in range(count)).encode()
+
+
+async def receive_load_responses(reader, send_times, statistics, on_responses=None):
+    """
+    Read response lines and match them, in order, with the times their requests were sent
+    :param on_responses: Function called with the number of responses after every read (used by the closed loop)
+    """
+    buffer = bytearray()
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            return
+        received_at = time.perf_counter()
+        buffer += data
+        line_start = 0
+        response_count = 0
+        while True:
+            line_end = buffer.find(b"\n", line_start)
+            if line_end < 0:
+                break
+            if send_times:
+                statistics.add_response(received_at - send_times.popleft(), bytes(buffer[line_start:line_end]))
+            else:
+                # A line that answers no request: the server sent more lines than it was sent requests
+                statistics.error_responses += 1
+            line_start = line_end + 1
+            response_count += 1
+        del buffer[:line_start]
+        if on_responses is not None and response_count:
+            on_responses(response_count)
+
+
+def make_binary_requests(batch_size):
+    """
+    :return: List of (request frame, expected response frame) with batch_size random pairs of numbers each
+    """
+    frames = []
+    for i in range(LOAD_FRAME_VARIANTS):
+        pairs = [(random.randint(-2 ** 31, 2 ** 31 - 1), random.randint(-2 ** 31, 2 ** 31 - 1))
+                 for j in range(batch_size)]
+        frames.append((binary_protocol.encode_request(pairs),
+                       binary_protocol.encode_response([a + b for a, b in pairs])))
+    return frames
+
+
+def make_batch_requests(batch_size):
+    """
+    :return: List of (request frame, expected response frame) with batch_size random expressions each, with small
+        numbers like make_numbers_to_send and all the operators
+    """
+    frames = []
+    for i in range(LOAD_FRAME_VARIANTS):
+        expressions = [(random.randint(1, 20), random.choice(batch_evaluator.OPERATORS), random.randint(1, 20))
+                       for j in range(batch_size)]
+        answers = [batch_evaluator.evaluate_checked(left, batch_evaluator.OPERATORS.index(operator_text), right)
+                   for left, operator_text, right in expressions]
+        frames.append((binary_protocol.encode_expressions(expressions),
+                       binary_protocol.encode_batch_response([result for result, status in answers],
+                                                             [status for result, status in answers])))
+    return frames
+
+
+async def receive_binary_responses(reader, send_times, expected_responses, batch_size, statistics,
+                                   on_responses=None):
+    """
+    Binary and batch protocols: read response frames, check them against the expected ones and match them, in order, with the
+    times their request frames were sent
+    :param on_responses: Function called with the number of frames after every read (used by the closed loop)
+    """
+    buffer = bytearray()
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            return
+        received_at = time.perf_counter()
+        buffer += data
+        offset = 0
+        frame_count = 0
+        while True:
+            length = binary_protocol.read_frame_length(buffer, offset)
+            frame_end = offset + binary_protocol.FRAME_HEADER_SIZE + (length or 0)
+            if length is None or len(buffer) < frame_end:
+                break
+            if send_times:
+                expected = expected_responses.popleft()
+                statistics.add_frame_response(received_at - send_times.popleft(), batch_size,
+                                              buffer[offset:frame_end] == expected)
+            else:
+                # A frame that answers no request frame
+                statistics.error_responses += batch_size
+            offset = frame_end
+            frame_count += 1
+        del buffer[:offset]
+        if on_responses is not None and frame_count:
+            on_responses(frame_count)
+
+
+async def run_load_connection(host, port, requests, settings, end_time, statistics):
+    """
+    Drive one connection of the load test until end_time.
+    Closed loop: keep settings["pipeline"] requests in flight, send a new one for every response.
+    Open loop: send bursts of settings["pipeline"] requests at a fixed rate, without waiting for responses.
+    With the binary and batch protocols, every request is a frame of settings["batch"] requests.
+    The latency is measured from the time a request was scheduled, so a slow server can not hide its delays by
+    slowing down the load generator
+    """
+    binary = settings["protocol"] != "text"
+    try:
+        source_host = settings["source_host"]
+        reader, writer = await asyncio.open_connection(host, port,
+                                                       local_addr=(source_host, 0) if source_host else None)
+        if binary:
+            request, accepted = ((binary_protocol.BATCH_REQUEST, binary_protocol.BATCH_ACCEPTED)
+                                 if settings["protocol"] == "batch"
+                                 else (binary_protocol.BINARY_REQUEST, binary_protocol.BINARY_ACCEPTED))
+            writer.write((request + "\n").encode())
+            if await reader.readline() != (accepted + "\n").encode():
+                raise ConnectionError("The server does not support the %s protocol" % settings["protocol"])
+    except IOError:
+        statistics.connection_errors += 1
+        return
+    statistics.connections_opened += 1
+    pipeline_depth = settings["pipeline"]
+    send_times = collections.deque()
+    # Binary and batch protocols: the response frame expected for every request frame sent
+    expected_responses = collections.deque()
+
+    def send_requests(count, scheduled_time):
+        if binary:
+            frames = [random.choice(requests) for i in range(count)]
+            writer.write(b"".join(request for request, expected in frames))
+            expected_responses.extend(expected for request, expected in frames)
+            statistics.requests_sent += count * settings["batch"]
+        else:
+            writer.write(make_request_batch(requests, count))
+            statistics.requests_sent += count
+        send_times.extend([scheduled_time] * count)
+
+    def send_replacements(response_count):
+        if time.perf_counter() < end_time:
+            send_requests(response_count, time.perf_counter())
+
+    def start_receiver(on_responses=None):
+        if binary:
+            return asyncio.ensure_future(receive_binary_responses(reader, send_times, expected_responses,
+                                                                  settings["batch"], statistics, on_responses))
+        return asyncio.ensure_future(receive_load_responses(reader, send_times, statistics, on_responses))
+
+    receiver = None
+    try:
+        if settings["loop"] == "closed":
+            send_requests(pipeline_depth, time.perf_counter())
+            receiver = start_receiver(send_replacements)
+            await asyncio.sleep(max(end_time - time.perf_counter(), 0))
+        else:
+            receiver = start_receiver()
+            # Time between two bursts on this connection, so that all connections together reach the rate
+            interval = pipeline_depth * settings["connections"] / settings["rate"]
+            # Start the connections at different times, so that their bursts do not all come at once
+            next_send = time.perf_counter() + random.uniform(0, interval)
+            while next_send < end_time:
+                await asyncio.sleep(max(next_send - time.perf_counter(), 0))
+                send_requests(pipeline_depth, next_send)
+                await writer.drain()
+                next_send += interval
+            await asyncio.sleep(max(end_time - time.perf_counter(), 0))
+
+        # Wait for the responses that are still on their way, then end the conversation
+        drain_deadline = time.perf_counter() + LOAD_DRAIN_TIMEOUT
+        while send_times and not receiver.done() and time.perf_counter() < drain_deadline:
+            await asyncio.sleep(0.01)
+        # An empty frame ends the conversation in the binary protocol
+        writer.write(binary_protocol.make_frame(b"") if binary else b"Game over\n")
+        writer.close()
+    except IOError:
+        statistics.connection_errors += 1
+    finally:
+        if receiver is not None:
+            receiver.cancel()
+            # Collects the exception of a receiver that failed, so that it is not reported as never retrieved
+            await asyncio.gather(receiver, return_exceptions=True)
+
+
+async def run_load_connections(host, port, settings):
+    statistics = LoadStatistics()
+    if settings["protocol"] == "binary":
+        requests = make_binary_requests(settings["batch"])
+    elif settings["protocol"] == "batch":
+        requests = make_batch_requests(settings["batch"])
+    else:
+        requests = [make_numbers_to_send() + "\n" for i in range(LOAD_REQUEST_VARIANTS)]
+    start_time = time.perf_counter()
+    end_time = start_time + settings["duration"]
+    await asyncio.gather(*[run_load_connection(host, port, requests, settings, end_time, statistics)
+                           for i in range(settings["connections"])])
+    return statistics.as_dict(min(time.perf_counter(), end_time) - start_time, settings)
+
+
+def run_load_test(host, port, connections=10, duration=10.0, loop="closed", pipeline=1, rate=1000.0,
+                  protocol="text", batch=100, source_host=None):
+    """
+    Load-test the server with many concurrent connections, using requests made by make_numbers_to_send
+    :param host: The server to test
+    :param port: TCP port of the server
+    :param connections: Number of concurrent connections
+    :param duration: Seconds to send requests
+    :param loop: "closed": wait for responses before sending more, "open": send at a fixed rate no matter what
+    :param pipeline: Closed loop: requests in flight on every connection. Open loop: requests sent in each burst.
+        With the binary and batch protocols these are frames, not single requests
+    :param rate: Open loop only: requests (frames with the binary and batch protocols) per second, for all the
+        connections
+    :param protocol: "text", "binary" or "batch", see LOAD_PROTOCOLS
+    :param batch: Binary and batch protocols: requests in every frame
+    :param source_host: Local address the connections are made from, for example 127.0.0.2 to look like another
+        client to a server on 127.0.0.1. None lets the operating system choose
+    :return: Dictionary with throughput (requests per second) and latency percentiles (per frame with the binary
+        and batch protocols)
+    """
+    settings = {
+        "host": host,
+        "port": port,
+        "connections": connections,
+        "duration": duration,
+        "loop": loop,
+        "pipeline": pipeline,
+        "rate": rate if loop == "open" else None,
+        "protocol": protocol,
+        "batch": batch if protocol != "text" else None,
+        "source_host": source_host,
+    }
+    return asyncio.run(run_load_connections(host, port, settings))
+
+
+# Main entrypoint of the script
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Warm-up TCP client and load generator for the warm-up server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--load", action="store_true", help="Run a load test instead of the five test requests")
+    parser.add_argument("--connections", type=int, default=10, help="Number of concurrent connections")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to run the load test")
+    parser.add_argument("--loop", choices=["closed", "open"], default="closed",
+                        help="closed: send a new request for every response, open: send at a fixed --rate")
+    parser.add_argument("--rate", type=float, default=1000, help="Open loop: requests per second in total")
+    parser.add_argument("--pipeline", type=int, default=1,
+                        help="Closed loop: requests in flight per connection, open loop: requests per burst")
+    parser.add_argument("--protocol", choices=LOAD_PROTOCOLS, default="text",
+                        help="Load test protocol: text lines, or the binary or batch frames of binary_protocol.py")
+    parser.add_argument("--batch", type=int, default=100,
+                        help="Binary and batch protocols: requests in every frame")
+    parser.add_argument("--source-host", default=None,
+                        help="Local address to connect from, for example 127.0.0.2 to appear as another client")
+    parser.add_argument("--output", help="Write the JSON result to this file instead of printing it")
+    arguments = parser.parse_args()
+
+    if arguments.load:
+        load_result = run_load_test(arguments.host, arguments.port, arguments.connections, arguments.duration,
+                                    arguments.loop, arguments.pipeline, arguments.rate, arguments.protocol,
+                                    arguments.batch, arguments.source_host)
+        if arguments.output:
+            with open(arguments.output, "w") as output_file:
+                json.dump(load_result, output_file, indent=2)
+        else:
+            print(json.dumps(load_result, indent=2))
+    else:
+        HOST = arguments.host
+        PORT = arguments.port
+        print("------Start of code------")
+        result = run_client_tests()
+        print(result)
+
+        print("------End of code------")
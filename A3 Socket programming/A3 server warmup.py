@@ -1,66 +1,1344 @@
-# A Simple TCP server, used as a warm-up exercise for assignment A3
-from socket import *
-import threading
-welcome_socket = socket(AF_INET, SOCK_STREAM)
-
-
-def stop_server():
-    global welcome_socket
-    try:
-        welcome_socket.close()
-        print("Server shutdown")
-        return True
-    except IOError as e:
-        print("Error happened:", e)
-        return False
-
-
-def start_server():
-    global welcome_socket
-    try:
-        welcome_socket.bind(("", 5678))
-        welcome_socket.listen(1)
-        print("Server ready for connection")
-        return True
-    except IOError as e:
-        print("Error happened:", e)
-        return False
-
-
-def handle_next_client(connection_socket, client_id):
-    while True:
-        message = connection_socket.recv(100).decode()
-        print("Message from client #%i: %s" % (client_id, message))
-        if message == "Game over":
-            break
-        message_list = message.split()
-        respond = int(message_list[0]) + int(message_list[2])
-        respond_to_send = str(respond)
-        connection_socket.send(respond_to_send.encode())
-    connection_socket.close()
-
-
-def run_server():
-    global welcome_socket
-    print("Starting TCP server...")
-
-    if not start_server():
-        print("Error! Failed to start the server")
-
-    need_to_run = True
-    client_id = 1
-    while need_to_run:
-        connection_socket, client_address = welcome_socket.accept()
-        print("Client #%i connected from %s" % (client_id, client_address))
-        client_thread = threading.Thread(target=handle_next_client, args=(connection_socket, client_id))
-        client_id += 1
-        client_thread.start()
-
-    if not stop_server():
-        print("Error! Failed to stop the server")
-
-
-# Main entrypoint of the script
-if __name__ == '__main__':
-    run_server()
-
+# A Simple TCP server, used as a warm-up exercise for assignment A3
+from socket import *
+import argparse
+import asyncio
+import heapq
+import os
+import selectors
+import signal
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import batch_evaluator
+import binary_protocol
+import profiling
+import traffic_log
+from admission_control import AdmissionControl, RATE_LIMIT_ERROR, RATE_LIMIT_POLICIES
+from metrics import default_registry, install_dump_signal, start_interval_reporter, METRICS_FORMATS
+from script_support import raise_open_files_limit
+
+# TCP port the server listens on
+SERVER_PORT = 5678
+# How many connections the operating system queues for us before accept() is called. With a short queue, a burst of
+# new connections is refused or stalls in SYN retries
+LISTEN_BACKLOG = 128
+# The server engines that can be chosen with the --mode command line option
+SERVER_MODES = ["threaded", "asyncio", "selectors", "pool"]
+# What the pool mode does with a new connection when all workers are busy and the queue is full
+OVERLOAD_POLICIES = ["reject", "queue"]
+# Sent to a client that is turned away because the server is overloaded
+OVERLOAD_ERROR = "ERROR: server overloaded, try again later\n"
+# Size of the receive buffer of each connection. One read can contain many pipelined requests
+READ_BUFFER_SIZE = 65536
+# Requests are lines of text. A client that sends this many bytes without a newline is disconnected
+MAX_REQUEST_LENGTH = 1024
+# When True, several processes can listen on the same port, and the kernel spreads the connections between them
+REUSE_PORT = False
+# Seconds the supervisor waits for the workers to exit before killing them
+WORKER_SHUTDOWN_TIMEOUT = 10
+# Seconds a connection may stay open without sending anything before the server closes it
+IDLE_TIMEOUT = 300.0
+# Seconds a client may take to send the rest of a request it has started. Stops clients that send a request one
+# byte at a time from holding a connection forever
+READ_TIMEOUT = 30.0
+# Seconds between two runs of the reaper that closes expired connections. The accept loops also check this often
+# whether a shutdown was requested
+REAPER_INTERVAL = 0.5
+# Seconds the connections get to finish the requests they already sent, after SIGTERM or SIGINT. Shorter than
+# WORKER_SHUTDOWN_TIMEOUT, so that the workers are done before the supervisor kills them
+DRAIN_TIMEOUT = 5.0
+# A worker that crashes sooner than this after being started is restarted only after a delay, to avoid a busy loop
+WORKER_MIN_LIFETIME = 1.0
+# asyncio and selectors modes: requests (or frames) of one connection handled before the other connections get their
+# turn. Without it, a client pipelining thousands of requests holds the event loop until they are all answered.
+# None handles everything received in one read at once
+REQUESTS_PER_TURN = 256
+
+welcome_socket = socket(AF_INET, SOCK_STREAM)
+# When set to False, the messages received from the clients are not printed. Printing is slow under heavy load
+print_messages = True
+
+# Performance metrics of this process, written on SIGUSR1 or with --metrics-interval (see metrics.py)
+request_latency = default_registry.histogram(
+    "warmup_server_request_seconds", "Time to handle one request, averaged over the requests received in one read")
+requests_received = default_registry.counter("warmup_server_requests_total", "Requests received")
+responses_sent = default_registry.counter("warmup_server_responses_total", "Responses sent, including errors")
+bytes_received = default_registry.counter("warmup_server_received_bytes_total", "Bytes received from clients")
+bytes_sent = default_registry.counter("warmup_server_sent_bytes_total", "Bytes of responses sent to clients")
+errors = default_registry.counter("warmup_server_errors_total", "Errors by kind", "kind")
+connections_active = default_registry.gauge("warmup_server_connections_active", "Open client connections")
+connections_total = default_registry.counter("warmup_server_connections_total", "Client connections accepted")
+# Set by the SIGTERM and SIGINT handler: stop accepting connections, drain the open ones and exit
+shutdown_requested = threading.Event()
+# traffic_log.TrafficRecorder that records the requests and responses of every connection, set with --record
+traffic_recorder = None
+# Rate limits and connection cap, see admission_control.py. Without options nothing is limited
+admission_control = AdmissionControl()
+# profiling.Profiler of this process, None unless enabled with --profile-sample or --profile-memory
+profiler = None
+
+
+def stop_server():
+    global welcome_socket
+    try:
+        welcome_socket.close()
+        print("Server shutdown")
+        return True
+    except IOError as e:
+        print("Error happened:", e)
+        return False
+
+
+def start_server():
+    global welcome_socket
+    try:
+        # Allow restarting the server right away, without waiting for old connections to leave TIME_WAIT
+        welcome_socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        if REUSE_PORT:
+            welcome_socket.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+        welcome_socket.bind(("", SERVER_PORT))
+        welcome_socket.listen(LISTEN_BACKLOG)
+        print("Server ready for connection")
+        return True
+    except IOError as e:
+        print("Error happened:", e)
+        return False
+
+
+def calculate_response(message):
+    """
+    Handle one request from a client. Used by all the server modes
+    :param message: One request line received from the client, for example "3 + 4", "3+4" or "-3 * 4". The operators
+        are those of batch_evaluator.OPERATORS
+    :return: The response to send back to the client, or None when the client ended the conversation
+    :raise ValueError: When the request is not valid
+    :raise ZeroDivisionError: When the request divides by zero
+    """
+    if message == "Game over":
+        return None
+    respond = batch_evaluator.evaluate(*batch_evaluator.parse_expression(message))
+    return str(respond)
+
+
+def set_expression_cache_size(size):
+    """
+    Clients often send the same expressions again and again. The responses to the last size different requests are
+    remembered, so that a repeated request is answered with one dictionary lookup. 0 disables the cache
+    """
+    global cached_calculate_response
+    if size > 0:
+        cached_calculate_response = lru_cache(maxsize=size)(calculate_response)
+    else:
+        cached_calculate_response = calculate_response
+
+
+cached_calculate_response = calculate_response
+set_expression_cache_size(batch_evaluator.EXPRESSION_CACHE_SIZE)
+
+
+def log_message(client_id, message):
+    if print_messages:
+        print("Message from client #%i: %s" % (client_id, message))
+
+
+class ClientSession:
+    """
+    The request framing of one client connection, used by all the server modes.
+    Every request is one line of text. The received data is split on newlines, so one read may contain many
+    pipelined requests (or only a part of one). All the responses to one read are returned together, so that
+    they can be sent with one write.
+    After the "binary" or "batch" request the connection uses the frames described in binary_protocol.py instead.
+    A session can pause: it stops handling requests and keeps them in its buffer, when the rate limit of the client
+    is reached or, in the event loop modes, when the connection has had its turn. The server mode then stops reading
+    from the connection, and calls resume() once paused_until has passed
+    """
+
+    def __init__(self, client_id, close_connection=None, admitted=None, turn_limit=None):
+        """
+        :param close_connection: Function that closes the connection from any thread, see SessionRegistry. When
+            given, the session is added to open_sessions until close() is called
+        :param admitted: admission_control.AdmittedConnection of the connection, closed with the session, or None
+        :param turn_limit: Most requests handled by one call of process() or resume(), None for no limit
+        """
+        self.client_id = client_id
+        # Received data that does not end with a newline yet
+        self.buffer = bytearray()
+        # Set when the client ended the conversation, or the connection must be closed
+        self.finished = False
+        # Set after the client switched to the binary protocol, batch is also set for batch frames
+        self.binary = False
+        self.batch = False
+        # time.monotonic() of the last received data, and of the first data of a request that is not complete yet
+        self.last_activity = time.monotonic()
+        self.partial_since = None
+        self.registered = close_connection is not None
+        if self.registered:
+            open_sessions.add(self, close_connection)
+        self.admitted = admitted
+        self.rate_limiter = admitted.rate_limiter if admitted is not None else None
+        self.turn_limit = turn_limit
+        # time.monotonic() after which resume() must be called, None when the session is not paused
+        self.paused_until = None
+        # Number of the session in the traffic log, when the traffic is recorded
+        self.recorder = traffic_recorder
+        self.recorded_session = self.recorder.open_session() if self.recorder is not None else None
+        # The cProfile of the session, when it is one of the connections sampled by --profile-sample
+        self.profile = profiler.sample("connection") if profiler is not None else None
+        if self.profile is not None:
+            # Only the sampled sessions pay for the profiling: their methods are replaced by profiled ones
+            self.process = self.profile.wrap(self.process)
+            self.resume = self.profile.wrap(self.resume)
+        connections_total.inc()
+        connections_active.inc()
+
+    def close(self):
+        """
+        Called by the server mode when the connection is closed
+        """
+        if self.registered:
+            open_sessions.remove(self)
+        if self.recorder is not None:
+            self.recorder.close_session(self.recorded_session)
+        if self.admitted is not None:
+            self.admitted.close()
+        if self.profile is not None:
+            self.profile.finish()
+        connections_active.dec()
+
+    def expiry_reason(self, now):
+        """
+        :return: "read_timeout" when the client started a request and did not finish it in time, "idle_timeout" when
+            it has not sent anything for too long, or None when the connection may stay open
+        """
+        if self.partial_since is not None and now - self.partial_since > READ_TIMEOUT:
+            return "read_timeout"
+        if now - self.last_activity > IDLE_TIMEOUT:
+            return "idle_timeout"
+        return None
+
+    def request_in_progress(self):
+        """
+        :return: True when a part of a request was received, the connection is then not closed while draining
+        """
+        return bool(self.buffer)
+
+    def process(self, data):
+        """
+        Handle the newly received data
+        :param data: The received bytes, empty when the client has closed the connection
+        :return: The responses to all the complete requests, as bytes (empty if there is nothing to send)
+        """
+        if not data:
+            self.finished = True
+            return b""
+        self.last_activity = time.monotonic()
+        return self.handle_received(data)
+
+    def resume(self):
+        """
+        Handle the requests kept while the session was paused. It may pause again
+        :return: The responses, as bytes
+        """
+        return self.handle_received(b"")
+
+    def handle_received(self, data):
+        self.paused_until = None
+        if self.binary:
+            response_data = self.process_frames(data)
+        else:
+            response_data = self.process_lines(data)
+        if not self.buffer or self.paused_until is not None:
+            # While paused, the server is the one that is late, not the client
+            self.partial_since = None
+        elif self.partial_since is None:
+            self.partial_since = self.last_activity
+        return response_data
+
+    def pause(self, reason):
+        """
+        Stop handling requests until the client gets tokens again ("rate_limit", or "rejected" after requests were
+        answered with RATE_LIMIT_ERROR) or until the other connections have had their turn ("turn")
+        """
+        if reason == "turn":
+            self.paused_until = time.monotonic()
+            return
+        if reason == "rate_limit":
+            # Counted once per pause, rejected requests are counted one by one by process_lines
+            errors.inc(label="rate_limited")
+        self.paused_until = time.monotonic() + self.rate_limiter.wait_time()
+
+    def process_lines(self, data):
+        """
+        Text protocol: handle all the complete request lines in the received data
+        :return: The responses, as bytes
+        """
+        start_time = time.perf_counter()
+        self.buffer += data
+        responses = []
+        request_count = 0
+        rejected_count = 0
+        line_start = 0
+        # Requests that may still be handled in this call, None when there is no limit
+        turn_left = self.turn_limit
+        tokens_left = None
+        if self.rate_limiter is not None:
+            waiting = self.buffer.count(b"\n")
+            tokens_left = self.rate_limiter.take(waiting if turn_left is None else min(waiting, turn_left))
+        # The request lines to record in the traffic log, all with the time they were received
+        recorded_requests = [] if self.recorder is not None else None
+        received_at = time.time() if self.recorder is not None else None
+        while not self.finished and not self.binary:
+            line_end = self.buffer.find(b"\n", line_start)
+            if line_end < 0:
+                break
+            if turn_left == 0:
+                self.pause("turn")
+                break
+            message = str(self.buffer[line_start:line_end], "utf-8", "replace").rstrip("\r")
+            if message and tokens_left == 0 and self.rate_limiter.policy == "delay":
+                self.pause("rate_limit")
+                break
+            line_start = line_end + 1
+            if not message:
+                continue
+            # A rejected request uses up the turn like an answered one, so that a client without tokens can not
+            # flood the other connections with error replies
+            if turn_left is not None:
+                turn_left -= 1
+            if recorded_requests is not None:
+                recorded_requests.append((traffic_log.REQUEST_LINE, message.encode()))
+            if tokens_left == 0:
+                rejected_count += 1
+                responses.append(RATE_LIMIT_ERROR)
+                continue
+            request_count += 1
+            if tokens_left is not None:
+                tokens_left -= 1
+            self.handle_request(message, responses)
+        del self.buffer[:line_start]
+        if rejected_count:
+            errors.inc(rejected_count, label="rate_limited")
+            self.rate_limiter.charge(rejected_count)
+            self.pause("rejected")
+        if tokens_left:
+            # Tokens taken for empty lines, frames after a switch to the binary protocol, or requests left for later
+            self.rate_limiter.give_back(tokens_left)
+        if len(self.buffer) > MAX_REQUEST_LENGTH and not self.binary and self.paused_until is None:
+            errors.inc(label="request_too_long")
+            responses.append("ERROR: request too long\n")
+            self.finished = True
+        if recorded_requests is not None:
+            self.recorder.record_many(self.recorded_session, recorded_requests, received_at)
+            self.recorder.record_many(self.recorded_session, [(traffic_log.RESPONSE_LINE, response[:-1].encode())
+                                                              for response in responses])
+        response_data = "".join(responses).encode()
+        # The metrics are updated once per read and not once per request, to keep their cost low
+        if request_count:
+            request_latency.observe((time.perf_counter() - start_time) / request_count, count=request_count)
+            requests_received.inc(request_count)
+        bytes_received.inc(len(data))
+        bytes_sent.inc(len(response_data))
+        responses_sent.inc(len(responses))
+        if self.binary and self.buffer:
+            # The client switched to the binary protocol, the rest of the data is already binary frames
+            response_data += self.process_frames(b"")
+        return response_data
+
+    def process_frames(self, data):
+        """
+        Binary protocol: handle all the complete request frames in the received data
+        :return: The response frames, as bytes
+        """
+        start_time = time.perf_counter()
+        self.buffer += data
+        output = bytearray()
+        request_count = 0
+        offset = 0
+        turn_left = self.turn_limit
+        with memoryview(self.buffer) as buffer_view:
+            while True:
+                length = binary_protocol.read_frame_length(self.buffer, offset)
+                if length is None:
+                    break
+                if length == 0:
+                    if self.recorder is not None:
+                        self.recorder.record(self.recorded_session, traffic_log.REQUEST_FRAME,
+                                             buffer_view[offset:offset + binary_protocol.FRAME_HEADER_SIZE])
+                    self.finished = True
+                    break
+                if not (binary_protocol.is_valid_batch_length(length) if self.batch
+                        else binary_protocol.is_valid_request_length(length)):
+                    errors.inc(label="invalid_frame")
+                    self.finished = True
+                    break
+                payload_start = offset + binary_protocol.FRAME_HEADER_SIZE
+                if len(self.buffer) < payload_start + length:
+                    break
+                if turn_left == 0:
+                    self.pause("turn")
+                    break
+                # Frames are never rejected, they wait for tokens whatever the policy is
+                if self.rate_limiter is not None and not self.rate_limiter.take(
+                        length // (binary_protocol.EXPRESSION_SIZE if self.batch else binary_protocol.PAIR_SIZE),
+                        partial=False):
+                    self.pause("rate_limit")
+                    break
+                if turn_left is not None:
+                    turn_left -= 1
+                with buffer_view[payload_start:payload_start + length] as payload:
+                    if self.batch:
+                        results, statuses = binary_protocol.calculate_expressions(payload)
+                    else:
+                        results = binary_protocol.calculate_sums(payload)
+                        statuses = b""
+                response_start = len(output)
+                output += (len(results) * 8 + len(statuses)).to_bytes(binary_protocol.FRAME_HEADER_SIZE, "little")
+                output += results
+                output += statuses
+                request_count += len(results)
+                if self.recorder is not None:
+                    self.recorder.record(self.recorded_session, traffic_log.REQUEST_FRAME,
+                                         buffer_view[offset:payload_start + length])
+                    self.recorder.record(self.recorded_session, traffic_log.RESPONSE_FRAME,
+                                         memoryview(output)[response_start:])
+                offset = payload_start + length
+        del self.buffer[:offset]
+        if request_count:
+            request_latency.observe((time.perf_counter() - start_time) / request_count, count=request_count)
+            requests_received.inc(request_count)
+            responses_sent.inc(request_count)
+        bytes_received.inc(len(data))
+        bytes_sent.inc(len(output))
+        return output
+
+    def handle_request(self, message, responses):
+        log_message(self.client_id, message)
+        if message == binary_protocol.BINARY_REQUEST or message == binary_protocol.BATCH_REQUEST:
+            self.binary = True
+            self.batch = message == binary_protocol.BATCH_REQUEST
+            responses.append((binary_protocol.BATCH_ACCEPTED if self.batch else binary_protocol.BINARY_ACCEPTED)
+                             + "\n")
+            return
+        try:
+            respond_to_send = cached_calculate_response(message)
+        except ValueError:
+            # A malformed request gets an error reply, the connection stays open for the next request
+            errors.inc(label="invalid_request")
+            responses.append("ERROR: invalid request\n")
+            return
+        except ZeroDivisionError:
+            errors.inc(label="division_by_zero")
+            responses.append("ERROR: division by zero\n")
+            return
+        if respond_to_send is None:
+            self.finished = True
+        else:
+            responses.append(respond_to_send + "\n")
+
+
+class SessionRegistry:
+    """
+    The open connections of all the server modes, for the reaper and for the graceful shutdown.
+    Every session is registered with a function close_connection(force) that may be called from another thread than
+    the one serving the connection. Without force, it stops receiving: the serving code sees the end of the connection
+    after the requests already received are answered. With force, the connection is aborted right away
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # session -> close_connection function
+        self.sessions = {}
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def add(self, session, close_connection):
+        with self.lock:
+            self.sessions[session] = close_connection
+
+    def remove(self, session):
+        with self.lock:
+            self.sessions.pop(session, None)
+
+    def reap(self):
+        """
+        Close the connections that have been idle, or in the middle of a request, for too long
+        :return: Number of connections closed
+        """
+        now = time.monotonic()
+        with self.lock:
+            expired = [(session, close_connection, session.expiry_reason(now))
+                       for session, close_connection in self.sessions.items()]
+        expired = [(session, close_connection, reason) for session, close_connection, reason in expired if reason]
+        for session, close_connection, reason in expired:
+            errors.inc(label=reason)
+            if print_messages:
+                print("Closing the connection of client #%i: %s" % (session.client_id, reason.replace("_", " ")))
+            # A client that sent half a request and then nothing is not waiting for anything
+            close_connection(force=reason == "read_timeout")
+        return len(expired)
+
+    def close_idle(self):
+        """
+        While draining: stop receiving on the connections that are not in the middle of a request
+        """
+        with self.lock:
+            idle = [close_connection for session, close_connection in self.sessions.items()
+                    if not session.request_in_progress()]
+        for close_connection in idle:
+            close_connection(force=False)
+
+    def abort_all(self):
+        """
+        :return: Number of connections aborted
+        """
+        with self.lock:
+            remaining = list(self.sessions.values())
+        for close_connection in remaining:
+            close_connection(force=True)
+        return len(remaining)
+
+
+# The sessions of all the open connections of this process
+open_sessions = SessionRegistry()
+
+
+def request_shutdown(signal_number, frame):
+    """
+    SIGTERM and SIGINT handler: the server stops accepting connections and drains the open ones. A second signal
+    exits right away
+    """
+    if shutdown_requested.is_set():
+        print("Forced shutdown")
+        os._exit(1)
+    print("Shutting down, finishing the requests in progress (signal again to force)...")
+    shutdown_requested.set()
+
+
+def install_shutdown_handler():
+    """
+    Must be called from the main thread. SIGINT is left alone when it is ignored, as in the worker processes
+    """
+    signal.signal(signal.SIGTERM, request_shutdown)
+    if signal.getsignal(signal.SIGINT) is not signal.SIG_IGN:
+        signal.signal(signal.SIGINT, request_shutdown)
+
+
+def run_reaper():
+    """
+    Threaded modes: close the expired connections every REAPER_INTERVAL seconds
+    """
+    while not shutdown_requested.wait(REAPER_INTERVAL):
+        open_sessions.reap()
+
+
+def drain_connections():
+    """
+    Threaded modes, after the welcome socket is closed: wait up to DRAIN_TIMEOUT seconds for the clients to finish
+    the requests they started, closing every connection as soon as it has no request in progress. The connections
+    still open after that are aborted
+    """
+    print("Draining %i connections..." % len(open_sessions))
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    while len(open_sessions) and time.monotonic() < deadline:
+        open_sessions.close_idle()
+        time.sleep(0.05)
+    report_drain_result(open_sessions.abort_all())
+
+
+def report_drain_result(aborted):
+    if aborted:
+        errors.inc(aborted, label="drain_aborted")
+        print("%i connections did not finish in time and were aborted" % aborted)
+    else:
+        print("All connections finished")
+
+
+def shutdown_socket(connection_socket, force):
+    """
+    close_connection function of the threaded modes. Shutting down the receiving side makes the blocked recv of the
+    serving thread return, as if the client had closed the connection, while responses can still be sent. force
+    also stops the sending
+    """
+    try:
+        connection_socket.shutdown(SHUT_RDWR if force else SHUT_RD)
+    except IOError:
+        # Already closed
+        pass
+
+
+def accept_until_shutdown():
+    """
+    Threaded modes: wait for the next connection, checking for a shutdown request every REAPER_INTERVAL seconds
+    :return: (socket, address) of the new connection, or None when the server must shut down
+    """
+    global welcome_socket
+    while not shutdown_requested.is_set():
+        try:
+            return welcome_socket.accept()
+        except timeout:
+            continue
+    return None
+
+
+def admit_connection(connection_socket, client_address):
+    """
+    Threaded and selectors modes: count a new connection in admission_control
+    :return: admission_control.AdmittedConnection, or None when the connection cap is reached. The client is then told
+        that the server is overloaded and the connection is closed
+    """
+    admitted = admission_control.open_connection(client_address[0] if client_address else None)
+    if admitted is None:
+        errors.inc(label="connection_limit")
+        reject_connection(connection_socket)
+    return admitted
+
+
+def handle_next_client(connection_socket, client_id, admitted=None):
+    session = ClientSession(client_id, lambda force: shutdown_socket(connection_socket, force), admitted)
+    try:
+        while not session.finished:
+            responses = session.process(connection_socket.recv(READ_BUFFER_SIZE))
+            while True:
+                if responses:
+                    connection_socket.sendall(responses)
+                if session.paused_until is None:
+                    break
+                # Rate limited: nothing more is read from the client until it has tokens again, TCP makes it wait
+                time.sleep(max(0.0, session.paused_until - time.monotonic()))
+                responses = session.resume()
+    except IOError as e:
+        errors.inc(label="connection")
+        print("Error happened with client #%i: %s" % (client_id, e))
+    session.close()
+    connection_socket.close()
+
+
+def run_server():
+    global welcome_socket
+    print("Starting TCP server...")
+
+    if not start_server():
+        print("Error! Failed to start the server")
+        return
+
+    welcome_socket.settimeout(REAPER_INTERVAL)
+    threading.Thread(target=run_reaper, name="reaper", daemon=True).start()
+    client_id = 1
+    while True:
+        accepted = accept_until_shutdown()
+        if accepted is None:
+            break
+        connection_socket, client_address = accepted
+        if print_messages:
+            print("Client #%i connected from %s" % (client_id, client_address))
+        admitted = admit_connection(connection_socket, client_address)
+        if admitted is not None:
+            threading.Thread(target=handle_next_client, args=(connection_socket, client_id, admitted)).start()
+        client_id += 1
+
+    if not stop_server():
+        print("Error! Failed to stop the server")
+    drain_connections()
+
+
+async def handle_next_client_async(reader, writer, client_id, admitted):
+    """
+    Same as handle_next_client, but for the asyncio mode: the connection is served by a coroutine instead of a thread,
+    so an idle connection costs only a few kilobytes of memory
+    """
+    def close_connection(force):
+        # Called from the event loop thread, by the reaper task or while draining
+        if force:
+            writer.transport.abort()
+        else:
+            # Stop reading first: data from the client after the EOF would break the StreamReader
+            writer.transport.pause_reading()
+            reader.feed_eof()
+
+    session = ClientSession(client_id, close_connection, admitted, REQUESTS_PER_TURN)
+    try:
+        while not session.finished:
+            responses = session.process(await reader.read(READ_BUFFER_SIZE))
+            while True:
+                if responses:
+                    writer.write(responses)
+                    await writer.drain()
+                if session.paused_until is None:
+                    break
+                # At the end of a turn the delay is 0, the other connections ready to run go first
+                await asyncio.sleep(max(0.0, session.paused_until - time.monotonic()))
+                responses = session.resume()
+    except IOError as e:
+        errors.inc(label="connection")
+        print("Error happened with client #%i: %s" % (client_id, e))
+    finally:
+        session.close()
+        writer.close()
+
+
+async def serve_async():
+    global welcome_socket
+    # A list is used so that the nested function can update the counter
+    next_client_id = [1]
+
+    def on_client_connected(reader, writer):
+        client_id = next_client_id[0]
+        next_client_id[0] += 1
+        client_address = writer.get_extra_info("peername")
+        if print_messages:
+            print("Client #%i connected from %s" % (client_id, client_address))
+        admitted = admission_control.open_connection(client_address[0] if client_address else None)
+        if admitted is None:
+            errors.inc(label="connection_limit")
+            writer.write(OVERLOAD_ERROR.encode())
+            writer.close()
+            return None
+        return handle_next_client_async(reader, writer, client_id, admitted)
+
+    # The already listening welcome socket is handed over to asyncio
+    welcome_socket.setblocking(False)
+    server = await asyncio.start_server(on_client_connected, sock=welcome_socket, backlog=LISTEN_BACKLOG)
+    async with server:
+        # The reaper runs in the event loop, so the sessions are only touched by this thread
+        while not shutdown_requested.is_set():
+            await asyncio.sleep(REAPER_INTERVAL)
+            open_sessions.reap()
+        server.close()
+        print("Draining %i connections..." % len(open_sessions))
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        while len(open_sessions) and time.monotonic() < deadline:
+            open_sessions.close_idle()
+            await asyncio.sleep(0.05)
+        report_drain_result(open_sessions.abort_all())
+        # Let the aborted connections run their clean-up
+        await asyncio.sleep(0)
+
+
+def run_async_server():
+    print("Starting TCP server in asyncio mode...")
+
+    if not start_server():
+        print("Error! Failed to start the server")
+        return
+
+    asyncio.run(serve_async())
+
+    if not stop_server():
+        print("Error! Failed to stop the server")
+
+
+class ReactorConnection:
+    """
+    The state of one client connection in the selectors mode. The socket is non-blocking, so whatever can not be
+    sent right away stays in write_buffer until the socket becomes writable again. Incomplete requests are kept
+    in the read buffer of the session
+    """
+
+    def __init__(self, selector, connection_socket, client_id, admitted):
+        self.socket = connection_socket
+        self.session = ClientSession(client_id, lambda force: reactor_shutdown(selector, self, force), admitted,
+                                     REQUESTS_PER_TURN)
+        self.write_buffer = bytearray()
+        # The selector events the socket is currently registered for, 0 when it is not registered. A paused session
+        # is not read from
+        self.events = selectors.EVENT_READ
+        # When True, the connection is closed as soon as the write buffer is empty
+        self.closing = False
+
+
+def reactor_accept(selector, client_id):
+    """
+    Accept all the connections waiting on the welcome socket
+    :return: The client id to use for the next connection
+    """
+    global welcome_socket
+    while True:
+        try:
+            connection_socket, client_address = welcome_socket.accept()
+        except (BlockingIOError, InterruptedError):
+            return client_id
+        if print_messages:
+            print("Client #%i connected from %s" % (client_id, client_address))
+        admitted = admit_connection(connection_socket, client_address)
+        if admitted is not None:
+            connection_socket.setblocking(False)
+            selector.register(connection_socket, selectors.EVENT_READ,
+                              ReactorConnection(selector, connection_socket, client_id, admitted))
+        client_id += 1
+
+
+def reactor_close(selector, connection):
+    reactor_set_events(selector, connection, 0)
+    connection.socket.close()
+    connection.session.close()
+
+
+def reactor_shutdown(selector, connection, force):
+    """
+    close_connection function of the selectors mode, called from the reactor loop by the reaper or while draining.
+    Without force, the responses that are still in the write buffer are sent before the connection is closed
+    """
+    if connection.socket.fileno() < 0:
+        return
+    if force:
+        reactor_close(selector, connection)
+    elif not connection.closing:
+        connection.closing = True
+        reactor_write(selector, connection)
+
+
+def reactor_set_events(selector, connection, wanted_events):
+    if wanted_events == connection.events:
+        return
+    if not wanted_events:
+        selector.unregister(connection.socket)
+    elif not connection.events:
+        selector.register(connection.socket, wanted_events, connection)
+    else:
+        selector.modify(connection.socket, wanted_events, connection)
+    connection.events = wanted_events
+
+
+def reactor_read(selector, connection, read_view, paused):
+    """
+    Receive data from a readable connection and queue the responses to the complete requests in it
+    :param read_view: Receive buffer shared by all the connections. The reactor has only one thread, and the session
+        copies what it needs to keep, so one buffer is enough
+    :param paused: Heap of (time.monotonic() to resume, client id, ReactorConnection) of the paused sessions
+    """
+    try:
+        received = connection.socket.recv_into(read_view)
+    except (BlockingIOError, InterruptedError):
+        return
+    except IOError:
+        errors.inc(label="connection")
+        received = 0
+    connection.write_buffer += connection.session.process(read_view[:received])
+    reactor_processed(selector, connection, paused)
+
+
+def reactor_resume(selector, connection, paused):
+    """
+    Handle the requests a paused session kept, at the end of its pause
+    """
+    connection.write_buffer += connection.session.resume()
+    reactor_processed(selector, connection, paused)
+
+
+def reactor_processed(selector, connection, paused):
+    if connection.session.finished:
+        connection.closing = True
+    elif connection.session.paused_until is not None:
+        # The session stopped at the end of its turn or at its rate limit. The connections paused at the end of
+        # their turn are resumed in the order they were paused, after the events of the next select
+        heapq.heappush(paused, (connection.session.paused_until, connection.session.client_id, connection))
+    reactor_write(selector, connection)
+
+
+def reactor_write(selector, connection):
+    """
+    Send as much of the write buffer as the socket accepts without blocking. A partial send keeps the rest of the
+    buffer and registers the socket for write events, so the rest is sent when there is room for it
+    """
+    try:
+        while connection.write_buffer:
+            sent = connection.socket.send(connection.write_buffer)
+            del connection.write_buffer[:sent]
+    except (BlockingIOError, InterruptedError):
+        pass
+    except IOError:
+        errors.inc(label="connection")
+        reactor_close(selector, connection)
+        return
+
+    if not connection.write_buffer and connection.closing:
+        reactor_close(selector, connection)
+        return
+    wanted_events = selectors.EVENT_READ if connection.session.paused_until is None else 0
+    if connection.write_buffer:
+        wanted_events |= selectors.EVENT_WRITE
+    reactor_set_events(selector, connection, wanted_events)
+
+
+def run_selectors_server():
+    """
+    Single-threaded server: one selector (epoll on Linux) waits for all the non-blocking sockets at once
+    """
+    global welcome_socket
+    print("Starting TCP server in selectors mode...")
+
+    if not start_server():
+        print("Error! Failed to start the server")
+        return
+
+    welcome_socket.setblocking(False)
+    selector = selectors.DefaultSelector()
+    # The welcome socket is the only registered socket without a ReactorConnection
+    selector.register(welcome_socket, selectors.EVENT_READ, None)
+    read_view = memoryview(bytearray(READ_BUFFER_SIZE))
+    # Heap of the paused sessions, see reactor_read
+    paused = []
+
+    client_id = 1
+    next_reap = time.monotonic() + REAPER_INTERVAL
+    # time.monotonic() when the draining must end, None until a shutdown is requested
+    drain_deadline = None
+    while drain_deadline is None or (len(open_sessions) and time.monotonic() < drain_deadline):
+        select_timeout = REAPER_INTERVAL if drain_deadline is None else 0.05
+        if paused:
+            select_timeout = max(0.0, min(select_timeout, paused[0][0] - time.monotonic()))
+        for key, events in selector.select(select_timeout):
+            connection = key.data
+            if connection is None:
+                client_id = reactor_accept(selector, client_id)
+                continue
+            if events & selectors.EVENT_READ:
+                reactor_read(selector, connection, read_view, paused)
+            if events & selectors.EVENT_WRITE and connection.socket.fileno() >= 0:
+                reactor_write(selector, connection)
+        now = time.monotonic()
+        while paused and paused[0][0] <= now:
+            connection = heapq.heappop(paused)[2]
+            # Connections closed while paused are skipped
+            if connection.socket.fileno() >= 0:
+                reactor_resume(selector, connection, paused)
+        if drain_deadline is not None:
+            open_sessions.close_idle()
+        elif shutdown_requested.is_set():
+            # Stop accepting, then drain the open connections
+            selector.unregister(welcome_socket)
+            if not stop_server():
+                print("Error! Failed to stop the server")
+            print("Draining %i connections..." % len(open_sessions))
+            drain_deadline = time.monotonic() + DRAIN_TIMEOUT
+            open_sessions.close_idle()
+        elif time.monotonic() >= next_reap:
+            open_sessions.reap()
+            next_reap = time.monotonic() + REAPER_INTERVAL
+    report_drain_result(open_sessions.abort_all())
+    selector.close()
+
+
+class PoolStatistics:
+    """
+    Counters that show how saturated the worker pool is. Updated both by the accept loop and by the workers
+    """
+
+    def __init__(self, pool_size, queue_size):
+        self.lock = threading.Lock()
+        self.pool_size = pool_size
+        self.queue_size = queue_size
+        self.accepted = 0
+        self.rejected = 0
+        self.finished = 0
+        self.active = 0
+        self.queued = 0
+        self.peak_active = 0
+        self.peak_queued = 0
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+
+    def connection_queued(self):
+        with self.lock:
+            self.accepted += 1
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+
+    def connection_started(self, waited_seconds):
+        with self.lock:
+            self.queued -= 1
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+            self.total_queue_wait += waited_seconds
+            self.max_queue_wait = max(self.max_queue_wait, waited_seconds)
+
+    def connection_finished(self):
+        with self.lock:
+            self.active -= 1
+            self.finished += 1
+
+    def connection_rejected(self):
+        with self.lock:
+            self.rejected += 1
+
+    def queued_connection_rejected(self, waited_seconds):
+        """
+        A connection counted by connection_queued is turned away instead of being served: it is no longer counted as
+        accepted, so that accepted + rejected stays the number of connections
+        """
+        with self.lock:
+            self.queued -= 1
+            self.accepted -= 1
+            self.rejected += 1
+            self.max_queue_wait = max(self.max_queue_wait, waited_seconds)
+
+    def as_dict(self):
+        with self.lock:
+            started = self.finished + self.active
+            return {
+                "pool_size": self.pool_size,
+                "queue_size": self.queue_size,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "finished": self.finished,
+                "active_workers": self.active,
+                "queued_connections": self.queued,
+                "peak_active_workers": self.peak_active,
+                "peak_queued_connections": self.peak_queued,
+                "saturation": self.active / self.pool_size,
+                "average_queue_wait": self.total_queue_wait / started if started else 0.0,
+                "max_queue_wait": self.max_queue_wait,
+            }
+
+    def report(self):
+        stats = self.as_dict()
+        return ("Pool: %i/%i workers busy (%.0f%% saturated, peak %i), %i/%i queued (peak %i), "
+                "%i accepted, %i rejected, queue wait avg %.3f s max %.3f s"
+                % (stats["active_workers"], stats["pool_size"], stats["saturation"] * 100, stats["peak_active_workers"],
+                   stats["queued_connections"], stats["queue_size"], stats["peak_queued_connections"],
+                   stats["accepted"], stats["rejected"], stats["average_queue_wait"], stats["max_queue_wait"]))
+
+
+def reject_connection(connection_socket):
+    """
+    Tell the client that the server is overloaded and close the connection, without waiting for its requests
+    """
+    try:
+        connection_socket.send(OVERLOAD_ERROR.encode())
+    except IOError:
+        pass
+    connection_socket.close()
+
+
+def serve_pooled_client(connection_socket, client_id, admitted, queued_at, statistics, slots, queue_timeout):
+    """
+    Runs in a worker thread of the pool: serve one client from start to end, then free its slot
+    """
+    waited = time.monotonic() - queued_at
+    if (queue_timeout is not None and waited > queue_timeout) or shutdown_requested.is_set():
+        # The client waited in the queue for too long, it has most likely given up already. After a shutdown
+        # request, the connections still waiting for a worker are not served anymore
+        statistics.queued_connection_rejected(waited)
+        try:
+            admitted.close()
+            reject_connection(connection_socket)
+        finally:
+            slots.release()
+        return
+    statistics.connection_started(waited)
+    try:
+        handle_next_client(connection_socket, client_id, admitted)
+    finally:
+        statistics.connection_finished()
+        slots.release()
+
+
+def print_pool_statistics(statistics, interval):
+    while True:
+        time.sleep(interval)
+        print(statistics.report())
+
+
+def run_pool_server(pool_size, queue_size, overload_policy, queue_timeout, stats_interval):
+    """
+    Threaded server with a fixed number of worker threads. At most queue_size accepted connections wait for a free
+    worker. When they are all taken, new connections are either rejected right away with an error line
+    ("reject"), or the accept loop waits up to queue_timeout seconds for a free place ("queue")
+    """
+    global welcome_socket
+    print("Starting TCP server with a pool of %i workers..." % pool_size)
+
+    if not start_server():
+        print("Error! Failed to start the server")
+        return
+
+    statistics = PoolStatistics(pool_size, queue_size)
+    # One slot for every connection that is served or waiting for a worker
+    slots = threading.BoundedSemaphore(pool_size + queue_size)
+    executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="client-worker")
+    if stats_interval > 0:
+        threading.Thread(target=print_pool_statistics, args=(statistics, stats_interval), daemon=True).start()
+    timeout_in_queue = queue_timeout if overload_policy == "queue" else None
+    welcome_socket.settimeout(REAPER_INTERVAL)
+    threading.Thread(target=run_reaper, name="reaper", daemon=True).start()
+
+    client_id = 1
+    while True:
+        accepted = accept_until_shutdown()
+        if accepted is None:
+            break
+        connection_socket, client_address = accepted
+        if print_messages:
+            print("Client #%i connected from %s" % (client_id, client_address))
+        admitted = admit_connection(connection_socket, client_address)
+        if admitted is None:
+            client_id += 1
+            continue
+        if overload_policy == "queue":
+            got_slot = slots.acquire(timeout=queue_timeout)
+        else:
+            got_slot = slots.acquire(blocking=False)
+        if got_slot:
+            statistics.connection_queued()
+            executor.submit(serve_pooled_client, connection_socket, client_id, admitted, time.monotonic(), statistics,
+                            slots, timeout_in_queue)
+        else:
+            statistics.connection_rejected()
+            admitted.close()
+            reject_connection(connection_socket)
+        client_id += 1
+
+    if not stop_server():
+        print("Error! Failed to stop the server")
+    drain_connections()
+    executor.shutdown(wait=True)
+    print(statistics.report())
+
+
+def start_metrics_output(arguments):
+    """
+    Write the metrics every --metrics-interval seconds, and when the process receives SIGUSR1
+    """
+    path = arguments.metrics_file
+    if path is not None and arguments.workers > 1:
+        # Every worker process has its own metrics
+        path = "%s.%i" % (path, os.getpid())
+    install_dump_signal(default_registry, arguments.metrics_format, path)
+    if arguments.metrics_interval > 0:
+        start_interval_reporter(default_registry, arguments.metrics_interval, arguments.metrics_format, path)
+
+
+def start_traffic_recording(arguments):
+    """
+    Record the traffic of all the connections in the --record file
+    """
+    global traffic_recorder
+    path = arguments.record
+    if path is not None and arguments.workers > 1:
+        # A log file for every worker process
+        path = "%s.%i" % (path, os.getpid())
+    traffic_recorder = traffic_log.open_recorder(path, "warm-up server", side="server", port=SERVER_PORT,
+                                                  mode=arguments.mode)
+
+
+def start_profiling(arguments):
+    """
+    Profile the connections sampled by --profile-sample and trace the memory every --profile-memory seconds. The
+    reports are written on SIGUSR2 and when the server stops
+    """
+    global profiler
+    output = arguments.profile_output
+    if arguments.workers > 1:
+        output = "%s.%i" % (output, os.getpid())
+    profiler = profiling.create_profiler("warm-up server (%s mode)" % arguments.mode, arguments.profile_sample,
+                                         arguments.profile_memory, output, open_sessions.__len__)
+    if profiler is not None:
+        profiler.install_report_signal()
+
+
+def run_selected_mode(arguments):
+    """
+    Run the server engine chosen on the command line
+    """
+    start_metrics_output(arguments)
+    start_traffic_recording(arguments)
+    start_profiling(arguments)
+    install_shutdown_handler()
+    try:
+        if arguments.mode == "asyncio":
+            run_async_server()
+        elif arguments.mode == "selectors":
+            run_selectors_server()
+        elif arguments.mode == "pool":
+            run_pool_server(arguments.pool_size, arguments.queue_size, arguments.overload, arguments.queue_timeout,
+                            arguments.stats_interval)
+        else:
+            run_server()
+    finally:
+        if traffic_recorder is not None:
+            traffic_recorder.close()
+        if profiler is not None:
+            print("Profile written to %s" % ", ".join(profiler.close()))
+
+
+def start_worker(arguments):
+    """
+    Fork a worker process that runs its own server on the shared port
+    :return: The process id of the worker
+    """
+    global welcome_socket
+    pid = os.fork()
+    if pid != 0:
+        return pid
+
+    # This is the worker process. Shutdown is controlled by the supervisor with SIGTERM, which drains the connections
+    # of the worker (see install_shutdown_handler), so Ctrl+C in the terminal (sent to all the processes) is left to
+    # the supervisor
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    exit_code = 0
+    try:
+        # The inherited socket object is shared with the other processes, every worker needs a socket of its own
+        welcome_socket = socket(AF_INET, SOCK_STREAM)
+        run_selected_mode(arguments)
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        os._exit(exit_code)
+
+
+def run_supervisor(arguments):
+    """
+    Start arguments.workers worker processes that all listen on the same port with SO_REUSEPORT. Workers that crash
+    are started again. On SIGTERM or SIGINT all the workers are stopped, and the supervisor exits when they are gone
+    """
+    print("Starting %i worker processes..." % arguments.workers)
+    # Process id of each running worker, and the time it was started
+    workers = {}
+    shutting_down = [False]
+
+    def request_shutdown(signal_number, frame):
+        shutting_down[0] = True
+        for worker_pid in workers:
+            try:
+                os.kill(worker_pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def forward_signal(signal_number, frame):
+        for worker_pid in workers:
+            try:
+                os.kill(worker_pid, signal_number)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+    # Each worker writes its own metrics (SIGUSR1) and profile (SIGUSR2)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, forward_signal)
+        signal.signal(signal.SIGUSR2, forward_signal)
+    for i in range(arguments.workers):
+        workers[start_worker(arguments)] = time.monotonic()
+
+    kill_deadline = None
+    while workers:
+        if shutting_down[0]:
+            if kill_deadline is None:
+                kill_deadline = time.monotonic() + WORKER_SHUTDOWN_TIMEOUT
+            elif time.monotonic() > kill_deadline:
+                print("Workers did not stop in time, killing them")
+                for worker_pid in workers:
+                    os.kill(worker_pid, signal.SIGKILL)
+                kill_deadline = float("inf")
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                time.sleep(0.1)
+                continue
+        else:
+            pid, status = os.waitpid(-1, 0)
+        started_at = workers.pop(pid, None)
+        if started_at is None or shutting_down[0]:
+            continue
+        if os.waitstatus_to_exitcode(status) == 0:
+            print("Worker %i stopped" % pid)
+            continue
+        print("Worker %i crashed with status %i, starting a new one" % (pid, os.waitstatus_to_exitcode(status)))
+        if time.monotonic() - started_at < WORKER_MIN_LIFETIME:
+            time.sleep(WORKER_MIN_LIFETIME)
+        if not shutting_down[0]:
+            workers[start_worker(arguments)] = time.monotonic()
+    print("All workers stopped")
+
+
+# Main entrypoint of the script
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Warm-up TCP server, replies with the result of simple arithmetic")
+    parser.add_argument("--mode", choices=SERVER_MODES, default="threaded",
+                        help="threaded: one thread per client (default), asyncio: all clients in one event loop, "
+                             "selectors: single-threaded reactor with non-blocking sockets, "
+                             "pool: fixed number of worker threads")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="TCP port to listen on")
+    parser.add_argument("--backlog", type=int, default=LISTEN_BACKLOG, help="Length of the listen queue")
+    parser.add_argument("--quiet", action="store_true", help="Do not print every received message")
+    parser.add_argument("--pool-size", type=int, default=32, help="Pool mode: number of worker threads")
+    parser.add_argument("--queue-size", type=int, default=64,
+                        help="Pool mode: number of accepted connections that may wait for a free worker")
+    parser.add_argument("--overload", choices=OVERLOAD_POLICIES, default="reject",
+                        help="Pool mode: reject new connections right away when the queue is full, "
+                             "or wait for a free place in the queue")
+    parser.add_argument("--queue-timeout", type=float, default=5.0,
+                        help="Pool mode: seconds a connection may wait for a worker with --overload queue")
+    parser.add_argument("--stats-interval", type=float, default=0,
+                        help="Pool mode: print pool saturation statistics every N seconds")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of server processes sharing the port with SO_REUSEPORT (Linux), "
+                             "each running the chosen mode")
+    parser.add_argument("--metrics-interval", type=float, default=0,
+                        help="Write the performance metrics every N seconds. They are also written on SIGUSR1")
+    parser.add_argument("--metrics-format", choices=METRICS_FORMATS, default="json")
+    parser.add_argument("--metrics-file", default=None,
+                        help="File the metrics are written to, stdout by default. With --workers, the process id "
+                             "of the worker is added to the name")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT,
+                        help="Close connections that have not sent anything for N seconds")
+    parser.add_argument("--read-timeout", type=float, default=READ_TIMEOUT,
+                        help="Close connections that take more than N seconds to send the rest of a request")
+    parser.add_argument("--drain-timeout", type=float, default=DRAIN_TIMEOUT,
+                        help="On SIGTERM or SIGINT, seconds the connections get to finish their requests")
+    parser.add_argument("--expression-cache", type=int, default=batch_evaluator.EXPRESSION_CACHE_SIZE,
+                        help="Number of different text requests whose response is remembered, 0 disables the cache")
+    parser.add_argument("--rate-limit", type=float, default=0,
+                        help="Requests per second each connection may send, 0 for no limit")
+    parser.add_argument("--rate-burst", type=float, default=None,
+                        help="Requests a connection may send at once above --rate-limit, 0.1 s of requests by default")
+    parser.add_argument("--address-rate-limit", type=float, default=0,
+                        help="Requests per second of all the connections from one IP address together, 0 for no limit")
+    parser.add_argument("--address-rate-burst", type=float, default=None,
+                        help="Like --rate-burst, for all the connections from one IP address")
+    parser.add_argument("--rate-limit-policy", choices=RATE_LIMIT_POLICIES, default="delay",
+                        help="delay: stop reading from a client over its rate until it has tokens again, "
+                             "reject: answer its requests with an error, which also takes a token. Binary frames "
+                             "are always delayed")
+    parser.add_argument("--requests-per-turn", type=int, default=REQUESTS_PER_TURN,
+                        help="asyncio and selectors modes: requests of one connection handled before the next "
+                             "connection gets its turn, 0 for no limit")
+    parser.add_argument("--max-connections", type=int, default=0,
+                        help="Connections served at the same time, more are turned away. 0 for no limit. "
+                             "With --workers, the limit of every worker")
+    parser.add_argument("--record", default=None,
+                        help="Append the requests and responses of every connection to this traffic log, for "
+                             '"A3 benchmark replay traffic.py". With --workers, the process id is added to the name')
+    profile_sample, profile_memory, profile_output = profiling.settings_from_environment()
+    parser.add_argument("--profile-sample", type=float, default=profile_sample,
+                        help="Fraction of the connections profiled with cProfile, 0 (default) for none. Default from "
+                             "the %s environment variable" % profiling.PROFILE_SAMPLE_VARIABLE)
+    parser.add_argument("--profile-memory", type=float, default=profile_memory,
+                        help="Trace the memory with tracemalloc and take a snapshot every N seconds, 0 (default) to "
+                             "not trace it. Default from %s" % profiling.PROFILE_MEMORY_VARIABLE)
+    parser.add_argument("--profile-output", default=profile_output,
+                        help="Start of the names of the profile reports, written on SIGUSR2 and at shutdown. With "
+                             "--workers, the process id is added. Default from %s" % profiling.PROFILE_OUTPUT_VARIABLE)
+    arguments = parser.parse_args()
+
+    SERVER_PORT = arguments.port
+    LISTEN_BACKLOG = arguments.backlog
+    print_messages = not arguments.quiet
+    IDLE_TIMEOUT = arguments.idle_timeout
+    READ_TIMEOUT = arguments.read_timeout
+    DRAIN_TIMEOUT = arguments.drain_timeout
+    set_expression_cache_size(arguments.expression_cache)
+    REQUESTS_PER_TURN = arguments.requests_per_turn or None
+    admission_control = AdmissionControl(arguments.rate_limit or None, arguments.rate_burst,
+                                         arguments.address_rate_limit or None, arguments.address_rate_burst,
+                                         arguments.max_connections or None, arguments.rate_limit_policy)
+    raise_open_files_limit()
+    if arguments.workers > 1:
+        REUSE_PORT = True
+        run_supervisor(arguments)
+    else:
+        run_selected_mode(arguments)
@@ -0,0 +1,214 @@
+# Admission control for the warm-up server, so that one client sending requests in a tight loop cannot take the
+# server away from the others.
+#  - Every connection, and every client address (all the connections from one IP address together), may have a
+#    token bucket: requests are handled at most at its rate, with bursts up to its size. A session that has no tokens
+#    left either waits for them (backpressure: the server stops reading from the connection, so TCP slows the client
+#    down) or answers the requests with RATE_LIMIT_ERROR, see RATE_LIMIT_POLICIES. A rejected request costs the
+#    server about as much as an answered one, so it takes a token too: the buckets go below 0, and the session waits
+#    until they have a whole token again
+#  - The number of open connections may be capped. Connections beyond the cap are turned away right away
+# Frames of the binary protocol cost one token per request in them. They are never rejected, a frame waits until the
+# buckets have at least one token, and then may take them below zero.
+
+import threading
+import time
+
+# What a session does with requests when its token buckets are empty
+RATE_LIMIT_POLICIES = ["delay", "reject"]
+# Sent in place of a response to a request that is over the rate limit with the reject policy
+RATE_LIMIT_ERROR = "ERROR: rate limit exceeded\n"
+# Size of a bucket when it is not given: the requests of this many seconds at the rate of the bucket
+DEFAULT_BURST_SECONDS = 0.1
+# Client addresses with no open connection and a full bucket are forgotten after this many new connections
+ADDRESS_PRUNE_INTERVAL = 1000
+
+
+class TokenBucket:
+    """
+    Holds up to capacity tokens, and gets rate new tokens per second. Not thread-safe: RateLimiter locks the buckets
+    shared by several connections
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: Tokens per second
+        :param capacity: The most tokens the bucket holds, the burst size. DEFAULT_BURST_SECONDS of tokens when None
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate * DEFAULT_BURST_SECONDS)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """
+        :return: Seconds until the bucket has one whole token, 0 when it has one now
+        """
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def is_full(self, now):
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+
+class RateLimiter:
+    """
+    The token buckets of one connection: its own bucket and the bucket of its client address, either may be None.
+    Used by one session, from one thread at a time
+    """
+
+    def __init__(self, connection_bucket, address_bucket, address_lock, policy):
+        self.connection_bucket = connection_bucket
+        self.address_bucket = address_bucket
+        # Shared with the other connections from the same address
+        self.address_lock = address_lock
+        self.buckets = [bucket for bucket in [connection_bucket, address_bucket] if bucket is not None]
+        self.policy = policy
+
+    def take(self, count, partial=True):
+        """
+        :param count: Number of requests waiting to be handled
+        :param partial: True: take as many whole tokens as there are, up to count. False: take count tokens at once,
+            as soon as every bucket has one whole token, even when that leaves fewer than 0
+        :return: Number of tokens taken, the requests that may be handled now
+        """
+        if self.address_bucket is None:
+            return self.take_from_buckets(count, partial)
+        with self.address_lock:
+            return self.take_from_buckets(count, partial)
+
+    def take_from_buckets(self, count, partial):
+        now = time.monotonic()
+        available = count
+        for bucket in self.buckets:
+            bucket.refill(now)
+            available = min(available, int(bucket.tokens))
+        if available <= 0:
+            return 0
+        taken = available if partial else count
+        for bucket in self.buckets:
+            bucket.tokens -= taken
+        return taken
+
+    def give_back(self, count):
+        """
+        Return tokens taken for requests that were not handled
+        """
+        if self.address_bucket is None:
+            self.connection_bucket.tokens += count
+            return
+        with self.address_lock:
+            for bucket in self.buckets:
+                bucket.tokens += count
+
+    def charge(self, count):
+        """
+        Take count tokens for requests answered with RATE_LIMIT_ERROR, even when that leaves fewer than 0
+        """
+        self.give_back(-count)
+
+    def wait_time(self):
+        """
+        :return: Seconds until every bucket has a whole token again
+        """
+        if self.address_bucket is None:
+            return self.connection_bucket.wait_time()
+        with self.address_lock:
+            return max(bucket.wait_time() for bucket in self.buckets)
+
+
+class AdmittedConnection:
+    """
+    A connection counted by AdmissionControl. close() must be called once when it is closed
+    """
+
+    def __init__(self, admission_control, address, rate_limiter):
+        self.admission_control = admission_control
+        self.address = address
+        # RateLimiter of the connection, None when no rate is limited
+        self.rate_limiter = rate_limiter
+
+    def close(self):
+        self.admission_control.connection_closed(self.address)
+
+
+class AdmissionControl:
+    """
+    The limits shared by all the connections of a server process. May be used from several threads
+    """
+
+    def __init__(self, connection_rate=None, connection_burst=None, address_rate=None, address_burst=None,
+                 max_connections=None, policy="delay"):
+        """
+        :param connection_rate: Requests per second of every connection, None for no limit
+        :param connection_burst: Requests a connection may send at once, see TokenBucket
+        :param address_rate: Requests per second of all the connections from one client address, None for no limit
+        :param address_burst: Like connection_burst, for all the connections from one address
+        :param max_connections: Connections that may be open at the same time, None for no limit
+        :param policy: One of RATE_LIMIT_POLICIES
+        """
+        self.connection_rate = connection_rate
+        self.connection_burst = connection_burst
+        self.address_rate = address_rate
+        self.address_burst = address_burst
+        self.max_connections = max_connections
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.open_connections = 0
+        self.rejected_connections = 0
+        # Client address -> [TokenBucket, lock of the bucket, number of open connections from the address]
+        self.addresses = {}
+        self.connections_since_prune = 0
+
+    def open_connection(self, address):
+        """
+        :param address: The IP address of the client, None when it is not known
+        :return: AdmittedConnection, or None when max_connections connections are already open
+        """
+        address_bucket = address_lock = None
+        with self.lock:
+            if self.max_connections is not None and self.open_connections >= self.max_connections:
+                self.rejected_connections += 1
+                return None
+            self.open_connections += 1
+            if self.address_rate is not None and address is not None:
+                entry = self.addresses.get(address)
+                if entry is None:
+                    entry = [TokenBucket(self.address_rate, self.address_burst), threading.Lock(), 0]
+                    self.addresses[address] = entry
+                entry[2] += 1
+                address_bucket, address_lock = entry[0], entry[1]
+                self.connections_since_prune += 1
+                if self.connections_since_prune >= ADDRESS_PRUNE_INTERVAL:
+                    self.prune_addresses()
+        rate_limiter = None
+        if self.connection_rate is not None or address_bucket is not None:
+            connection_bucket = None
+            if self.connection_rate is not None:
+                connection_bucket = TokenBucket(self.connection_rate, self.connection_burst)
+            rate_limiter = RateLimiter(connection_bucket, address_bucket, address_lock, self.policy)
+        return AdmittedConnection(self, address, rate_limiter)
+
+    def connection_closed(self, address):
+        with self.lock:
+            self.open_connections -= 1
+            entry = self.addresses.get(address)
+            if entry is not None:
+                entry[2] -= 1
+
+    def prune_addresses(self):
+        """
+        Forget the addresses without connections whose bucket has filled up again: a new connection from them would
+        get the same full bucket. Addresses with an empty bucket are kept, so that reconnecting does not reset it.
+        Called with the lock held
+        """
+        self.connections_since_prune = 0
+        now = time.monotonic()
+        for address, (bucket, bucket_lock, connection_count) in list(self.addresses.items()):
+            if connection_count == 0:
+                with bucket_lock:
+                    if bucket.is_full(now):
+                        del self.addresses[address]
@@ -0,0 +1,207 @@
+# Evaluation of arithmetic expressions for the warm-up server: single expressions of the text protocol, and the batch
+# frames of binary_protocol.py with thousands of expressions each.
+#
+# Evaluating a batch one expression at a time costs several Python function calls per expression. Instead, all the
+# expressions with the same operator are computed together: with one NumPy operation on whole arrays when NumPy is
+# installed, otherwise with map() over the operands, which runs the loop in C. Batch results are 64-bit integers: an
+# expression whose result does not fit gets the status STATUS_OVERFLOW instead of a wrapped around number.
+
+import operator
+import re
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The operators. Their code in batch frames is their position: "+" is 0, "-" is 1, and so on.
+# "/" is integer division rounded down and "%" the remainder that goes with it, like // and % in Python
+OPERATORS = "+-*/%"
+OPERATOR_FUNCTIONS = [operator.add, operator.sub, operator.mul, operator.floordiv, operator.mod]
+# Status of every result of a batch
+STATUS_OK = 0
+STATUS_OVERFLOW = 1
+STATUS_DIVISION_BY_ZERO = 2
+STATUS_INVALID_OPERATOR = 3
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+# Number of different text requests whose response the server remembers
+EXPRESSION_CACHE_SIZE = 4096
+# Batches smaller than this are evaluated without NumPy: setting up the arrays would cost more than it saves
+NUMPY_MIN_BATCH = 64
+# A text request: two integers, optionally signed, with an operator between them, for example "3 + 4" or "-3*4"
+EXPRESSION_PATTERN = re.compile(r"\s*([-+]?\d+)\s*([-+*/%])\s*([-+]?\d+)\s*")
+
+
+def parse_expression(message):
+    """
+    :return: (left operand, operator code, right operand)
+    :raise ValueError: When the message is not an expression
+    """
+    left, operator_text, right = message.partition("+")
+    if operator_text:
+        # The most common request, parsed without the regular expression
+        try:
+            return int(left), 0, int(right)
+        except ValueError:
+            pass
+    match = EXPRESSION_PATTERN.fullmatch(message)
+    if match is None:
+        raise ValueError("expected two numbers separated by one of " + OPERATORS)
+    left, operator_text, right = match.groups()
+    return int(left), OPERATORS.index(operator_text), int(right)
+
+
+def evaluate(left, code, right):
+    """
+    Evaluate one expression of the text protocol. The numbers have no size limit
+    :raise ZeroDivisionError: When dividing by zero
+    """
+    return OPERATOR_FUNCTIONS[code](left, right)
+
+
+def evaluate_checked(left, code, right):
+    """
+    Evaluate one expression of a batch
+    :return: (result, status). The result is 0 when the status is not STATUS_OK
+    """
+    if code >= len(OPERATOR_FUNCTIONS):
+        return 0, STATUS_INVALID_OPERATOR
+    try:
+        result = OPERATOR_FUNCTIONS[code](left, right)
+    except ZeroDivisionError:
+        return 0, STATUS_DIVISION_BY_ZERO
+    if not INT64_MIN <= result <= INT64_MAX:
+        return 0, STATUS_OVERFLOW
+    return result, STATUS_OK
+
+
+def evaluate_batch(left, right, codes):
+    """
+    Evaluate many expressions, with NumPy when it is installed
+    :param left: The left operands, a buffer of 64-bit integers in the native byte order (memoryview or array)
+    :param right: The right operands, like left
+    :param codes: bytes-like object with the operator code of every expression
+    :return: (results, statuses): 64-bit integers in the native byte order and one status byte per expression, both
+        objects supporting the buffer protocol
+    """
+    if numpy is not None and len(codes) >= NUMPY_MIN_BATCH:
+        return evaluate_batch_numpy(left, right, codes)
+    return evaluate_batch_python(left, right, codes)
+
+
+def apply_operator(code, left, right):
+    return OPERATOR_FUNCTIONS[code](left, right)
+
+
+def evaluate_batch_python(left, right, codes):
+    """
+    The evaluation without NumPy, see evaluate_batch
+    """
+    count = len(codes)
+    codes = bytes(codes)
+    # The usual case: no errors, computed in one pass, and without a Python function call per expression when the
+    # whole batch uses one operator. Any error (a result that does not fit in 64 bits, a division by zero or an
+    # invalid operator) stops the pass, and the expressions are then evaluated one by one
+    try:
+        if count and codes.count(codes[0]) == count:
+            return array("q", map(OPERATOR_FUNCTIONS[codes[0]], left, right)), bytearray(count)
+        return array("q", map(apply_operator, codes, left, right)), bytearray(count)
+    except (OverflowError, ZeroDivisionError, IndexError):
+        pass
+    results = array("q", bytes(8 * count))
+    statuses = bytearray(count)
+    for index, (code, left_operand, right_operand) in enumerate(zip(codes, left, right)):
+        results[index], statuses[index] = evaluate_checked(left_operand, code, right_operand)
+    return results, statuses
+
+
+def numpy_add(left, right):
+    """
+    :return: (results wrapped around to 64 bits, overflow mask, division by zero mask or None)
+    """
+    results = left + right
+    # The sum overflowed when its sign differs from the sign of both operands
+    return results, ((left ^ results) & (right ^ results)) < 0, None
+
+
+def numpy_subtract(left, right):
+    results = left - right
+    # The difference overflowed when the operands have different signs and the result has the sign of the right one
+    return results, ((left ^ right) & (left ^ results)) < 0, None
+
+
+def numpy_multiply(left, right):
+    results = left * right
+    # A product of two numbers that fit in 32 bits always fits in 64 bits. For the others: dividing a wrapped around
+    # product by one operand does not give back the other one. -1 * INT64_MIN is the only product for which it does
+    large = (left < -2 ** 31) | (left >= 2 ** 31) | (right < -2 ** 31) | (right >= 2 ** 31)
+    if not large.any():
+        return results, None, None
+    divisors = numpy.where(left == 0, 1, left)
+    overflow = large & (((left != 0) & (results // divisors != right)) | ((left == -1) & (right == INT64_MIN)))
+    return results, overflow, None
+
+
+def numpy_floor_divide(left, right):
+    by_zero = right == 0
+    overflow = (left == INT64_MIN) & (right == -1)
+    return left // numpy.where(by_zero | overflow, 1, right), overflow, by_zero
+
+
+def numpy_remainder(left, right):
+    by_zero = right == 0
+    # x % -1 is always 0, the same as x % 1, which avoids the processor exception of INT64_MIN % -1
+    return left % numpy.where(by_zero | (right == -1), 1, right), None, by_zero
+
+
+NUMPY_OPERATIONS = [numpy_add, numpy_subtract, numpy_multiply, numpy_floor_divide, numpy_remainder]
+
+
+def evaluate_numpy_operation(code, left, right):
+    """
+    :return: (results, statuses) of expressions that all use the operator code
+    """
+    results, overflow, by_zero = NUMPY_OPERATIONS[code](left, right)
+    statuses = numpy.zeros(len(results), numpy.uint8)
+    if overflow is not None:
+        statuses[overflow] = STATUS_OVERFLOW
+    if by_zero is not None:
+        statuses[by_zero] = STATUS_DIVISION_BY_ZERO
+    results[statuses != STATUS_OK] = 0
+    return results, statuses
+
+
+def evaluate_batch_numpy(left, right, codes):
+    """
+    The evaluation with NumPy, see evaluate_batch. Every operator present in the batch is computed with one array
+    operation. When the batch has several operators, the expressions are first sorted by operator, so that each
+    operator works on one contiguous part of the arrays
+    """
+    left = numpy.frombuffer(left, numpy.int64)
+    right = numpy.frombuffer(right, numpy.int64)
+    codes = numpy.frombuffer(codes, numpy.uint8)
+    with numpy.errstate(all="ignore"):
+        if len(codes) and codes[0] < len(NUMPY_OPERATIONS) and (codes == codes[0]).all():
+            results, statuses = evaluate_numpy_operation(codes[0], left, right)
+        else:
+            order = numpy.argsort(codes, kind="stable")
+            # Expressions with the operator code c are at boundaries[c]:boundaries[c + 1] after sorting, the ones with
+            # invalid codes at the end
+            boundaries = numpy.searchsorted(codes[order], numpy.arange(len(NUMPY_OPERATIONS) + 1))
+            sorted_left = left[order]
+            sorted_right = right[order]
+            sorted_results = numpy.zeros(len(codes), numpy.int64)
+            sorted_statuses = numpy.full(len(codes), STATUS_INVALID_OPERATOR, numpy.uint8)
+            for code in range(len(NUMPY_OPERATIONS)):
+                start, end = boundaries[code], boundaries[code + 1]
+                if start < end:
+                    sorted_results[start:end], sorted_statuses[start:end] = evaluate_numpy_operation(
+                        code, sorted_left[start:end], sorted_right[start:end])
+            results = numpy.empty_like(sorted_results)
+            statuses = numpy.empty_like(sorted_statuses)
+            results[order] = sorted_results
+            statuses[order] = sorted_statuses
+    # Memoryviews, so that the results are appended to a bytearray as bytes and not added as numbers
+    return memoryview(results), memoryview(statuses)
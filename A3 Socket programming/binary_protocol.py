@@ -0,0 +1,173 @@
+# The binary mode of the warm-up server, for bulk numeric traffic.
+#
+# A client switches to it by sending the text request "binary". The server answers "binaryok\n", and from then on
+# both sides send frames: a 4-byte little-endian length, followed by that many bytes.
+#  - Request frame: pairs of operands, each a 32-bit signed little-endian integer (8 bytes per pair)
+#  - Response frame: the sum of every pair as a 64-bit signed little-endian integer, in the same order. The sum of
+#    two 32-bit numbers always fits, so there is no overflow
+# An empty request frame ends the conversation, like "Game over" in the text protocol. A frame with a length that is
+# not a multiple of 8, or longer than MAX_FRAME_LENGTH, is an error and the server closes the connection.
+#
+# Parsing is done without copying: the operands are read through a memoryview of the receive buffer, cast to 32-bit
+# integers, and the sums are written to an array that is sent as it is.
+#
+# A client sending "batch" instead of "binary" (answered with "batchok") uses batch frames, with any operator of
+# batch_evaluator.OPERATORS. The frames are the same, but the payloads hold n expressions as three arrays:
+#  - Request: n left operands, n right operands (64-bit signed little-endian integers), then n operator codes (bytes)
+#  - Response: n results (64-bit signed little-endian integers), then n status bytes, see batch_evaluator.STATUS_OK.
+#    The result is 0 when the status is not STATUS_OK, for example on overflow or division by zero
+
+import sys
+from array import array
+from operator import add
+
+import batch_evaluator
+
+# The text request that switches a connection to the binary mode, and the reply of the server
+BINARY_REQUEST = "binary"
+BINARY_ACCEPTED = "binaryok"
+# The text request that switches a connection to batch frames, and the reply of the server
+BATCH_REQUEST = "batch"
+BATCH_ACCEPTED = "batchok"
+FRAME_HEADER_SIZE = 4
+# Largest accepted request frame in bytes, 131072 pairs
+MAX_FRAME_LENGTH = 1024 * 1024
+PAIR_SIZE = 8
+# Bytes per expression in a batch request frame and per result in a batch response frame
+EXPRESSION_SIZE = 17
+RESULT_SIZE = 9
+# The frames are little-endian. On a big-endian computer the numbers must be byte-swapped
+NATIVE_LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+def make_frame(payload):
+    """
+    :param payload: bytes-like object
+    :return: The frame as bytes: the length followed by the payload
+    """
+    payload = memoryview(payload).cast("B")
+    return len(payload).to_bytes(FRAME_HEADER_SIZE, "little") + payload
+
+
+def encode_request(pairs):
+    """
+    :param pairs: List of (a, b) tuples, both 32-bit signed integers
+    :return: The request frame as bytes
+    :raise OverflowError: When a number does not fit in 32 bits
+    """
+    operands = array("i", [value for pair in pairs for value in pair])
+    if not NATIVE_LITTLE_ENDIAN:
+        operands.byteswap()
+    return make_frame(operands)
+
+
+def encode_response(sums):
+    """
+    :param sums: List of the sums, 64-bit signed integers
+    :return: The response frame as bytes, as the server would send it
+    """
+    sums = array("q", sums)
+    if not NATIVE_LITTLE_ENDIAN:
+        sums.byteswap()
+    return make_frame(sums)
+
+
+def read_frame_length(buffer, offset):
+    """
+    :return: The payload length of the frame that starts at offset, or None when the header is not complete yet
+    """
+    if len(buffer) - offset < FRAME_HEADER_SIZE:
+        return None
+    return int.from_bytes(buffer[offset:offset + FRAME_HEADER_SIZE], "little")
+
+
+def is_valid_request_length(length):
+    return length % PAIR_SIZE == 0 and length <= MAX_FRAME_LENGTH
+
+
+def calculate_sums(payload):
+    """
+    :param payload: memoryview of the payload of a request frame
+    :return: array of 64-bit sums, in the byte order of the frames
+    """
+    if NATIVE_LITTLE_ENDIAN:
+        with payload.cast("i") as operands, operands[0::2] as left, operands[1::2] as right:
+            return array("q", map(add, left, right))
+    operands = array("i")
+    operands.frombytes(payload)
+    operands.byteswap()
+    sums = array("q", map(add, operands[0::2], operands[1::2]))
+    sums.byteswap()
+    return sums
+
+
+def decode_response(payload):
+    """
+    :param payload: The payload of a response frame
+    :return: array of the sums
+    """
+    sums = array("q")
+    sums.frombytes(payload)
+    if not NATIVE_LITTLE_ENDIAN:
+        sums.byteswap()
+    return sums
+
+
+def encode_expressions(expressions):
+    """
+    :param expressions: List of (left, operator, right) tuples, for example (3, "*", 4). The numbers must fit in 64 bits
+    :return: The batch request frame as bytes
+    """
+    left = array("q", [expression[0] for expression in expressions])
+    right = array("q", [expression[2] for expression in expressions])
+    codes = bytes(batch_evaluator.OPERATORS.index(expression[1]) for expression in expressions)
+    if not NATIVE_LITTLE_ENDIAN:
+        left.byteswap()
+        right.byteswap()
+    return make_frame(left.tobytes() + right.tobytes() + codes)
+
+
+def is_valid_batch_length(length):
+    return length % EXPRESSION_SIZE == 0 and length <= MAX_FRAME_LENGTH
+
+
+def calculate_expressions(payload):
+    """
+    :param payload: memoryview of the payload of a batch request frame
+    :return: (results, statuses) in the byte order of the frames, see batch_evaluator.evaluate_batch
+    """
+    count = len(payload) // EXPRESSION_SIZE
+    with payload[16 * count:] as codes:
+        if NATIVE_LITTLE_ENDIAN:
+            with payload[:8 * count].cast("q") as left, payload[8 * count:16 * count].cast("q") as right:
+                return batch_evaluator.evaluate_batch(left, right, codes)
+        operands = array("q")
+        operands.frombytes(payload[:16 * count])
+        operands.byteswap()
+        results, statuses = batch_evaluator.evaluate_batch(operands[:count], operands[count:], codes)
+        swapped_results = array("q")
+        swapped_results.frombytes(memoryview(results).cast("B"))
+        swapped_results.byteswap()
+        return swapped_results, statuses
+
+
+def encode_batch_response(results, statuses):
+    """
+    :param results: List of the results, 64-bit signed integers
+    :param statuses: List of the status of every result
+    :return: The batch response frame as bytes, as the server would send it
+    """
+    results = array("q", results)
+    if not NATIVE_LITTLE_ENDIAN:
+        results.byteswap()
+    return make_frame(results.tobytes() + bytes(statuses))
+
+
+def decode_batch_response(payload):
+    """
+    :param payload: The payload of a batch response frame
+    :return: List of (result, status)
+    """
+    count = len(payload) // RESULT_SIZE
+    results = decode_response(payload[:8 * count])
+    return list(zip(results, payload[8 * count:]))
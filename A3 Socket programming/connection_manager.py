@@ -0,0 +1,126 @@
+# Opening TCP connections for the clients: timeouts, keepalive, TCP_NODELAY, and reconnecting with backoff.
+#
+# When a server restarts, every client loses its connection at the same moment. If they all reconnect right away, and
+# then again after the same fixed delay, the server is hit by waves of connections. The delay between attempts grows
+# exponentially, and each delay is a random part of it ("full jitter"), so the clients spread out over time.
+
+import random
+import socket as socket_module
+import threading
+from socket import *
+
+# Seconds to wait for the TCP handshake
+CONNECT_TIMEOUT = 10
+# Seconds to wait for a reply before the connection is considered broken, None waits forever
+READ_TIMEOUT = 30
+# TCP keepalive: seconds of silence before the first probe, seconds between probes, and failed probes before the
+# connection is closed. Finds dead connections while nothing is sent, for example in async mode
+KEEPALIVE_IDLE = 60
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_PROBES = 5
+# Reconnecting: the first and the largest delay in seconds, and the number of attempts before giving up
+RECONNECT_INITIAL_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30
+RECONNECT_ATTEMPTS = 8
+
+
+def configure_socket(connection, read_timeout=READ_TIMEOUT):
+    """
+    Set the options of a connected socket: no Nagle delay for the short request lines, TCP keepalive, read timeout
+    """
+    connection.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+    connection.setsockopt(SOL_SOCKET, SO_KEEPALIVE, 1)
+    # The keepalive timing options are not available on every platform
+    for option_name, value in (("TCP_KEEPIDLE", KEEPALIVE_IDLE), ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL),
+                               ("TCP_KEEPCNT", KEEPALIVE_PROBES)):
+        if hasattr(socket_module, option_name):
+            connection.setsockopt(IPPROTO_TCP, getattr(socket_module, option_name), value)
+    connection.settimeout(read_timeout)
+
+
+def open_connection(host, port, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+    """
+    Connect to a server
+    :return: The connected socket, see configure_socket
+    :raise IOError: When the connection could not be established in time
+    """
+    connection = create_connection((host, port), timeout=connect_timeout)
+    try:
+        configure_socket(connection, read_timeout)
+    except IOError:
+        connection.close()
+        raise
+    return connection
+
+
+def backoff_delays(initial_delay=RECONNECT_INITIAL_DELAY, max_delay=RECONNECT_MAX_DELAY):
+    """
+    Endless generator of delays for exponential backoff with full jitter: a random delay between 0 and
+    initial_delay * 2^attempt, but never more than max_delay
+    """
+    ceiling = initial_delay
+    while True:
+        yield random.uniform(0, ceiling)
+        ceiling = min(ceiling * 2, max_delay)
+
+
+class ConnectionManager:
+    """
+    Opens the connection to one server, and opens it again with backoff when it was lost
+    """
+
+    def __init__(self, host, port, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 attempts=RECONNECT_ATTEMPTS, initial_delay=RECONNECT_INITIAL_DELAY, max_delay=RECONNECT_MAX_DELAY):
+        """
+        :param attempts: Connection attempts of one reconnect before giving up, None tries forever
+        """
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.attempts = attempts
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        # Set by stop() to end the waiting between attempts, for example when the user disconnects
+        self.stopped = threading.Event()
+        self.reconnect_count = 0
+
+    def connect(self):
+        """
+        One connection attempt
+        :return: The connected socket
+        :raise IOError: When the connection failed
+        """
+        self.stopped.clear()
+        return open_connection(self.host, self.port, self.connect_timeout, self.read_timeout)
+
+    def reconnect(self, on_connected=None):
+        """
+        Try to connect until it succeeds, waiting longer between every attempt
+        :param on_connected: Function called with the new socket, for example to log in again. When it raises
+            IOError, the socket is closed and the next attempt is made
+        :return: The connected socket, or None when all attempts failed or stop() was called
+        """
+        delays = backoff_delays(self.initial_delay, self.max_delay)
+        attempt = 0
+        while self.attempts is None or attempt < self.attempts:
+            attempt += 1
+            if self.stopped.wait(next(delays)):
+                return None
+            try:
+                connection = open_connection(self.host, self.port, self.connect_timeout, self.read_timeout)
+            except IOError:
+                continue
+            try:
+                if on_connected is not None:
+                    on_connected(connection)
+            except IOError:
+                connection.close()
+                continue
+            self.reconnect_count += 1
+            return connection
+        return None
+
+    def stop(self):
+        self.stopped.set()
+
@@ -0,0 +1,382 @@
+# Storage for the unread messages of the chat server users (the inbox command).
+#
+# The messages of each user are kept in a ring buffer made of two compact arrays: one bytearray with all the message
+# lines after each other, and an array with the end offset of every line. There are no Python objects per message.
+# The total memory used by all the inboxes is limited. When it goes above the limit, the inboxes that were used
+# least recently are either spilled to append-only segment files on disk, or dropped, depending on the policy.
+# Spilled messages are read back through mmap, so an inbox is drained by handing out memoryviews of the segment
+# files and of the ring buffer, without building one string per message.
+
+import mmap
+import os
+import tempfile
+from array import array
+from collections import OrderedDict
+
+# What to do when the memory limit, or the capacity of one inbox, is reached
+INBOX_POLICIES = ["spill", "evict"]
+# Default number of messages one in-memory ring buffer holds
+DEFAULT_RING_CAPACITY = 10000
+# A new segment file is started when the current one is larger than this
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+# When the memory limit is reached, inboxes are spilled or evicted until the memory use is below this part of the limit
+LOW_WATERMARK = 0.9
+# Approximate memory used by an inbox besides its messages: the object, the arrays and the dictionary entry
+INBOX_OVERHEAD_BYTES = 400
+
+
+class UserInbox:
+    """
+    The unread messages of one user: the oldest ones in segment files (spilled), the newest ones in the ring buffer
+    """
+    __slots__ = ("data", "ends", "head", "spilled", "spilled_count")
+
+    def __init__(self):
+        # The message lines after each other
+        self.data = bytearray()
+        # End offset in data of every message
+        self.ends = array("I")
+        # Index in ends of the oldest message still in the ring. Messages before it are dropped or spilled, and their
+        # bytes are removed from data when the ring is compacted
+        self.head = 0
+        # Messages on disk, oldest first: list of (segment, offset, length, message count)
+        self.spilled = []
+        self.spilled_count = 0
+
+    def memory_count(self):
+        return len(self.ends) - self.head
+
+    def start_offset(self):
+        return self.ends[self.head - 1] if self.head else 0
+
+    def memory_bytes(self):
+        return len(self.data) - self.start_offset()
+
+    def append(self, line):
+        self.data += line
+        self.ends.append(len(self.data))
+
+    def drop_oldest(self):
+        """
+        Drop the oldest message of the ring
+        :return: Number of bytes freed
+        """
+        start = self.start_offset()
+        self.head += 1
+        freed = self.ends[self.head - 1] - start
+        # Compacting moves the remaining bytes, so it is only done when at least half of the ring is unused
+        if self.head > len(self.ends) // 2:
+            self.compact()
+        return freed
+
+    def take_oldest(self, count):
+        """
+        Remove the count oldest messages of the ring
+        :return: Their lines, copied: the ring may be compacted or grow before they are sent
+        """
+        start = self.start_offset()
+        self.head += count
+        with memoryview(self.data) as data:
+            lines = bytes(data[start:self.ends[self.head - 1]])
+        if self.head > len(self.ends) // 2:
+            self.compact()
+        return lines
+
+    def compact(self):
+        offset = self.start_offset()
+        del self.data[:offset]
+        self.ends = array("I", [end - offset for end in self.ends[self.head:]])
+        self.head = 0
+
+    def clear_memory(self):
+        self.data = bytearray()
+        self.ends = array("I")
+        self.head = 0
+
+
+class SegmentFiles:
+    """
+    Append-only segment files for spilled messages. A segment file is deleted when all the messages in it have been
+    drained and a newer segment is being written
+    """
+
+    def __init__(self, directory, segment_size):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.next_segment_id = 1
+        # segment id -> number of spilled chunks in it that are not drained yet
+        self.live_chunks = {}
+        # segment id -> (file, mmap or None). The mmap is created when the segment is read, and again when it grew
+        self.open_segments = {}
+        # Memory maps that could not be closed yet, because memoryviews of them were still in use
+        self.retired_maps = []
+        self.current_id = None
+        self.current_size = 0
+        self.bytes_on_disk = 0
+
+    def path(self, segment_id):
+        return os.path.join(self.directory, "inbox-segment-%06i.log" % segment_id)
+
+    def append(self, data):
+        """
+        :return: (segment id, offset) where the data was written
+        """
+        if self.current_id is None or self.current_size + len(data) > self.segment_size:
+            self.start_new_segment()
+        segment_file, segment_map = self.open_segments[self.current_id]
+        offset = self.current_size
+        segment_file.write(data)
+        segment_file.flush()
+        self.current_size += len(data)
+        self.bytes_on_disk += len(data)
+        self.live_chunks[self.current_id] += 1
+        return self.current_id, offset
+
+    def start_new_segment(self):
+        previous_id = self.current_id
+        self.current_id = self.next_segment_id
+        self.next_segment_id += 1
+        self.current_size = 0
+        self.open_segments[self.current_id] = (open(self.path(self.current_id), "w+b"), None)
+        self.live_chunks[self.current_id] = 0
+        if previous_id is not None and self.live_chunks[previous_id] == 0:
+            self.delete_segment(previous_id)
+
+    def map_segment(self, segment_id, end):
+        """
+        :return: mmap of the segment file that includes at least the bytes before end
+        """
+        segment_file, segment_map = self.open_segments[segment_id]
+        if segment_map is None or len(segment_map) < end:
+            if segment_map is not None:
+                self.retire_map(segment_map)
+            segment_map = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.open_segments[segment_id] = (segment_file, segment_map)
+        return segment_map
+
+    def read(self, segment_id, offset, length):
+        """
+        :return: memoryview of the bytes in the segment file, without copying them
+        """
+        return memoryview(self.map_segment(segment_id, offset + length))[offset:offset + length]
+
+    def lines_length(self, segment_id, offset, length, count):
+        """
+        :return: Number of bytes of the first count message lines of a spilled chunk
+        """
+        segment_map = self.map_segment(segment_id, offset + length)
+        line_end = offset
+        for i in range(count):
+            line_end = segment_map.find(b"\n", line_end, offset + length) + 1
+        return line_end - offset
+
+    def chunk_drained(self, segment_id):
+        self.live_chunks[segment_id] -= 1
+        if self.live_chunks[segment_id] == 0 and segment_id != self.current_id:
+            self.delete_segment(segment_id)
+
+    def delete_segment(self, segment_id):
+        segment_file, segment_map = self.open_segments.pop(segment_id)
+        if segment_map is not None:
+            self.retire_map(segment_map)
+        self.bytes_on_disk -= os.fstat(segment_file.fileno()).st_size
+        segment_file.close()
+        del self.live_chunks[segment_id]
+        # On Linux the data stays readable through the mmap until it is closed, even after the file is removed
+        os.remove(self.path(segment_id))
+
+    def retire_map(self, segment_map):
+        self.retired_maps.append(segment_map)
+        still_used = []
+        for retired_map in self.retired_maps:
+            try:
+                retired_map.close()
+            except BufferError:
+                still_used.append(retired_map)
+        self.retired_maps = still_used
+
+    def close(self):
+        for segment_id in list(self.open_segments):
+            self.delete_segment(segment_id)
+
+
+class InboxStore:
+    """
+    The inboxes of all users, with a limit for the memory they use together
+    """
+
+    def __init__(self, memory_limit=None, policy="spill", ring_capacity=DEFAULT_RING_CAPACITY, spill_directory=None,
+                 segment_size=DEFAULT_SEGMENT_SIZE):
+        """
+        :param memory_limit: Bytes the messages in memory may use in total, None for no limit
+        :param policy: "spill" moves cold inboxes to segment files, "evict" drops their oldest messages
+        :param ring_capacity: Messages kept in memory for one user. A full ring is spilled, or its oldest message is
+            dropped, depending on the policy
+        :param spill_directory: Directory for the segment files. A temporary directory is used when it is None
+        """
+        if policy not in INBOX_POLICIES:
+            raise ValueError("Unknown inbox policy: %s" % policy)
+        self.memory_limit = memory_limit
+        self.policy = policy
+        self.ring_capacity = ring_capacity
+        self.spill_directory = spill_directory
+        # True when the store made a temporary spill directory itself, and must remove it when closed
+        self.temporary_directory = False
+        self.segment_size = segment_size
+        self.segments = None  # Created on the first spill
+        # username -> UserInbox, the least recently used first
+        self.inboxes = OrderedDict()
+        self.memory_used = 0
+        self.dropped_messages = 0
+
+    def append(self, username, line):
+        """
+        Add a message to the inbox of a user
+        :param line: The message line as the inbox reply sends it, bytes ending with a newline
+        """
+        inbox = self.inboxes.get(username)
+        if inbox is None:
+            inbox = self.inboxes[username] = UserInbox()
+            self.memory_used += INBOX_OVERHEAD_BYTES
+        else:
+            self.inboxes.move_to_end(username)
+        if inbox.memory_count() >= self.ring_capacity:
+            if self.policy == "spill":
+                self.spill(inbox)
+            else:
+                self.memory_used -= inbox.drop_oldest()
+                self.dropped_messages += 1
+        inbox.append(line)
+        self.memory_used += len(line)
+        if self.memory_limit is not None and self.memory_used > self.memory_limit:
+            self.reduce_memory()
+
+    def count(self, username):
+        inbox = self.inboxes.get(username)
+        if inbox is None:
+            return 0
+        return inbox.spilled_count + inbox.memory_count()
+
+    def drain(self, username):
+        """
+        Take all the messages of a user. The inbox is empty afterwards
+        :return: (number of messages, list of bytes-like chunks with the message lines in order). The chunks are
+            memoryviews of the segment files and of the ring buffer, ready to be written to a socket as they are
+        """
+        inbox = self.inboxes.pop(username, None)
+        if inbox is None:
+            return 0, []
+        chunks = []
+        for segment_id, offset, length, count in inbox.spilled:
+            chunks.append(self.segments.read(segment_id, offset, length))
+            self.segments.chunk_drained(segment_id)
+        if inbox.memory_count():
+            chunks.append(memoryview(inbox.data)[inbox.start_offset():])
+        self.memory_used -= inbox.memory_bytes() + INBOX_OVERHEAD_BYTES
+        return inbox.spilled_count + inbox.memory_count(), chunks
+
+    def take(self, username, limit):
+        """
+        Take the oldest messages of a user, at most limit. The newer messages stay in the inbox
+        :return: (number of messages, list of bytes-like chunks with the message lines in order), like drain
+        """
+        inbox = self.inboxes.get(username)
+        if inbox is None or limit <= 0:
+            return 0, []
+        if self.count(username) <= limit:
+            return self.drain(username)
+        chunks = []
+        taken = 0
+        while taken < limit and inbox.spilled:
+            segment_id, offset, length, count = inbox.spilled[0]
+            if taken + count <= limit:
+                chunks.append(self.segments.read(segment_id, offset, length))
+                self.segments.chunk_drained(segment_id)
+                del inbox.spilled[0]
+                inbox.spilled_count -= count
+                taken += count
+                continue
+            # Only the first messages of this chunk are taken, the rest of it stays spilled
+            wanted = limit - taken
+            part_length = self.segments.lines_length(segment_id, offset, length, wanted)
+            chunks.append(self.segments.read(segment_id, offset, part_length))
+            inbox.spilled[0] = (segment_id, offset + part_length, length - part_length, count - wanted)
+            inbox.spilled_count -= wanted
+            taken = limit
+        if taken < limit:
+            lines = inbox.take_oldest(limit - taken)
+            chunks.append(lines)
+            self.memory_used -= len(lines)
+            taken = limit
+        return taken, chunks
+
+    def reduce_memory(self):
+        """
+        Spill or drop messages of the least recently used inboxes until the memory use is below the low watermark.
+        Going a bit below the limit means that this does not have to run again for every new message
+        """
+        target = self.memory_limit * LOW_WATERMARK
+        empty_inboxes = []
+        for username, inbox in self.inboxes.items():
+            if self.memory_used <= target:
+                break
+            if inbox.memory_count() == 0:
+                continue
+            if self.policy == "spill":
+                self.spill(inbox)
+            else:
+                while inbox.memory_count() and self.memory_used > target:
+                    self.memory_used -= inbox.drop_oldest()
+                    self.dropped_messages += 1
+                if inbox.memory_count() == 0 and inbox.spilled_count == 0:
+                    empty_inboxes.append(username)
+        for username in empty_inboxes:
+            del self.inboxes[username]
+            self.memory_used -= INBOX_OVERHEAD_BYTES
+
+    def spill(self, inbox):
+        """
+        Move the messages in the ring buffer of an inbox to the end of the current segment file
+        """
+        if self.segments is None:
+            if self.spill_directory is None:
+                self.spill_directory = tempfile.mkdtemp(prefix="chat-inbox-")
+                self.temporary_directory = True
+            self.segments = SegmentFiles(self.spill_directory, self.segment_size)
+        count = inbox.memory_count()
+        with memoryview(inbox.data) as data:
+            payload = data[inbox.start_offset():]
+            segment_id, offset = self.segments.append(payload)
+            length = len(payload)
+            payload.release()
+        inbox.spilled.append((segment_id, offset, length, count))
+        inbox.spilled_count += count
+        self.memory_used -= length
+        inbox.clear_memory()
+
+    def statistics(self):
+        memory_messages = 0
+        spilled_messages = 0
+        for inbox in self.inboxes.values():
+            memory_messages += inbox.memory_count()
+            spilled_messages += inbox.spilled_count
+        return {
+            "inboxes": len(self.inboxes),
+            "messages_in_memory": memory_messages,
+            "messages_spilled": spilled_messages,
+            "messages_dropped": self.dropped_messages,
+            "memory_bytes": self.memory_used,
+            "disk_bytes": self.segments.bytes_on_disk if self.segments is not None else 0,
+        }
+
+    def close(self):
+        """
+        Delete the segment files
+        """
+        if self.segments is not None:
+            self.segments.close()
+            self.segments = None
+        if self.temporary_directory:
+            os.rmdir(self.spill_directory)
+            self.spill_directory = None
+            self.temporary_directory = False
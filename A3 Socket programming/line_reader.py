@@ -0,0 +1,97 @@
+# Buffered reading of newline-terminated text lines from a TCP socket.
+# Used by the chat client instead of reading the socket one byte at a time.
+
+# Size of the receive buffer that is allocated for every connection
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+
+class LineReader:
+    """
+    Reads text lines from a socket using large reads into a preallocated buffer.
+    One reader must be created per connection: bytes received after the end of a line are kept in the buffer
+    and returned by the next call.
+    """
+
+    def __init__(self, sock, buffer_size=DEFAULT_BUFFER_SIZE, byte_counter=None):
+        """
+        :param sock: The connected socket to read from
+        :param buffer_size: Initial size of the receive buffer, in bytes. The buffer grows if a single line is longer
+        :param byte_counter: metrics.Counter increased with the number of bytes received, or None
+        """
+        self.sock = sock
+        self.byte_counter = byte_counter
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        # Unread data is stored in buffer[start:end]
+        self.start = 0
+        self.end = 0
+
+    def pending_bytes(self):
+        """
+        :return: Number of received bytes that have not been returned as a line yet
+        """
+        return self.end - self.start
+
+    def has_line(self):
+        """
+        :return: True when a complete line is already in the buffer, so read_line() will not touch the socket
+        """
+        return self.buffer.find(b"\n", self.start, self.end) >= 0
+
+    def read_line(self):
+        """
+        Read one line of text, blocking until the whole line has been received.
+        :return: The line as a string, without the trailing "\n" or "\r\n"
+        :raise ConnectionError: When the server closes the connection before a whole line is received
+        """
+        # Bytes before scan_from are already known not to contain a newline
+        scan_from = self.start
+        while True:
+            newline_position = self.buffer.find(b"\n", scan_from, self.end)
+            if newline_position >= 0:
+                line_end = newline_position
+                if line_end > self.start and self.buffer[line_end - 1] == 13:  # 13 is "\r"
+                    line_end -= 1
+                # Decoding a complete line means that UTF-8 sequences split between two reads are already joined
+                line = str(self.view[self.start:line_end], "utf-8", "replace")
+                self.start = newline_position + 1
+                if self.start == self.end:
+                    # Everything consumed, next read can start at the beginning of the buffer again
+                    self.start = 0
+                    self.end = 0
+                return line
+            # The buffer may be compacted while receiving, so remember the scanned length instead of the position
+            scanned_length = self.end - self.start
+            self._receive_more()
+            scan_from = self.start + scanned_length
+
+    def _receive_more(self):
+        """
+        Receive more data from the socket, making room in the buffer first if needed
+        """
+        if self.end == len(self.buffer):
+            self._make_room()
+        received = self.sock.recv_into(self.view[self.end:])
+        if received == 0:
+            raise ConnectionError("Connection closed by the remote side")
+        self.end += received
+        if self.byte_counter is not None:
+            self.byte_counter.inc(received)
+
+    def _make_room(self):
+        """
+        Move the unread bytes to the start of the buffer, or grow the buffer when it is full of unread data
+        """
+        unread = self.end - self.start
+        if self.start > 0:
+            self.buffer[0:unread] = self.view[self.start:self.end]
+        else:
+            # One line is longer than the whole buffer. A bytearray can not be resized while a memoryview
+            # refers to it, so a new, bigger buffer is allocated
+            new_buffer = bytearray(len(self.buffer) * 2)
+            new_buffer[0:unread] = self.view[self.start:self.end]
+            self.view.release()
+            self.buffer = new_buffer
+            self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = unread
@@ -0,0 +1,246 @@
+# Performance metrics for the clients and the servers: counters, gauges and latency histograms.
+#
+# Recording a value takes a lock and a few additions, so it can be done for every request. A histogram has fixed
+# buckets, the values themselves are not kept, so the memory used does not grow with the number of requests.
+# The metrics of a registry can be written as JSON or in the Prometheus text format, on request (for example on the
+# SIGUSR1 signal) or every few seconds.
+
+import json
+import signal
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds in seconds of the latency histogram buckets, from 10 microseconds to about 10 seconds, doubling
+DEFAULT_LATENCY_BUCKETS = [0.00001 * 2 ** i for i in range(21)]
+METRICS_FORMATS = ["json", "prometheus"]
+
+
+class Counter:
+    """
+    A number that only grows, for example bytes sent. Optionally split by the value of one label
+    """
+    kind = "counter"
+
+    def __init__(self, name, help_text, label_name=None):
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self.lock = threading.Lock()
+        # label value (None when there is no label) -> number
+        self.values = {}
+
+    def inc(self, amount=1, label=None):
+        with self.lock:
+            self.values[label] = self.values.get(label, 0) + amount
+
+    def value(self, label=None):
+        return self.values.get(label, 0)
+
+    def as_dict(self):
+        with self.lock:
+            return dict(self.values)
+
+    def samples(self):
+        """
+        :return: List of (name suffix, labels dictionary, value) for the Prometheus format
+        """
+        with self.lock:
+            return [("", self.labels(label), value) for label, value in self.values.items()]
+
+    def labels(self, label):
+        return {} if label is None else {self.label_name: label}
+
+
+class Gauge(Counter):
+    """
+    A number that goes up and down, for example the number of open connections
+    """
+    kind = "gauge"
+
+    def dec(self, amount=1, label=None):
+        self.inc(-amount, label)
+
+    def set(self, value, label=None):
+        with self.lock:
+            self.values[label] = value
+
+
+class Histogram(Counter):
+    """
+    Counts how many values fell in each bucket, for example the latency of every command
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_name=None, buckets=DEFAULT_LATENCY_BUCKETS):
+        Counter.__init__(self, name, help_text, label_name)
+        self.buckets = buckets
+        # label value -> [count in every bucket (the last one for values above all buckets), count, sum]
+        self.values = {}
+
+    def observe(self, value, label=None, count=1):
+        """
+        :param count: Record the value this many times, for example the average latency of a batch of requests
+        """
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            data = self.values.get(label)
+            if data is None:
+                data = self.values[label] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            data[0][index] += count
+            data[1] += count
+            data[2] += value * count
+
+    def percentile(self, bucket_counts, count, percent):
+        """
+        :return: Upper bound of the bucket the percentile falls in, an estimate that is at most twice too high
+        """
+        wanted = count * percent / 100
+        seen = 0
+        for index, bucket_count in enumerate(bucket_counts):
+            seen += bucket_count
+            if seen >= wanted and bucket_count:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return 0.0
+
+    def as_dict(self):
+        result = {}
+        with self.lock:
+            for label, (bucket_counts, count, total) in self.values.items():
+                result[label] = {
+                    "count": count,
+                    "sum": total,
+                    "mean": total / count if count else 0.0,
+                    "p50": self.percentile(bucket_counts, count, 50),
+                    "p90": self.percentile(bucket_counts, count, 90),
+                    "p99": self.percentile(bucket_counts, count, 99),
+                }
+        return result
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for label, (bucket_counts, count, total) in self.values.items():
+                cumulative = 0
+                for index, bucket_count in enumerate(bucket_counts):
+                    cumulative += bucket_count
+                    bound = "%g" % self.buckets[index] if index < len(self.buckets) else "+Inf"
+                    samples.append(("_bucket", dict(self.labels(label), le=bound), cumulative))
+                samples.append(("_count", self.labels(label), count))
+                samples.append(("_sum", self.labels(label), total))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    All the metrics of one program, by name
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.started_at = time.time()
+
+    def get_or_create(self, metric_class, name, help_text, label_name):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = metric_class(name, help_text, label_name)
+            return metric
+
+    def counter(self, name, help_text, label_name=None):
+        return self.get_or_create(Counter, name, help_text, label_name)
+
+    def gauge(self, name, help_text, label_name=None):
+        return self.get_or_create(Gauge, name, help_text, label_name)
+
+    def histogram(self, name, help_text, label_name=None):
+        return self.get_or_create(Histogram, name, help_text, label_name)
+
+    def as_dict(self):
+        """
+        :return: Dictionary metric name -> {label value -> value}, the label value is "" for metrics without a label
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        result = {"uptime_seconds": time.time() - self.started_at}
+        for metric in metrics:
+            result[metric.name] = {("" if label is None else label): value
+                                   for label, value in metric.as_dict().items()}
+        return result
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        """
+        :return: The metrics in the Prometheus text exposition format
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append("# HELP %s %s" % (metric.name, metric.help_text))
+            lines.append("# TYPE %s %s" % (metric.name, metric.kind))
+            for suffix, labels, value in metric.samples():
+                label_text = ",".join('%s="%s"' % (name, str(label).replace('"', '\\"'))
+                                      for name, label in labels.items())
+                lines.append("%s%s%s %s" % (metric.name, suffix, "{%s}" % label_text if label_text else "",
+                                            repr(float(value)) if isinstance(value, float) else value))
+        return "\n".join(lines) + "\n"
+
+    def dump(self, metrics_format="json"):
+        """
+        :param metrics_format: "json" or "prometheus"
+        """
+        if metrics_format == "prometheus":
+            return self.to_prometheus()
+        return self.to_json() + "\n"
+
+
+# The registry used by the programs unless they are given another one
+default_registry = MetricsRegistry()
+
+
+def write_metrics(registry, metrics_format, path=None):
+    """
+    Write the metrics to a file, replacing what was in it, or to stdout when path is None
+    """
+    text = registry.dump(metrics_format)
+    if path is None:
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        return
+    with open(path, "w") as metrics_file:
+        metrics_file.write(text)
+
+
+def start_interval_reporter(registry, interval, metrics_format="json", path=None):
+    """
+    Write the metrics every interval seconds from a background thread
+    """
+    def report():
+        while True:
+            time.sleep(interval)
+            write_metrics(registry, metrics_format, path)
+
+    reporter = threading.Thread(target=report, name="metrics-reporter", daemon=True)
+    reporter.start()
+    return reporter
+
+
+def install_dump_signal(registry, metrics_format="json", path=None):
+    """
+    Write the metrics when the process receives SIGUSR1, for example with: kill -USR1 <pid>
+    Must be called from the main thread. Does nothing on systems without SIGUSR1
+    """
+    if not hasattr(signal, "SIGUSR1"):
+        return
+
+    def dump_metrics(signal_number, frame):
+        # Written from a new thread: the signal may arrive while the main thread is in the middle of a print, and
+        # writing to stdout again from the same thread would fail
+        threading.Thread(target=write_metrics, args=(registry, metrics_format, path), daemon=True).start()
+
+    signal.signal(signal.SIGUSR1, dump_metrics)
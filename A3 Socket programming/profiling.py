@@ -0,0 +1,264 @@
+# Opt-in profiling for the warm-up server and the chat client, to find out where the time and the memory go.
+#  - Time: a fraction of the connections (server) or of the menu actions (client) is sampled and runs under cProfile.
+#    Every sampled run has its own profile, and the profiles are added up per label, for example "connection"
+#  - Memory: tracemalloc traces the allocations, and a snapshot is taken every few seconds. The report shows how the
+#    traced memory per open connection changed over time, and the lines of code that allocated the growth
+# The reports are written to files when the program stops, and when it receives SIGUSR2.
+#
+# Profiling is enabled with the environment variables below, or with the --profile-... options of the server. When
+# it is disabled there is no profiler at all: a program only checks once per connection (or action) that it is None.
+# A sampled connection is slower, cProfile adds a cost to every function call. Tracing the memory slows down every
+# allocation of the process, and a snapshot holds the interpreter for a few milliseconds per thousand allocations.
+
+import cProfile
+import io
+import os
+import pstats
+import random
+import re
+import signal
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+# Fraction of the connections or actions profiled with cProfile, for example 0.01
+PROFILE_SAMPLE_VARIABLE = "A3_PROFILE_SAMPLE"
+# Seconds between two tracemalloc snapshots
+PROFILE_MEMORY_VARIABLE = "A3_PROFILE_MEMORY"
+# Start of the names of the report files
+PROFILE_OUTPUT_VARIABLE = "A3_PROFILE_OUTPUT"
+DEFAULT_OUTPUT = "profile"
+# Functions listed in the text report for every label, by cumulative time
+REPORT_FUNCTIONS = 30
+# Lines of code listed in the text report, by memory allocated since profiling started
+REPORT_ALLOCATIONS = 20
+# Memory snapshots kept for the report, the oldest ones are dropped
+MEMORY_HISTORY_SIZE = 1000
+
+
+def settings_from_environment():
+    """
+    :return: (sample fraction, seconds between memory snapshots, output prefix), 0 for what is not enabled
+    :raise ValueError: When a variable is not a number
+    """
+    sample_fraction = float(os.environ.get(PROFILE_SAMPLE_VARIABLE) or 0)
+    memory_interval = float(os.environ.get(PROFILE_MEMORY_VARIABLE) or 0)
+    output = os.environ.get(PROFILE_OUTPUT_VARIABLE) or DEFAULT_OUTPUT
+    return sample_fraction, memory_interval, output
+
+
+class ProfiledRun:
+    """
+    The cProfile of one sampled connection or action. Used by one thread at a time
+    """
+
+    def __init__(self, profiler, label):
+        self.profiler = profiler
+        self.label = label
+        self.profile = cProfile.Profile()
+        # Number of calls that were profiled
+        self.calls = 0
+
+    def call(self, function, *args):
+        """
+        :return: What function returns
+        """
+        try:
+            self.profile.enable()
+        except ValueError:
+            # Python 3.12 and later: only one profiler may be active at a time, the call is not profiled
+            return function(*args)
+        self.calls += 1
+        try:
+            return function(*args)
+        finally:
+            self.profile.disable()
+
+    def wrap(self, function):
+        """
+        :return: A function that calls function under the profile of this run
+        """
+        def profiled(*args):
+            return self.call(function, *args)
+        return profiled
+
+    def finish(self):
+        """
+        Add the profile to the statistics of its label. Called once, when the connection or the action is done
+        """
+        if self.calls:
+            self.profiler.add_profile(self.label, self.profile)
+
+
+class Profiler:
+    """
+    The profiling of one process. May be used from several threads
+    """
+
+    def __init__(self, name, sample_fraction=0.0, memory_interval=0.0, output=DEFAULT_OUTPUT, connection_count=None):
+        """
+        :param name: What is profiled, shown in the report
+        :param sample_fraction: Fraction of the runs profiled with cProfile, 0 for none
+        :param memory_interval: Seconds between two tracemalloc snapshots, 0 to not trace the memory
+        :param output: Start of the names of the report files: <output>.txt, and <output>.<label>.pstats for every
+            label, which can be read with the pstats module or tools like snakeviz
+        :param connection_count: Function returning the number of open connections, to compute the memory per
+            connection. None when the process has no connections to count
+        """
+        self.name = name
+        self.sample_fraction = sample_fraction
+        self.memory_interval = memory_interval
+        self.output = output
+        self.connection_count = connection_count
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        # label -> pstats.Stats of all the sampled runs together
+        self.stats = {}
+        # label -> [runs, sampled runs]
+        self.run_counts = {}
+        # (seconds since start, traced bytes, open connections or None), one entry per snapshot
+        self.memory_history = deque(maxlen=MEMORY_HISTORY_SIZE)
+        self.first_snapshot = None
+        self.last_snapshot = None
+        self.stopped = threading.Event()
+        if memory_interval > 0:
+            tracemalloc.start()
+            self.take_snapshot()
+            threading.Thread(target=self.run_snapshots, name="memory-profiler", daemon=True).start()
+
+    def sample(self, label):
+        """
+        Decide whether a new run (a connection or an action) is profiled
+        :return: ProfiledRun when it is, None otherwise
+        """
+        sampled = random.random() < self.sample_fraction
+        with self.lock:
+            counts = self.run_counts.setdefault(label, [0, 0])
+            counts[0] += 1
+            counts[1] += sampled
+        return ProfiledRun(self, label) if sampled else None
+
+    def add_profile(self, label, profile):
+        with self.lock:
+            stats = self.stats.get(label)
+            if stats is None:
+                self.stats[label] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+
+    def take_snapshot(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ])
+        traced = sum(statistic.size for statistic in snapshot.statistics("filename"))
+        connections = self.connection_count() if self.connection_count is not None else None
+        with self.lock:
+            if self.first_snapshot is None:
+                self.first_snapshot = snapshot
+            self.last_snapshot = snapshot
+            self.memory_history.append((time.time() - self.started_at, traced, connections))
+
+    def run_snapshots(self):
+        while not self.stopped.wait(self.memory_interval):
+            self.take_snapshot()
+
+    def report(self):
+        """
+        :return: The text report
+        """
+        lines = ["Profile of the %s, process %i, %.1f s" % (self.name, os.getpid(), time.time() - self.started_at)]
+        with self.lock:
+            for label, (runs, sampled) in sorted(self.run_counts.items()):
+                lines.append("")
+                lines.append("=== %s: %i of %i profiled ===" % (label, sampled, runs))
+                stats = self.stats.get(label)
+                if stats is not None:
+                    text = io.StringIO()
+                    stats.stream = text
+                    stats.sort_stats("cumulative").print_stats(REPORT_FUNCTIONS)
+                    lines.append(text.getvalue().strip("\n"))
+            if self.memory_history:
+                lines.extend(self.memory_report())
+        return "\n".join(lines) + "\n"
+
+    def memory_report(self):
+        """
+        Called with the lock held
+        :return: The lines of the memory part of the report
+        """
+        lines = ["", "=== Memory ===", "%10s %12s %12s %16s" % ("seconds", "traced KiB", "connections",
+                                                                 "growth KiB/conn")]
+        first_traced = self.memory_history[0][1]
+        for elapsed, traced, connections in self.memory_history:
+            per_connection = "%.1f" % ((traced - first_traced) / 1024 / connections) if connections else "-"
+            lines.append("%10.1f %12.1f %12s %16s" % (elapsed, traced / 1024,
+                                                      "-" if connections is None else connections, per_connection))
+        lines.append("")
+        lines.append("Allocated since the first snapshot, by line:")
+        for difference in self.last_snapshot.compare_to(self.first_snapshot, "lineno")[:REPORT_ALLOCATIONS]:
+            lines.append("  %s" % difference)
+        return lines
+
+    def report_path(self, label):
+        return "%s.%s.pstats" % (self.output, re.sub(r"\W+", "_", label.lower()).strip("_"))
+
+    def write_reports(self):
+        """
+        Write <output>.txt and the pstats files, replacing the previous ones
+        :return: The names of the files written
+        """
+        if self.memory_interval > 0 and not self.stopped.is_set():
+            self.take_snapshot()
+        paths = [self.output + ".txt"]
+        with open(paths[0], "w") as report_file:
+            report_file.write(self.report())
+        with self.lock:
+            for label, stats in self.stats.items():
+                paths.append(self.report_path(label))
+                stats.dump_stats(paths[-1])
+        return paths
+
+    def install_report_signal(self):
+        """
+        Write the reports when the process receives SIGUSR2, for example with: kill -USR2 <pid>
+        Must be called from the main thread. Does nothing on systems without SIGUSR2
+        """
+        if not hasattr(signal, "SIGUSR2"):
+            return
+
+        def dump_reports(signal_number, frame):
+            # From a new thread, like the metrics: the signal may arrive while the main thread holds the lock
+            threading.Thread(target=self.write_reports, daemon=True).start()
+
+        signal.signal(signal.SIGUSR2, dump_reports)
+
+    def close(self):
+        """
+        Write the reports and stop tracing the memory
+        :return: The names of the files written
+        """
+        paths = self.write_reports()
+        self.stopped.set()
+        if self.memory_interval > 0:
+            tracemalloc.stop()
+        return paths
+
+
+def create_profiler(name, sample_fraction, memory_interval, output=DEFAULT_OUTPUT, connection_count=None):
+    """
+    :return: Profiler, see its constructor, or None when neither cProfile sampling nor memory tracing is enabled
+    """
+    if sample_fraction <= 0 and memory_interval <= 0:
+        return None
+    return Profiler(name, sample_fraction, memory_interval, output, connection_count)
+
+
+def profiler_from_environment(name, connection_count=None):
+    """
+    :return: Profiler set up with the environment variables, or None when they do not enable profiling
+    """
+    sample_fraction, memory_interval, output = settings_from_environment()
+    return create_profiler(name, sample_fraction, memory_interval, output, connection_count)
@@ -0,0 +1,42 @@
+# Helpers shared by the servers, the clients and the benchmarks of assignment A3: importing the scripts whose file
+# names contain spaces, and raising the limit of open files for programs that hold many connections.
+
+import importlib.util
+import os
+
+# The directory of the assignment scripts
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def script_path(file_name):
+    """
+    :return: The full path of one of the assignment scripts, for example script_path("A3 server warmup.py")
+    """
+    return os.path.join(SCRIPT_DIRECTORY, file_name)
+
+
+def load_script(name, path):
+    """
+    Import one of the assignment scripts. Their file names contain spaces, so a normal import does not work
+    :param name: Name of the module
+    :param path: Path of the script, or its file name in SCRIPT_DIRECTORY
+    """
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPT_DIRECTORY, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def raise_open_files_limit():
+    """
+    Every connection uses one file descriptor. Raise the soft limit of open files to the hard limit,
+    so that the program can hold as many connections as the system allows
+    :return: The new limit, or None if it is not possible to change it on this system
+    """
+    try:
+        import resource
+        soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard_limit, hard_limit))
+        return hard_limit
+    except (ImportError, ValueError, OSError):
+        return None
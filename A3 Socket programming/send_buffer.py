@@ -0,0 +1,110 @@
+# Buffered writing of commands to a TCP socket.
+# Used by the chat client: commands are copied into one preallocated buffer and sent with few system calls, instead of
+# building, encoding and sending every command on its own.
+
+import time
+
+# Size of the send buffer that is allocated for every connection. The buffer is sent when it is full
+DEFAULT_BUFFER_SIZE = 64 * 1024
+# Seconds buffered data may wait before a write sends it, even when the buffer is not full
+DEFAULT_FLUSH_DELAY = 0.002
+
+
+class SendBuffer:
+    """
+    Collects data for a socket in a preallocated buffer and sends it with as few calls as possible.
+    Data is sent when the buffer is full, when the oldest buffered data is older than flush_delay at the time of a
+    write, or when flush() is called. Nothing is sent in the background, so flush() must be called before waiting for
+    a reply. One buffer must be created per connection
+    """
+
+    def __init__(self, sock, buffer_size=DEFAULT_BUFFER_SIZE, flush_delay=DEFAULT_FLUSH_DELAY, byte_counter=None):
+        """
+        :param sock: The connected socket to write to
+        :param buffer_size: Size of the buffer, in bytes. Writes larger than the buffer are sent without copying them
+        :param flush_delay: Seconds, see the class description. None sends only when the buffer is full or flushed
+        :param byte_counter: metrics.Counter increased with the number of bytes sent, or None
+        """
+        self.sock = sock
+        self.byte_counter = byte_counter
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        # Data waiting to be sent is stored in buffer[0:end]
+        self.end = 0
+        self.flush_delay = flush_delay
+        # time.monotonic() of the first write after the last flush
+        self.first_write_time = None
+        # Number of send calls made, for comparing the number of system calls
+        self.send_calls = 0
+
+    def pending_bytes(self):
+        """
+        :return: Number of bytes written to the buffer that have not been sent yet
+        """
+        return self.end
+
+    def write_command(self, command, arguments=None):
+        """
+        Add one command line, see write()
+        :param arguments: The arguments as a string, or None when the command has no arguments
+        """
+        if arguments is None:
+            self.write((command + "\n").encode())
+        else:
+            self.write(("%s %s\n" % (command, arguments)).encode())
+
+    def write(self, data):
+        """
+        Add data to the buffer. The buffer is sent when it gets full, or when the flush delay has passed
+        :param data: bytes-like object
+        :raise IOError: When sending failed. The buffered data is then discarded, the connection is not usable anymore
+        """
+        length = len(data)
+        if self.end + length > len(self.buffer):
+            # Does not fit: the buffered data and the new data are sent together, with one call when possible
+            self._send([self.view[:self.end], data])
+            return
+        self.buffer[self.end:self.end + length] = data
+        self.end += length
+        if self.first_write_time is None:
+            self.first_write_time = time.monotonic()
+        if self.end == len(self.buffer) or (self.flush_delay is not None
+                                            and time.monotonic() - self.first_write_time >= self.flush_delay):
+            self.flush()
+
+    def flush(self):
+        """
+        Send everything in the buffer
+        :raise IOError: When sending failed, see write()
+        """
+        if self.end:
+            self._send([self.view[:self.end]])
+
+    def _send(self, chunks):
+        """
+        Send all the chunks. socket.send may send only the first part of the data, so it is called again with the rest
+        until everything is sent. Several chunks are sent with one sendmsg call (scatter/gather) where it exists
+        """
+        chunks = [memoryview(chunk).cast("B") for chunk in chunks if len(chunk)]
+        try:
+            while chunks:
+                if len(chunks) == 1 or not hasattr(self.sock, "sendmsg"):
+                    sent = self.sock.send(chunks[0])
+                else:
+                    sent = self.sock.sendmsg(chunks)
+                self.send_calls += 1
+                if self.byte_counter is not None:
+                    self.byte_counter.inc(sent)
+                # Remove the sent bytes from the front of the chunk list
+                while sent:
+                    if sent >= len(chunks[0]):
+                        sent -= len(chunks[0])
+                        chunks.pop(0).release()
+                    else:
+                        chunks[0] = chunks[0][sent:]
+                        sent = 0
+        finally:
+            for chunk in chunks:
+                chunk.release()
+            self.end = 0
+            self.first_write_time = None
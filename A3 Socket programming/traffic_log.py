@@ -0,0 +1,172 @@
+# Recording of the traffic of client sessions, so that it can be replayed later as a benchmark with
+# "A3 benchmark replay traffic.py". The chat client and the warm-up server can both record.
+#
+# The log is a binary file that is only ever appended to. It starts with LOG_MAGIC, followed by records:
+#   - time.time() of the event, 8-byte float
+#   - session number, 4-byte unsigned integer
+#   - kind of the record, 1 byte, see REQUEST_LINE and the other kinds below
+#   - length of the data, 4-byte unsigned integer, followed by the data
+# All numbers are little-endian. Lines are stored without their newline, frames (see binary_protocol.py) whole, with
+# their length. Requests are what the client sent and responses what the server sent, on whichever side the recording
+# was made.
+#
+# Every recorder appends a RECORDING_STARTED record first, with a JSON description of where the traffic comes from.
+# Its "side" is "client" or "server": the times recorded by a server do not include the network.
+# Session numbers start at 1 again in every recording, so a session is identified by the recording and its number.
+
+import json
+import struct
+import threading
+import time
+from collections import namedtuple
+
+LOG_MAGIC = b"A3TRAFFIC1\n"
+RECORD_HEADER = struct.Struct("<dIBI")
+# The kinds of records. The kinds of responses are odd
+REQUEST_LINE = 0
+RESPONSE_LINE = 1
+REQUEST_FRAME = 2
+RESPONSE_FRAME = 3
+SESSION_OPENED = 4
+SESSION_CLOSED = 5
+RECORDING_STARTED = 6
+# Records are collected in a buffer of this size before they are written to the file
+WRITE_BUFFER_SIZE = 64 * 1024
+
+# session is (number of the recording in the log, starting at 1; session number)
+Record = namedtuple("Record", ["time", "session", "kind", "data"])
+
+
+def is_request(kind):
+    return kind == REQUEST_LINE or kind == REQUEST_FRAME
+
+
+def is_response(kind):
+    return kind == RESPONSE_LINE or kind == RESPONSE_FRAME
+
+
+class TrafficRecorder:
+    """
+    Appends the traffic of many sessions to one log file. It may be used from several threads.
+    The records are buffered: they are written to the file when a session is closed, when the buffer is full and
+    by close()
+    """
+
+    def __init__(self, path, source, **details):
+        """
+        :param path: The log file. When it exists, the new recording is added at its end
+        :param source: What is recorded, for example "chat client"
+        :param details: Other facts stored in the description of the recording, for example the port of the server
+        """
+        self.path = path
+        self.file = open(path, "ab", buffering=WRITE_BUFFER_SIZE)
+        self.lock = threading.Lock()
+        self.last_session = 0
+        if self.file.tell() == 0:
+            self.file.write(LOG_MAGIC)
+        description = dict(details, source=source)
+        self.record(0, RECORDING_STARTED, json.dumps(description).encode())
+
+    def open_session(self):
+        """
+        :return: The number of the new session
+        """
+        with self.lock:
+            self.last_session += 1
+            session = self.last_session
+        self.record(session, SESSION_OPENED)
+        return session
+
+    def close_session(self, session):
+        self.record(session, SESSION_CLOSED)
+        with self.lock:
+            if not self.file.closed:
+                self.file.flush()
+
+    def record(self, session, kind, data=b""):
+        """
+        :param data: bytes-like object, a line without its newline or a whole frame. Records of sessions that are
+            still running when the recorder is closed are left out
+        """
+        header = RECORD_HEADER.pack(time.time(), session, kind, len(data))
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(header)
+                self.file.write(data)
+
+    def record_many(self, session, records, record_time=None):
+        """
+        Record several events of a session that happened at the same time, with one write
+        :param records: List of (kind, data)
+        :param record_time: time.time() of the events, now when None
+        """
+        if record_time is None:
+            record_time = time.time()
+        pack = RECORD_HEADER.pack
+        chunks = []
+        for kind, data in records:
+            chunks.append(pack(record_time, session, kind, len(data)))
+            chunks.append(data)
+        data = b"".join(chunks)
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(data)
+
+    def record_line(self, session, kind, line):
+        """
+        :param line: A line of text without its newline
+        """
+        self.record(session, kind, line.encode())
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def open_recorder(path, source, **details):
+    """
+    :return: TrafficRecorder writing to path, or None when path is None
+    """
+    if path is None:
+        return None
+    return TrafficRecorder(path, source, **details)
+
+
+def read_log(path):
+    """
+    Generator: the records of a log, in the order they were written
+    :return: Record for every request, response, opened and closed session, and the RECORDING_STARTED records with
+        the session number 0
+    :raise ValueError: When the file is not a traffic log
+    """
+    with open(path, "rb") as log_file:
+        if log_file.read(len(LOG_MAGIC)) != LOG_MAGIC:
+            raise ValueError("%s is not a traffic log" % path)
+        recording = 0
+        while True:
+            header = log_file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                # The end of the log, or a record cut off when the recording process was killed
+                return
+            record_time, session, kind, length = RECORD_HEADER.unpack(header)
+            data = log_file.read(length)
+            if len(data) < length:
+                return
+            if kind == RECORDING_STARTED:
+                recording += 1
+            yield Record(record_time, (recording, session), kind, data)
+
+
+def read_sessions(path):
+    """
+    :return: (list of the descriptions of the recordings, dictionary session -> list of its Record, in the order
+        the sessions were opened)
+    """
+    descriptions = []
+    sessions = {}
+    for record in read_log(path):
+        if record.kind == RECORDING_STARTED:
+            descriptions.append(json.loads(record.data))
+        else:
+            sessions.setdefault(record.session, []).append(record)
+    return descriptions, sessions